@@ -0,0 +1,273 @@
+"""
+Estimate the shift that co-registers one GeoTIFF onto another, for movetif.
+
+Instead of choosing --north/--east by eye (e.g. mosaic_x against
+mosaic_over), the shift is measured by FFT phase correlation: first on the
+whole overlap, resampled from the cached pyramids of both rasters to about
+COARSE_SIZE pixels, then at the finer of the two resolutions inside a single
+REFINE_SIZE window of the overlap, starting from the coarse estimate.
+Sub-pixel peaks come from a parabola through the correlation maximum.
+Full-resolution windows are read from the GeoTIFFs through rasterio, with
+bands picked by colour interpretation (see rasterbands).
+
+The result is in meters, as the --north/--east arguments movetif needs to
+move the moving raster onto the reference. Note that movetif translates
+the origin by -north / e rows, which for the usual north-up rasters (e < 0)
+lowers the northing: a raster lying too far north gets a positive --north.
+
+python3 align.py --reference 3/mosaic_over.tif --moving 3/mosaic_x2.tif
+python3 align.py --reference 3/mosaic_over.tif --moving 3/mosaic_x2.tif --apply --in-place
+python3 align.py --batch pairs.csv --offsets offsets.csv --jobs 8
+python3 movetif.py --batch offsets.csv
+
+pairs.csv columns: reference,moving[,output] (paths relative to the CSV).
+"""
+import argparse
+import csv
+import math
+import os
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import Affine, from_origin
+from rasterio.warp import reproject
+from decodecache import add_cache_arguments, cache_from_args
+from findcenters import box_sums, integral, luminance
+from instrument import add_report_argument, phase, write_report
+from merge import footprint
+from movetif import move_geotiff
+from pyramid import Pyramid
+from scheduler import image_pixels, print_summary, run_tasks
+
+# Side, in pixels, of the overlap as resampled for the coarse correlation
+COARSE_SIZE = 512
+# Side, in full-resolution pixels, of the refinement window
+REFINE_SIZE = 1024
+# Correlation peaks below this are reported as unreliable
+MIN_CONFIDENCE = 0.05
+
+
+def sample(pyramid, transform, crs, left, top, res, shape):
+    """
+    Gray level and validity of a raster resampled onto the north-up grid with
+    top-left corner (left, top), pixel size res and the given shape.
+
+    The coarsest pyramid level that is still at least as fine as res is
+    read, and only over the region under the grid.
+    """
+    level = 0
+    source_res = math.hypot(transform.a, transform.d)
+    while level + 1 < pyramid.n_levels and source_res * 2 ** (level + 1) <= res:
+        level += 1
+    level_transform = transform * Affine.scale(2 ** level)
+
+    # Pixel window of the grid at that level, with a margin for the resampling kernel
+    inverse = ~level_transform
+    right, bottom = left + shape[1] * res, top - shape[0] * res
+    corners = [inverse * (x, y) for x in (left, right) for y in (top, bottom)]
+    cols, rows = zip(*corners)
+    row_off, col_off = int(math.floor(min(rows))) - 2, int(math.floor(min(cols))) - 2
+    rows = int(math.ceil(max(rows))) + 2 - row_off
+    cols = int(math.ceil(max(cols))) + 2 - col_off
+    rgba, row_off, col_off = pyramid.read(level, row_off, rows, col_off, cols)
+
+    resampled = np.zeros((4,) + shape, dtype=np.uint8)
+    if rgba.size:
+        reproject(
+            np.ascontiguousarray(np.moveaxis(rgba, -1, 0)), resampled,
+            src_transform=level_transform * Affine.translation(col_off, row_off), src_crs=crs,
+            dst_transform=from_origin(left, top, res, res), dst_crs=crs, resampling=Resampling.bilinear,
+        )
+    rgba = np.moveaxis(resampled, 0, -1)
+    gray, _ = luminance(rgba)
+    # Pixels blended with transparent neighbours would add false edges
+    return gray, rgba[..., 3] == 255
+
+
+def phase_correlate(reference, valid_reference, moving, valid_moving):
+    """
+    Shift (rows, cols) of moving's content relative to reference's, with
+    sub-pixel precision, and the height of the correlation peak (1 for a
+    perfect match). Invalid pixels are set to the mean and both images are
+    tapered with a Hann window to suppress edge effects.
+    """
+    taper = np.outer(np.hanning(reference.shape[0]), np.hanning(reference.shape[1]))
+
+    def prepare(gray, valid):
+        mean = gray[valid].mean() if valid.any() else 0.0
+        return np.where(valid, gray - mean, 0.0) * taper
+
+    cross = np.conj(np.fft.rfft2(prepare(reference, valid_reference)))
+    cross *= np.fft.rfft2(prepare(moving, valid_moving))
+    cross /= np.maximum(np.abs(cross), 1e-12)
+    correlation = np.fft.irfft2(cross, s=reference.shape)
+
+    peak = np.unravel_index(np.argmax(correlation), correlation.shape)
+    shift = []
+    for axis, size in enumerate(correlation.shape):
+        neighbours = []
+        for step in (-1, 0, 1):
+            index = list(peak)
+            index[axis] = (index[axis] + step) % size
+            neighbours.append(correlation[tuple(index)])
+        before, center, after = neighbours
+        denominator = before - 2 * center + after
+        offset = 0.5 * (before - after) / denominator if denominator < 0 else 0.0
+        position = peak[axis] + offset
+        # Peaks past the middle are negative shifts that wrapped around
+        shift.append(position - size if position > size / 2 else position)
+    return shift[0], shift[1], float(correlation[peak])
+
+
+def align_pair(reference_path, moving_path, cache=None):
+    """
+    movetif shift in meters, {"north", "east"}, that moves moving_path onto
+    reference_path, with the confidence of the coarse and fine correlations.
+    """
+    with rasterio.open(reference_path) as ref, rasterio.open(moving_path) as mov:
+        if ref.crs != mov.crs:
+            raise ValueError(f"{reference_path} and {moving_path} have different CRS")
+        crs = ref.crs
+        ref_transform, mov_transform = ref.transform, mov.transform
+        ref_left, ref_bottom, ref_right, ref_top = footprint(ref, crs)
+        mov_left, mov_bottom, mov_right, mov_top = footprint(mov, crs)
+    left, right = max(ref_left, mov_left), min(ref_right, mov_right)
+    bottom, top = max(ref_bottom, mov_bottom), min(ref_top, mov_top)
+    if left >= right or bottom >= top:
+        raise ValueError(f"{reference_path} and {moving_path} do not overlap")
+
+    with Pyramid(reference_path, cache=cache) as ref_pyramid, Pyramid(moving_path, cache=cache) as mov_pyramid:
+        # Coarse: the whole overlap at about COARSE_SIZE pixels
+        with phase("coarse"):
+            coarse_res = max(right - left, top - bottom) / COARSE_SIZE
+            shape = (max(1, int((top - bottom) / coarse_res)), max(1, int((right - left) / coarse_res)))
+            ref_gray, ref_valid = sample(ref_pyramid, ref_transform, crs, left, top, coarse_res, shape)
+            mov_gray, mov_valid = sample(mov_pyramid, mov_transform, crs, left, top, coarse_res, shape)
+            rows, cols, coarse_confidence = phase_correlate(ref_gray, ref_valid, mov_gray, mov_valid)
+            dx, dy = cols * coarse_res, -rows * coarse_res
+
+        # Fine: one full-resolution window where the overlap has the most valid pixels
+        with phase("refine"):
+            fine_res = min(
+                math.hypot(ref_transform.a, ref_transform.d), math.hypot(mov_transform.a, mov_transform.d)
+            )
+            size = min(REFINE_SIZE, int((right - left) / fine_res), int((top - bottom) / fine_res))
+            side = min(max(1, int(round(size * fine_res / coarse_res))), *shape)
+            both = (ref_valid & mov_valid).astype(np.float64)
+            counts = box_sums(integral(both), side, 0, (shape[0] - side + 1, shape[1] - side + 1))
+            row, col = np.unravel_index(np.argmax(counts), counts.shape)
+            win_left = left + (col + side / 2) * coarse_res - size * fine_res / 2
+            win_top = top - (row + side / 2) * coarse_res + size * fine_res / 2
+
+            ref_gray, ref_valid = sample(ref_pyramid, ref_transform, crs, win_left, win_top, fine_res, (size, size))
+            # Sample the moving raster where the coarse shift says the same content is
+            mov_gray, mov_valid = sample(
+                mov_pyramid, mov_transform, crs, win_left + dx, win_top + dy, fine_res, (size, size),
+            )
+            rows, cols, fine_confidence = phase_correlate(ref_gray, ref_valid, mov_gray, mov_valid)
+            dx += cols * fine_res
+            dy -= rows * fine_res
+
+    # The moving raster must move by (-dx, -dy); see the module docstring for movetif's north
+    return {
+        "north": dy, "east": -dx,
+        "coarse_confidence": coarse_confidence, "fine_confidence": fine_confidence,
+    }
+
+
+def print_alignment(moving_path, result):
+    print(
+        f"📐 {os.path.basename(moving_path)}: north {result['north']:+.3f} m, east {result['east']:+.3f} m "
+        f"(peaks {result['coarse_confidence']:.2f} / {result['fine_confidence']:.2f})"
+    )
+    if min(result["coarse_confidence"], result["fine_confidence"]) < MIN_CONFIDENCE:
+        print("⚠️  Weak correlation peak; check the overlap before applying this shift")
+
+
+def align_and_move(reference_path, moving_path, output_path=None, apply=False, in_place=False, cache=None):
+    """Align one pair, optionally shifting the moving raster; returns align_pair's result."""
+    result = align_pair(reference_path, moving_path, cache)
+    print_alignment(moving_path, result)
+    if apply:
+        move_geotiff(moving_path, output_path, result["north"], result["east"], in_place=in_place)
+    return result
+
+
+def read_pairs_csv(csv_path):
+    """(reference, moving, output) rows of a pairs CSV, relative to its folder."""
+    base_dir = os.path.dirname(os.path.abspath(csv_path))
+    pairs = []
+    with open(csv_path, newline="") as f:
+        for row in csv.DictReader(f):
+            moving = os.path.join(base_dir, row["moving"].strip())
+            output = (row.get("output") or "").strip()
+            if output:
+                output = os.path.join(base_dir, output)
+            else:
+                base, ext = os.path.splitext(moving)
+                output = f"{base}_moved{ext}"
+            pairs.append((os.path.join(base_dir, row["reference"].strip()), moving, output))
+    return pairs
+
+
+def write_offsets_csv(offsets_path, rows):
+    """Write (input, output, north, east) rows as a movetif --batch CSV."""
+    base_dir = os.path.dirname(os.path.abspath(offsets_path))
+    with open(offsets_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["input", "north", "east", "output"])
+        for input_path, output_path, north, east in rows:
+            writer.writerow([
+                os.path.relpath(input_path, base_dir), f"{north:.4f}", f"{east:.4f}",
+                os.path.relpath(output_path, base_dir),
+            ])
+    print(f"📝 Offsets written to {offsets_path} (apply with movetif.py --batch)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Estimate (and optionally apply) the north/east shift aligning one GeoTIFF to another."
+    )
+    parser.add_argument("--reference", help="GeoTIFF that stays in place (e.g. mosaic_over)")
+    parser.add_argument("--moving", help="GeoTIFF to be shifted onto the reference (e.g. mosaic_x)")
+    parser.add_argument("--batch", help="CSV with columns reference,moving[,output] to align many pairs")
+    parser.add_argument("--offsets", help="Write the shifts as a movetif.py --batch CSV")
+    parser.add_argument("--apply", action="store_true", help="Shift the moving GeoTIFF with movetif")
+    parser.add_argument("--output", help="Shifted copy of --moving (default: <moving>_moved.tif)")
+    parser.add_argument(
+        "--in-place", action="store_true", help="With --apply, update only the moving file's geotransform"
+    )
+    parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes for --batch (default: 1).")
+    add_cache_arguments(parser)
+    add_report_argument(parser)
+    args = parser.parse_args()
+    cache = cache_from_args(args)
+
+    if args.batch:
+        pairs = read_pairs_csv(args.batch)
+    elif args.reference and args.moving:
+        base, ext = os.path.splitext(args.moving)
+        pairs = [(args.reference, args.moving, args.output or f"{base}_moved{ext}")]
+    else:
+        parser.error("--reference and --moving, or --batch, are required")
+
+    tasks = [
+        (moving, image_pixels(moving), (reference, moving, output, args.apply, args.in_place, cache))
+        for reference, moving, output in pairs
+    ]
+    results = run_tasks(tasks, align_and_move, args.jobs)
+    failures = print_summary(results, "pairs")
+
+    if args.offsets:
+        outputs = {moving: output for _, moving, output in pairs}
+        write_offsets_csv(args.offsets, [
+            (moving, outputs[moving], result["north"], result["east"])
+            for moving, result, error in results if error is None
+        ])
+    write_report(args.report, "align", vars(args))
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
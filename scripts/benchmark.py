@@ -0,0 +1,334 @@
+"""
+Benchmark the scripts on synthetic mosaics.
+
+Generates RGBA PNG mosaic folders (mosaic_x / mosaic_over naming variants with
+transparent and black regions) and 4-band uint16 GeoTIFFs at the requested
+sizes, then runs every script's main function on them. Each case runs in a
+fresh process so wall time, pixels/s and peak RSS are measured in isolation.
+Cold start, the time for `opencosmos <command> --help` to return in a new
+interpreter, is measured for every command too, so an import creeping back
+to module level shows up next to the throughput numbers.
+
+python3 benchmark.py --sizes 1 16 64 --output results.json
+python3 benchmark.py --sizes 1 16 64 --compare results.json
+python3 benchmark.py --sizes 1 --cases rotate --cold-start-runs 9
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+import instrument
+from opencosmos import COMMANDS
+from pngstream import PngBandWriter, iter_bands
+
+DEFAULT_SIZES = (1, 16, 64)
+# Runs per command when timing cold start; the median is reported
+COLD_START_RUNS = 5
+BAND_ROWS = 256
+
+# Synthetic mosaics live in EPSG:25831 around the usual survey area
+ORIGIN_LAT, ORIGIN_LON = 39.5785, 2.3502
+PIXEL_SIZE = 0.005
+
+
+def dimensions(megapixels):
+    """Width and height of a roughly 4:3 image with the given megapixels."""
+    height = max(1, int(round((megapixels * 1e6 * 3 / 4) ** 0.5)))
+    width = max(1, int(round(megapixels * 1e6 / height)))
+    return width, height
+
+
+def synthetic_rgba(row_off, rows, width, height, variant):
+    """
+    Smooth seabed-like RGBA rows with a transparent irregular border and, for
+    mosaic_x variants, opaque black blocks.
+    """
+    y = np.arange(row_off, row_off + rows, dtype=np.float32)[:, None] / height
+    x = np.arange(width, dtype=np.float32)[None, :] / width
+    rgba = np.empty((rows, width, 4), dtype=np.uint8)
+    rgba[..., 0] = (96 + 64 * np.sin(9 * x + 3 * y + variant)).astype(np.uint8)
+    rgba[..., 1] = (128 + 48 * np.cos(7 * y - 5 * x)).astype(np.uint8)
+    rgba[..., 2] = (160 + 40 * np.sin(11 * (x + y))).astype(np.uint8)
+
+    # Irregular footprint: everything outside is fully transparent
+    radius = 0.46 + 0.03 * np.sin(20 * np.arctan2(y - 0.5, x - 0.5) + variant)
+    inside = (x - 0.5) ** 2 + (y - 0.5) ** 2 < radius ** 2
+    rgba[..., 3] = np.where(inside, 255, 0)
+    rgba[~inside, :3] = 0
+
+    if variant in (1, 2):
+        # Opaque black blocks, treated as transparent in mosaic_x files
+        black = ((x * 16).astype(int) % 5 == variant) & ((y * 16).astype(int) % 7 == 3)
+        rgba[black, :3] = 0
+    return rgba
+
+
+def write_synthetic_png(path, width, height, variant):
+    writer = PngBandWriter(path, width, height, compress_level=1)
+    for row_off, rows in iter_bands(height, BAND_ROWS):
+        writer.write(synthetic_rgba(row_off, rows, width, height, variant))
+    writer.close()
+
+
+def write_synthetic_uint16(path, width, height):
+    profile = {
+        "driver": "GTiff", "width": width, "height": height, "count": 4, "dtype": "uint16",
+        "crs": "EPSG:25831", "transform": from_origin(439800.0, 4372500.0, PIXEL_SIZE, PIXEL_SIZE),
+        "tiled": True, "blockxsize": 256, "blockysize": 256, "nodata": 0, "BIGTIFF": "IF_SAFER",
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        for row_off, rows in iter_bands(height, BAND_ROWS):
+            rgba = synthetic_rgba(row_off, rows, width, height, 0).astype(np.uint16)
+            data = np.moveaxis(rgba, -1, 0) * 257
+            dst.write(data, window=Window(0, row_off, width, rows))
+
+
+def prepare_dataset(data_dir, megapixels):
+    """Create (or reuse) the synthetic inputs for one size."""
+    width, height = dimensions(megapixels)
+    folder = os.path.join(data_dir, f"{megapixels}MP")
+    mosaics = os.path.join(folder, "mosaics")
+    os.makedirs(mosaics, exist_ok=True)
+
+    for name, variant in (("mosaic_x1.png", 1), ("mosaic_x2.png", 2), ("mosaic_over.png", 3)):
+        path = os.path.join(mosaics, name)
+        if not os.path.exists(path):
+            write_synthetic_png(path, width, height, variant)
+
+    tif_path = os.path.join(folder, "survey_uint16.tif")
+    if not os.path.exists(tif_path):
+        write_synthetic_uint16(tif_path, width, height)
+
+    return {"folder": mosaics, "png": os.path.join(mosaics, "mosaic_x1.png"), "tif": tif_path,
+            "pixels": width * height}
+
+
+def case_compare_pngs(work, data):
+    from compare_pngs import compare_all_pngs_in_folder
+    compare_all_pngs_in_folder(work["folder"])
+
+
+def case_compare_pngs_serial(work, data):
+    from compare_pngs import compare_all_pngs_in_folder
+    compare_all_pngs_in_folder(work["folder"], prefetch=0)
+
+
+def case_compare_pngs_stream(work, data):
+    from compare_pngs import compare_all_pngs_in_folder
+    compare_all_pngs_in_folder(work["folder"], max_memory=256 * 1024 * 1024)
+
+
+def case_deleteblack(work, data):
+    from deleteblack import delete_black
+    delete_black(data["png"], os.path.join(work["dir"], "out.png"))
+
+
+def case_rotate(work, data):
+    from rotate_folder import rotate_image
+    shutil.copy(data["png"], os.path.join(work["dir"], "in.png"))
+    rotate_image(os.path.join(work["dir"], "in.png"))
+
+
+def case_rotate_stream(work, data):
+    from rotate_folder import rotate_image
+    shutil.copy(data["png"], os.path.join(work["dir"], "in.png"))
+    rotate_image(os.path.join(work["dir"], "in.png"), max_memory=64 << 20)
+
+
+def case_png2geotiff(work, data):
+    from png2geotiff_simple import georeference_png_to_geotiff
+    georeference_png_to_geotiff(
+        data["png"], os.path.join(work["dir"], "out.tif"),
+        ORIGIN_LAT, ORIGIN_LON, PIXEL_SIZE, PIXEL_SIZE,
+    )
+
+
+def case_uint8(work, data):
+    from uint8 import convert_to_uint8
+    shutil.copy(data["tif"], os.path.join(work["dir"], "in.tif"))
+    convert_to_uint8(os.path.join(work["dir"], "in.tif"))
+
+
+def case_uint8_stretch(work, data):
+    from uint8 import convert_files
+    shutil.copy(data["tif"], os.path.join(work["dir"], "in.tif"))
+    convert_files([os.path.join(work["dir"], "in.tif")], stretch="percentile")
+
+
+CASES = {
+    "compare_pngs": case_compare_pngs,
+    "compare_pngs_serial": case_compare_pngs_serial,
+    "compare_pngs_stream": case_compare_pngs_stream,
+    "deleteblack": case_deleteblack,
+    "rotate": case_rotate,
+    "rotate_stream": case_rotate_stream,
+    "png2geotiff": case_png2geotiff,
+    "uint8": case_uint8,
+    "uint8_stretch": case_uint8_stretch,
+}
+
+# Cases that modify their inputs in place get a private copy of the folder
+COPIES_FOLDER = {"compare_pngs", "compare_pngs_stream"}
+
+
+def _run_case(name, work, data, queue):
+    sys.stdout = open(os.devnull, "w")
+    start = time.perf_counter()
+    CASES[name](work, data)
+    seconds = time.perf_counter() - start
+    queue.put({
+        "seconds": seconds,
+        "peak_rss_mb": instrument.peak_rss_bytes() / (1024 * 1024),
+        "phases": instrument.RUN.phases,
+    })
+
+
+def run_case(name, data, work_root):
+    """Run one case in a fresh process and return its measurements."""
+    work_dir = tempfile.mkdtemp(dir=work_root)
+    try:
+        work = {"dir": work_dir, "folder": data["folder"]}
+        if name in COPIES_FOLDER:
+            work["folder"] = os.path.join(work_dir, "mosaics")
+            shutil.copytree(data["folder"], work["folder"])
+
+        ctx = multiprocessing.get_context("spawn")
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run_case, args=(name, work, data, queue))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            raise RuntimeError(f"case '{name}' exited with code {proc.exitcode}")
+        result = queue.get()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    result["mpix_per_s"] = data["pixels"] / 1e6 / result["seconds"]
+    return result
+
+
+def run_benchmarks(sizes, cases, data_dir):
+    results = []
+    for megapixels in sizes:
+        print(f"\n📦 Preparing {megapixels} MP dataset in {data_dir}")
+        data = prepare_dataset(data_dir, megapixels)
+        for name in cases:
+            try:
+                measured = run_case(name, data, data_dir)
+            except Exception as e:
+                print(f"❌ {name} @ {megapixels} MP failed: {e}")
+                continue
+            measured.update(case=name, megapixels=megapixels)
+            results.append(measured)
+            print(
+                f"   {name:<20} {measured['seconds']:8.2f} s  "
+                f"{measured['mpix_per_s']:8.2f} MP/s  {measured['peak_rss_mb']:8.1f} MiB peak"
+            )
+    return results
+
+
+def median_wall_ms(cmd, runs=COLD_START_RUNS):
+    """Median wall time in ms of running cmd to completion, runs times."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def measure_cold_start(runs=COLD_START_RUNS):
+    """
+    Median wall time in ms of `opencosmos <command> --help` in a fresh
+    interpreter for every command, plus "python" for the bare interpreter.
+    """
+    entry = os.path.join(os.path.dirname(os.path.abspath(__file__)), "opencosmos.py")
+    commands = {"python": [sys.executable, "-c", "pass"]}
+    commands.update({name: [sys.executable, entry, name, "--help"] for name in COMMANDS})
+
+    print(f"\n⏱️  Cold start (median of {runs} runs)")
+    results = []
+    for name, cmd in commands.items():
+        results.append({"command": name, "ms": median_wall_ms(cmd, runs)})
+        print(f"   {name:<20} {results[-1]['ms']:8.1f} ms")
+    return results
+
+
+def compare_results(results, baseline_path, cold_start=()):
+    """Print the change of each case (and cold start) against a saved baseline."""
+    with open(baseline_path) as f:
+        saved = json.load(f)
+    baseline = {(r["case"], r["megapixels"]): r for r in saved["results"]}
+    baseline_cold = {r["command"]: r for r in saved.get("cold_start", [])}
+
+    print(f"\n📊 Compared with {baseline_path}:")
+    for r in results:
+        base = baseline.get((r["case"], r["megapixels"]))
+        if base is None:
+            continue
+        speed = r["mpix_per_s"] / base["mpix_per_s"]
+        memory = r["peak_rss_mb"] / base["peak_rss_mb"]
+        print(f"   {r['case']:<20} {r['megapixels']:>5} MP  speed x{speed:5.2f}  peak RSS x{memory:5.2f}")
+    for r in cold_start:
+        base = baseline_cold.get(r["command"])
+        if base is None:
+            continue
+        print(f"   {r['command']:<20} cold start {base['ms']:8.1f} → {r['ms']:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scripts on synthetic mosaics.")
+    parser.add_argument(
+        "--sizes", nargs="+", type=float, default=list(DEFAULT_SIZES),
+        help="Mosaic sizes in megapixels (default: 1 16 64; up to 500 for full runs)",
+    )
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=list(CASES), help="Cases to run")
+    parser.add_argument("--data-dir", help="Where synthetic inputs are generated and cached (default: temp dir)")
+    parser.add_argument("--output", help="Save results as JSON (e.g. a new baseline)")
+    parser.add_argument("--compare", help="Baseline JSON to compare the results against")
+    parser.add_argument(
+        "--cold-start-runs", type=int, default=COLD_START_RUNS,
+        help=f"Runs per command when timing cold start; 0 skips it (default: {COLD_START_RUNS})",
+    )
+    args = parser.parse_args()
+
+    sizes = [int(s) if float(s).is_integer() else s for s in args.sizes]
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="opencosmos-bench-")
+    os.makedirs(data_dir, exist_ok=True)
+
+    results = run_benchmarks(sizes, args.cases, data_dir)
+    cold_start = measure_cold_start(args.cold_start_runs) if args.cold_start_runs > 0 else []
+
+    if args.output:
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "results": results,
+            "cold_start": cold_start,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results saved to {args.output}")
+
+    if args.compare:
+        compare_results(results, args.compare, cold_start)
+
+    if not args.data_dir:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
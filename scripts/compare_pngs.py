@@ -1,39 +1,104 @@
 import argparse
 import os
+import numpy as np
 from PIL import Image
+from instrument import add_report_argument, count_read, count_written, phase, write_report
+from manifest import Manifest
+from decodecache import add_cache_arguments, cache_from_args, open_band_reader, open_image
+from pngstream import (
+    PngBandWriter, add_png_arguments, iter_bands, parse_size, png_options_from_args, rows_per_band, save_png,
+    unstreamable_reason,
+)
+from scheduler import DEFAULT_PREFETCH, add_prefetch_argument, folder_pixels, print_summary, run_pipelined, run_tasks
+from validmask import ValidityMask
 
 # Disable Pillow safety limits for large images
 Image.MAX_IMAGE_PIXELS = None
 
+# Recorded in the manifest; change it when the filter rules change
+PARAMS = {"filter": "alpha0-or-mosaic_x-black"}
+
+
+def build_transparency_mask(arrays, filenames):
+    """Return a boolean (H, W) mask of pixels that must become transparent.
+
+    A pixel is masked when its alpha is 0 in any image, or when it is pure
+    black (RGB == 0) in any 'mosaic_x' image.
+    """
+    mask = np.zeros(arrays[0].shape[:2], dtype=bool)
+    for arr, name in zip(arrays, filenames):
+        mask |= arr[..., 3] == 0
+        if "mosaic_x" in name.lower():
+            mask |= ~arr[..., :3].any(axis=-1)
+    return mask
+
 
 def compare_and_filter_all(images, filenames):
     """Apply the transparency/black pixel filter across all images."""
-    width, height = images[0].size
-    pixel_data = [img.load() for img in images]
+    arrays = [np.array(img.convert("RGBA")) for img in images]
+    mask = build_transparency_mask(arrays, filenames)
+
+    # Apply transparency to all
+    filtered = []
+    for arr in arrays:
+        arr[mask] = 0
+        filtered.append(Image.fromarray(arr, "RGBA"))
+
+    return filtered
+
+
+def select_comparable(folder_path, sizes):
+    """
+    Pick the images of a folder that take part in the comparison.
+
+    sizes is a list of (path, (width, height)) pairs. Returns the kept paths,
+    or None when the folder must be skipped.
+    """
+    # Determine reference size from the first non-mosaic_over image
+    ref_size = next((size for path, size in sizes if "mosaic_over" not in path.lower()), None)
+    if not ref_size:
+        print(f"⚠️  No base image found in {folder_path} (only 'mosaic_over' files). Skipping.")
+        return None
 
-    for y in range(height):
-        for x in range(width):
-            make_transparent = False
+    # Filter images: skip mosaic_over with different size
+    kept = []
+    for path, size in sizes:
+        if size != ref_size:
+            if "mosaic_over" in path.lower():
+                print(f"⚠️  Skipping '{os.path.basename(path)}' (size {size} != {ref_size})")
+                continue
+            else:
+                raise ValueError(
+                    f"❌ Images in {folder_path} must have the same dimensions. "
+                    f"Found mismatch: {os.path.basename(path)} is {size}, expected {ref_size}"
+                )
+        kept.append(path)
 
-            # Check each image’s pixel
-            for idx, pixels in enumerate(pixel_data):
-                r, g, b, a = pixels[x, y]
+    if len(kept) < 2:
+        print(f"⚠️  Not enough valid images to compare in {folder_path}. Skipping.")
+        return None
 
-                # Transparent or black (if mosaic_x)
-                if a == 0 or ("mosaic_x" in filenames[idx].lower() and (r, g, b) == (0, 0, 0)):
-                    make_transparent = True
-                    break
+    return kept
 
-            # Apply transparency to all
-            if make_transparent:
-                for p in pixel_data:
-                    p[x, y] = (0, 0, 0, 0)
 
-    return images
+def compare_all_pngs_in_folder(
+    folder_path, max_memory=None, cache=None, rebuild_mask=False, prefetch=DEFAULT_PREFETCH, png_options=None
+):
+    """
+    Process one folder containing PNGs.
 
+    With max_memory (bytes) the folder is streamed in row bands instead of
+    loading every image at once. With a DecodedCache, decoded pixels are
+    taken from (and added to) the cache. Up to prefetch images (or bands)
+    are decoded ahead of and encoded behind the one being filtered.
+    Images the filter leaves unchanged are not written; the others are
+    replaced atomically, encoded with png_options (see save_png).
 
-def compare_all_pngs_in_folder(folder_path):
-    """Process one folder containing PNGs."""
+    The combined validity mask is kept in the folder's sidecar. Images already
+    folded into it are not read to build the mask again; only new or changed
+    images are, and the others are rewritten only if the mask shrank.
+    rebuild_mask ignores the sidecar.
+    """
     png_files = [
         os.path.join(folder_path, f)
         for f in os.listdir(folder_path)
@@ -45,55 +110,279 @@ def compare_all_pngs_in_folder(folder_path):
 
     print(f"\nProcessing folder: {folder_path}")
 
-    # Load images in RGBA
-    all_images = [(p, Image.open(p).convert("RGBA")) for p in png_files]
+    # Image.open only parses the header, so this does not decode any pixels
+    sizes = []
+    for p in png_files:
+        with Image.open(p) as img:
+            sizes.append((p, img.size))
 
-    # Determine reference size from the first non-mosaic_over image
-    ref_image = next((img for path, img in all_images if "mosaic_over" not in path.lower()), None)
-    if not ref_image:
-        print(f"⚠️  No base image found in {folder_path} (only 'mosaic_over' files). Skipping.")
+    filenames = select_comparable(folder_path, sizes)
+    if filenames is None:
         return
 
-    ref_size = ref_image.size
+    width, height = dict(sizes)[filenames[0]]
+    old_mask = None if rebuild_mask else ValidityMask.load(folder_path, width, height)
+    new_files = [p for p in filenames if old_mask is None or not old_mask.is_member(p)]
+    if not new_files:
+        print(f"⏭️  Mask sidecar of {folder_path} already covers all images")
+        return
 
-    # Filter images: skip mosaic_over with different size
-    filtered = []
-    for path, img in all_images:
-        if img.size != ref_size:
-            if "mosaic_over" in path.lower():
-                print(f"⚠️  Skipping '{os.path.basename(path)}' (size {img.size} != {ref_size})")
-                continue
-            else:
+    mask = ValidityMask.create(folder_path, width, height)
+    try:
+        if max_memory is not None:
+            written = stream_folder(
+                filenames, new_files, old_mask, mask, max_memory, cache, prefetch, png_options
+            )
+        else:
+            written = filter_in_memory(filenames, new_files, old_mask, mask, cache, prefetch, png_options)
+    except BaseException:
+        mask.discard()
+        raise
+    mask.save(filenames)
+
+    if old_mask is not None:
+        print(f"🧩 Folded {len(new_files)} new image(s) into the mask sidecar")
+    print(f"✅ Updated {len(written)} images in {folder_path}")
+
+
+def filter_in_memory(
+    filenames, new_files, old_mask, mask, cache=None, prefetch=DEFAULT_PREFETCH, png_options=None
+):
+    """Filter the folder with whole images in memory; return the rewritten paths."""
+
+    def decode(path):
+        with phase("decode"):
+            arr = np.array(open_image(path, cache).convert("RGBA"))
+        count_read(path)
+        return path, arr
+
+    # Fold each new image into the mask while the next one is decoded
+    arrays = {}
+    valid = np.ones((mask.height, mask.width), dtype=bool)
+
+    def fold(decoded):
+        path, arr = decoded
+        with phase("compute"):
+            valid[build_transparency_mask([arr], [path])] = False
+        arrays[path] = arr
+
+    run_pipelined([(p, (p,)) for p in new_files], decode, fold, lambda _: None, prefetch, fail_fast=True)
+
+    with phase("compute"):
+        changed = True
+        if old_mask is not None:
+            old_valid = old_mask.read(0, old_mask.height)
+            changed = bool((old_valid & ~valid).any())
+            valid &= old_valid
+        mask.write(0, valid)
+        invalid = ~valid
+
+    # Images already in the sidecar only change if the mask shrank
+    to_check = filenames if changed else new_files
+
+    def load(path):
+        return decode(path) if path not in arrays else (path, arrays.pop(path))
+
+    def apply(loaded):
+        path, arr = loaded
+        with phase("compute"):
+            if not arr[invalid].any():
+                return path, None
+            arr[invalid] = 0
+        return path, arr
+
+    def save(filtered):
+        path, arr = filtered
+        if arr is None:
+            return None
+        with phase("encode"):
+            save_png(Image.fromarray(arr, "RGBA"), path, **(png_options or {}))
+        count_written(path)
+        return path
+
+    results = run_pipelined([(p, (p,)) for p in to_check], load, apply, save, prefetch, fail_fast=True)
+    return [path for _, path, _ in results if path is not None]
+
+
+def stream_folder(
+    filenames, new_files, old_mask, mask, max_memory, cache=None, prefetch=DEFAULT_PREFETCH, png_options=None
+):
+    """
+    Filter the folder band by band, keeping the working set under max_memory
+    bytes; return the rewritten paths.
+    """
+    if cache is None:
+        # Refuse up front rather than with some images already read
+        for path in filenames:
+            reason = unstreamable_reason(path)
+            if reason is not None:
                 raise ValueError(
-                    f"❌ Images in {folder_path} must have the same dimensions. "
-                    f"Found mismatch: {os.path.basename(path)} is {img.size}, expected {ref_size}"
+                    f"{os.path.basename(path)} has {reason} and cannot be streamed; "
+                    "run without --max-memory or with --cache-dir"
                 )
-        filtered.append((path, img))
 
-    if len(filtered) < 2:
-        print(f"⚠️  Not enough valid images to compare in {folder_path}. Skipping.")
-        return
+    # Up to 2 * prefetch + 1 bands are in flight at once
+    band_rows = rows_per_band(mask.width, len(filenames), max_memory // (2 * max(prefetch, 0) + 1))
+
+    if old_mask is None:
+        # One pass: the mask of each band comes from the images being rewritten
+        def band_validity(row_off, bands):
+            valid = ~build_transparency_mask(bands, filenames)
+            mask.write(row_off, valid)
+            return valid
+
+        written = rewrite_bands(filenames, band_rows, band_validity, cache, prefetch, png_options)
+        print(f"   ({band_rows} rows per band)")
+        return written
+
+    # Fold only the new images into the existing mask, then rewrite
+    changed = False
+    readers = [open_band_reader(p, cache) for p in new_files]
+
+    def read(row_off, rows):
+        with phase("decode"):
+            return row_off, [r.read_rgba(row_off, rows) for r in readers]
+
+    def fold(band):
+        nonlocal changed
+        row_off, bands = band
+        with phase("compute"):
+            old_valid = old_mask.read(row_off, bands[0].shape[0])
+            valid = old_valid & ~build_transparency_mask(bands, new_files)
+            changed = changed or not np.array_equal(valid, old_valid)
+            mask.write(row_off, valid)
+
+    try:
+        items = [(row_off, (row_off, rows)) for row_off, rows in iter_bands(mask.height, band_rows)]
+        run_pipelined(items, read, fold, lambda _: None, prefetch, fail_fast=True)
+    finally:
+        for reader in readers:
+            reader.close()
+
+    to_check = filenames if changed else new_files
+    written = rewrite_bands(
+        to_check, band_rows, lambda row_off, bands: mask.read(row_off, bands[0].shape[0]),
+        cache, prefetch, png_options,
+    )
+    print(f"   ({band_rows} rows per band)")
+    return written
+
+
+def rewrite_bands(paths, band_rows, band_validity, cache=None, prefetch=DEFAULT_PREFETCH, png_options=None):
+    """
+    Stream paths band by band, clearing the pixels where
+    band_validity(row_off, bands) is False, and replace them once all are written.
+    Bands are read ahead and written behind the one being filtered.
+
+    An image is only encoded from its first band the filter changes (the
+    rows above are copied from the source at that point), and images it
+    never changes are left untouched. Returns the replaced paths.
+    """
+    readers = [open_band_reader(p, cache) for p in paths]
+    writers = [None] * len(paths)
+    width, height = readers[0].width, readers[0].height
+
+    def read(row_off, rows):
+        with phase("decode"):
+            return row_off, [r.read_rgba(row_off, rows) for r in readers]
 
-    # Apply filtering
-    filenames = [p for p, _ in filtered]
-    images = [img for _, img in filtered]
-    images = compare_and_filter_all(images, filenames)
+    def apply(band):
+        row_off, bands = band
+        with phase("compute"):
+            invalid = ~band_validity(row_off, bands)
+            changed = []
+            for b in bands:
+                changed.append(bool(b[invalid].any()))
+                b[invalid] = 0
+        return row_off, bands, changed
 
-    # Save back
-    for path, img in zip(filenames, images):
-        img.save(path, "PNG")
+    def start_writer(path, row_off):
+        writer = PngBandWriter(path, width, height, **(png_options or {}))
+        with open_band_reader(path, cache) as reader:
+            for off, rows in iter_bands(row_off, band_rows):
+                with phase("decode"):
+                    band = reader.read_rgba(off, rows)
+                with phase("encode"):
+                    writer.write(band)
+        return writer
 
-    print(f"✅ Updated {len(filenames)} images in {folder_path}")
+    def write(filtered):
+        row_off, bands, changed = filtered
+        for i, b in enumerate(bands):
+            if writers[i] is None and changed[i]:
+                writers[i] = start_writer(paths[i], row_off)
+            if writers[i] is not None:
+                with phase("encode"):
+                    writers[i].write(b)
 
+    try:
+        items = [(row_off, (row_off, rows)) for row_off, rows in iter_bands(height, band_rows)]
+        run_pipelined(items, read, apply, write, prefetch, fail_fast=True)
+    except BaseException:
+        for writer in writers:
+            if writer is not None:
+                writer.abort()
+        raise
+    finally:
+        for reader in readers:
+            reader.close()
+    for p in paths:
+        count_read(p)
 
-def process_folder_recursively(root_folder):
-    """Scan all subfolders for PNGs."""
+    # Only replace the sources once every output has been fully written
+    with phase("encode"):
+        for writer in writers:
+            if writer is not None:
+                writer.close()
+                count_written(writer.path)
+    return [writer.path for writer in writers if writer is not None]
+
+
+def folder_pngs(folder_path):
+    """Paths of the PNGs directly inside folder_path."""
+    return sorted(
+        os.path.join(folder_path, f)
+        for f in os.listdir(folder_path)
+        if f.lower().endswith(".png")
+    )
+
+
+def process_folder_recursively(
+    root_folder, max_memory=None, jobs=1, force=False, cache=None, prefetch=DEFAULT_PREFETCH, png_options=None
+):
+    """
+    Scan all subfolders for PNGs, returning per-folder results.
+
+    Folders whose PNGs are unchanged since they were last synced (according
+    to the tree's manifest) are skipped unless force is set; force also
+    rebuilds the mask sidecars from scratch.
+    """
+    manifest = Manifest(root_folder)
+    tasks = []
+    skipped = 0
     for dirpath, _, filenames in os.walk(root_folder):
         if any(f.lower().endswith(".png") for f in filenames):
-            compare_all_pngs_in_folder(dirpath)
+            key = manifest.key("compare_pngs", dirpath)
+            if not force and manifest.is_up_to_date(key, folder_pngs(dirpath), PARAMS):
+                skipped += 1
+                continue
+            args = (dirpath, max_memory, cache, force, prefetch, png_options)
+            tasks.append((dirpath, folder_pixels(dirpath, filenames), args))
 
+    results = run_tasks(tasks, compare_all_pngs_in_folder, jobs)
 
-if __name__ == "__main__":
+    # The filter is idempotent, so the folder's state after a run is up to date
+    for dirpath, _, error in results:
+        if error is None:
+            manifest.record(manifest.key("compare_pngs", dirpath), folder_pngs(dirpath), PARAMS)
+    manifest.save()
+
+    if skipped:
+        print(f"⏭️  Skipped {skipped} up-to-date folders (use --force to redo them)")
+    return results
+
+
+def main():
     parser = argparse.ArgumentParser(
         description=(
             "Recursively compare all PNGs in each folder, removing pixels transparent in any image.\n"
@@ -102,7 +391,37 @@ if __name__ == "__main__":
         )
     )
     parser.add_argument("--folder", required=True, help="Root folder to scan recursively.")
+    parser.add_argument(
+        "--max-memory",
+        help=(
+            "Stream each folder in row bands using at most this much memory (e.g. 512M, 4G). "
+            "The budget applies to each worker."
+        ),
+    )
+    parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes (default: 1).")
+    parser.add_argument("--force", action="store_true", help="Reprocess folders even if they are up to date.")
+    add_prefetch_argument(parser)
+    add_png_arguments(parser)
+    add_cache_arguments(parser)
+    add_report_argument(parser)
     args = parser.parse_args()
 
-    process_folder_recursively(args.folder)
+    max_memory = parse_size(args.max_memory) if args.max_memory else None
+    results = process_folder_recursively(
+        args.folder, max_memory, args.jobs, args.force, cache_from_args(args), args.prefetch,
+        png_options_from_args(args),
+    )
+    failures = print_summary(results, "folders")
+    write_report(
+        args.report, "compare_pngs",
+        {
+            "folder": args.folder, "max_memory": max_memory, "jobs": args.jobs, "prefetch": args.prefetch,
+            **png_options_from_args(args),
+        },
+    )
+    if failures:
+        raise SystemExit(1)
 
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Shared cache of decoded mosaics as memory-mapped .npy arrays.
+
+Decoding a gigapixel PNG is single-threaded and dominates most scripts, so
+with --cache-dir the first script to read a PNG stores its RGBA pixels as a
+raw (height, width, 4) array named after the file's SHA-256. Every later
+read of the same content, from any script, maps that array instead of
+decoding again. The cache is capped in size and evicts the least recently
+used arrays first.
+"""
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+import numpy as np
+from PIL import Image
+from instrument import phase
+from manifest import file_sha256
+from pngstream import PngBandReader, is_png, iter_bands, parse_size
+from rasterbands import RasterBandReader
+
+Image.MAX_IMAGE_PIXELS = None
+
+DEFAULT_CACHE_SIZE = "20G"
+CACHE_DIR_ENV = "OPENCOSMOS_CACHE_DIR"
+INDEX_NAME = "index.json"
+# Rows decoded per band while filling a cache entry
+FILL_BAND_ROWS = 512
+
+
+class DecodedCache:
+    """
+    Content-addressed store of decoded RGBA arrays in cache_dir.
+
+    index.json remembers the hash of each source (by size and mtime, so
+    unchanged files are not re-hashed) and when each array was last used.
+    Updates are serialized with a lock file, so several processes can share
+    the cache. Instances only hold the folder and limit and can be passed to
+    worker processes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=parse_size(DEFAULT_CACHE_SIZE)):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @contextmanager
+    def _index(self):
+        """Locked read-modify-write access to the index."""
+        with open(os.path.join(self.cache_dir, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            path = os.path.join(self.cache_dir, INDEX_NAME)
+            index = {"sources": {}, "entries": {}}
+            if os.path.exists(path):
+                with open(path) as f:
+                    index = json.load(f)
+            yield index
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(index, f, indent=1)
+            os.replace(tmp_path, path)
+
+    def _array_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.npy")
+
+    def _digest(self, path):
+        """Content hash of path, reusing the indexed one while size and mtime match."""
+        st = os.stat(path)
+        real = os.path.realpath(path)
+        with self._index() as index:
+            known = index["sources"].get(real)
+            if known and known["size"] == st.st_size and known["mtime_ns"] == st.st_mtime_ns:
+                return known["sha256"]
+
+        digest = file_sha256(path)
+        with self._index() as index:
+            index["sources"][real] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+        return digest
+
+    def _fill(self, path, digest):
+        """Decode path into a new cache entry."""
+        tmp_path = os.path.join(self.cache_dir, f"{digest}.{os.getpid()}.tmp.npy")
+        try:
+            # PNGs the band reader cannot reproduce exactly are decoded whole by Pillow
+            with open_band_reader(path, fallback=is_png(path)) as reader:
+                array = np.lib.format.open_memmap(
+                    tmp_path, mode="w+", dtype=np.uint8, shape=(reader.height, reader.width, 4)
+                )
+                for row_off, rows in iter_bands(reader.height, FILL_BAND_ROWS):
+                    array[row_off:row_off + rows] = reader.read_rgba(row_off, rows)
+                array.flush()
+                del array
+            os.replace(tmp_path, self._array_path(digest))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _evict(self, index, keep):
+        """Drop least recently used arrays until the cache fits max_bytes."""
+        total = sum(e["bytes"] for e in index["entries"].values())
+        for digest, entry in sorted(index["entries"].items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            if os.path.exists(self._array_path(digest)):
+                os.remove(self._array_path(digest))
+            del index["entries"][digest]
+            total -= entry["bytes"]
+
+    def open(self, path):
+        """Read-only (height, width, 4) RGBA memory map of path, decoding it on a miss."""
+        digest = self._digest(path)
+        array_path = self._array_path(digest)
+        if not os.path.exists(array_path):
+            print(f"🗄️  Caching decoded {os.path.basename(path)}")
+            with phase("cache"):
+                self._fill(path, digest)
+
+        with self._index() as index:
+            index["entries"][digest] = {"bytes": os.path.getsize(array_path), "last_used": time.time()}
+            self._evict(index, keep=digest)
+        return np.load(array_path, mmap_mode="r")
+
+
+class CachedBandReader:
+    """PngBandReader counterpart that serves bands from the decoded cache."""
+
+    def __init__(self, cache, path):
+        self.path = path
+        self._array = cache.open(path)
+        self.height, self.width = self._array.shape[:2]
+
+    def read_rgba(self, row_off, rows, col_off=0, cols=None):
+        """Same as PngBandReader.read_rgba; the result is a writable copy."""
+        if cols is None:
+            cols = self.width - col_off
+        return np.array(self._array[row_off:row_off + rows, col_off:col_off + cols])
+
+    def close(self):
+        self._array = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PillowBandReader:
+    """
+    PngBandReader counterpart for files the band readers refuse (16-bit
+    PNGs, formats GDAL does not open): the whole image is decoded by Pillow
+    with convert('RGBA') and bands are served from memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with Image.open(path) as img:
+            self._array = np.asarray(img.convert("RGBA"))
+        self.height, self.width = self._array.shape[:2]
+
+    def read_rgba(self, row_off, rows, col_off=0, cols=None):
+        """Same as PngBandReader.read_rgba; the result is a writable copy."""
+        if cols is None:
+            cols = self.width - col_off
+        return np.array(self._array[row_off:row_off + rows, col_off:col_off + cols])
+
+    def close(self):
+        self._array = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_band_reader(path, cache=None, fallback=False):
+    """
+    Band reader for path, backed by the cache when one is given. PNGs are
+    streamed by PngBandReader; GeoTIFFs and other rasters are read by
+    window through rasterio. With fallback, files those readers refuse are
+    decoded whole by Pillow instead.
+    """
+    if cache is not None:
+        return CachedBandReader(cache, path)
+    try:
+        if is_png(path):
+            return PngBandReader(path)
+        return RasterBandReader(path)
+    except (ValueError, OSError):
+        # rasterio's open errors are OSErrors
+        if not fallback:
+            raise
+    return PillowBandReader(path)
+
+
+def open_image(path, cache=None):
+    """
+    Fully loaded PIL image of path. RGBA images come from the cache when one
+    is given; other modes are decoded normally so they keep their mode.
+    """
+    img = Image.open(path)
+    if cache is None or img.mode != "RGBA":
+        img.load()
+        return img
+    img.close()
+    return Image.fromarray(np.asarray(cache.open(path)), "RGBA")
+
+
+def add_cache_arguments(parser):
+    """Register the --cache-dir and --cache-size options."""
+    parser.add_argument(
+        "--cache-dir", default=os.environ.get(CACHE_DIR_ENV),
+        help=f"Reuse decoded mosaics from this cache folder (default: ${CACHE_DIR_ENV}, if set)",
+    )
+    parser.add_argument(
+        "--cache-size", default=DEFAULT_CACHE_SIZE,
+        help=f"Evict least recently used entries beyond this size (default: {DEFAULT_CACHE_SIZE})",
+    )
+
+
+def cache_from_args(args):
+    """DecodedCache for the parsed --cache-dir/--cache-size, or None."""
+    if not args.cache_dir:
+        return None
+    return DecodedCache(args.cache_dir, parse_size(args.cache_size))
@@ -1,38 +1,157 @@
 import argparse
 import os
+import numpy as np
 from PIL import Image
+from instrument import add_report_argument, count_read, count_written, phase, write_report
+from manifest import Manifest
+from decodecache import add_cache_arguments, cache_from_args, open_band_reader
+from pngstream import PngBandWriter, iter_bands, parse_size, rows_per_band, save_png, unstreamable_reason
+from scheduler import image_pixels, print_summary, run_tasks
 
 Image.MAX_IMAGE_PIXELS = None
 
+# Default memory budget per image for strip processing
+DEFAULT_MAX_MEMORY = 256 * 1024 * 1024
+
+
+def make_black_transparent(rgba, threshold=0):
+    """
+    Set pixels whose R, G and B are all <= threshold to (0, 0, 0, 0), in place.
+
+    rgba is a (..., 4) uint8 array. With threshold 0 only pure black is removed.
+    """
+    black = (rgba[..., :3] <= threshold).all(axis=-1)
+    rgba[black] = 0
+    return rgba
+
+
+def output_path_for(input_path):
+    """Build output path: same folder, add _transparent before extension."""
+    base, ext = os.path.splitext(input_path)
+    return f"{base}_transparent{ext}"
+
+
+def delete_black(input_path, output_path=None, threshold=0, max_memory=DEFAULT_MAX_MEMORY, cache=None):
+    """
+    Make (near-)black pixels of a PNG transparent, one strip at a time.
+    PNGs the band reader refuses (16-bit, see unstreamable_reason) are
+    processed whole in memory instead.
+    """
+    if output_path is None:
+        output_path = output_path_for(input_path)
+
+    if cache is None and unstreamable_reason(input_path) is not None:
+        # The band reader cannot decode it like convert("RGBA"), so decode it whole
+        with phase("decode"):
+            with Image.open(input_path) as img:
+                rgba = np.array(img.convert("RGBA"))
+        with phase("compute"):
+            make_black_transparent(rgba, threshold)
+        with phase("encode"):
+            save_png(Image.fromarray(rgba, "RGBA"), output_path)
+        count_read(input_path)
+        count_written(output_path)
+        print(f"Image with transparent black pixels saved as: {output_path}")
+        return output_path
+
+    with open_band_reader(input_path, cache) as reader:
+        band_rows = rows_per_band(reader.width, 1, max_memory)
+        writer = PngBandWriter(output_path, reader.width, reader.height)
+        try:
+            for row_off, rows in iter_bands(reader.height, band_rows):
+                with phase("decode"):
+                    band = reader.read_rgba(row_off, rows)
+                with phase("compute"):
+                    make_black_transparent(band, threshold)
+                with phase("encode"):
+                    writer.write(band)
+        except BaseException:
+            writer.abort()
+            raise
+    with phase("encode"):
+        writer.close()
+    count_read(input_path)
+    count_written(output_path)
+
+    print(f"Image with transparent black pixels saved as: {output_path}")
+    return output_path
+
+
+def process_folder_recursively(
+    root_folder, threshold=0, max_memory=DEFAULT_MAX_MEMORY, jobs=1, force=False, cache=None,
+):
+    """
+    Run delete_black on every PNG below root_folder, returning per-file results.
+
+    Images already processed with the same threshold and unchanged since
+    (according to the tree's manifest) are skipped unless force is set.
+    """
+    manifest = Manifest(root_folder)
+    params = {"threshold": threshold}
+    tasks = []
+    skipped = 0
+    for dirpath, _, filenames in os.walk(root_folder):
+        for filename in filenames:
+            if not filename.lower().endswith(".png"):
+                continue
+            image_path = os.path.join(dirpath, filename)
+            if os.path.splitext(image_path)[0].endswith("_transparent"):
+                # Skip our own outputs
+                continue
+            files = [image_path, output_path_for(image_path)]
+            if not force and manifest.is_up_to_date(manifest.key("deleteblack", image_path), files, params):
+                skipped += 1
+                continue
+            tasks.append((image_path, image_pixels(image_path), (image_path, None, threshold, max_memory, cache)))
+
+    results = run_tasks(tasks, delete_black, jobs)
+
+    for image_path, output_path, error in results:
+        if error is None:
+            manifest.record(manifest.key("deleteblack", image_path), [image_path, output_path], params)
+    manifest.save()
+
+    if skipped:
+        print(f"⏭️  Skipped {skipped} up-to-date images (use --force to redo them)")
+    return results
+
+
 def main():
     parser = argparse.ArgumentParser(description="Make black pixels transparent in a PNG image.")
-    parser.add_argument("--input", required=True, help="Path to the input PNG image")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="Path to the input PNG image")
+    source.add_argument("--folder", help="Process every PNG in this folder (recursively)")
+    parser.add_argument(
+        "--threshold", type=int, default=0,
+        help="Pixels with R, G and B all <= threshold are made transparent (default: 0, pure black only)",
+    )
+    parser.add_argument(
+        "--max-memory", default="256M",
+        help="Memory budget per image for strip processing (default: 256M)",
+    )
+    parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes for --folder (default: 1)")
+    parser.add_argument("--force", action="store_true", help="With --folder, reprocess images even if up to date")
+    add_cache_arguments(parser)
+    add_report_argument(parser)
     args = parser.parse_args()
 
-    # Open image and ensure RGBA mode
-    img = Image.open(args.input).convert("RGBA")
-    datas = img.getdata()
+    if not 0 <= args.threshold <= 255:
+        parser.error("--threshold must be between 0 and 255")
+    max_memory = parse_size(args.max_memory)
+    cache = cache_from_args(args)
 
-    new_data = []
-    for item in datas:
-        # item is (R, G, B, A)
-        if item[0] == 0 and item[1] == 0 and item[2] == 0:
-            # Make black pixels transparent
-            new_data.append((0, 0, 0, 0))
-        else:
-            new_data.append(item)
+    params = {"input": args.input, "folder": args.folder, "threshold": args.threshold, "max_memory": max_memory}
 
-    # Apply new data
-    img.putdata(new_data)
+    if args.input:
+        delete_black(args.input, threshold=args.threshold, max_memory=max_memory, cache=cache)
+        write_report(args.report, "deleteblack", params)
+        return
 
-    # Build output path
-    base, ext = os.path.splitext(args.input)
-    output_path = f"{base}_transparent{ext}"
-
-    # Save as PNG with alpha
-    img.save(output_path, "PNG")
-    print(f"Image with transparent black pixels saved as: {output_path}")
+    results = process_folder_recursively(args.folder, args.threshold, max_memory, args.jobs, args.force, cache)
+    failures = print_summary(results, "images")
+    write_report(args.report, "deleteblack", params)
+    if failures:
+        raise SystemExit(1)
 
 if __name__ == "__main__":
     main()
-
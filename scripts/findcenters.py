@@ -0,0 +1,301 @@
+"""
+Find the centers of square reference markers in mosaics without clicking.
+
+Batch replacement for getcenter.py: markers are located coarse-to-fine.
+A box filter on a reduced pyramid level scores every position by the
+contrast between a square and the ring around it. The best positions are
+then refined at full resolution to the centroid of the marker pixels. The
+centers are written as CSV or YAML, which png2geotiff reads with --pixels.
+
+python3 findcenters.py --images a.png b.png --square-size 120 --output centers.csv
+python3 png2geotiff.py --mosaic_path a.png --pixels centers.csv ...
+"""
+import argparse
+import csv
+import os
+import numpy as np
+import yaml
+from instrument import add_report_argument, phase, write_report
+from pyramid import Pyramid
+from scheduler import image_pixels, print_summary, run_tasks
+
+# Marker side, in pixels of the pyramid level the coarse search runs on
+COARSE_SQUARE_PIXELS = 8
+REFINE_ITERATIONS = 3
+
+
+def luminance(rgba):
+    """Gray level and validity (non-transparent) mask of an RGBA array."""
+    gray = rgba[..., :3].astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    return gray, rgba[..., 3] > 0
+
+
+def integral(image):
+    """Summed-area table with a leading zero row and column."""
+    table = np.zeros((image.shape[0] + 1, image.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(image, axis=0, dtype=np.float64), axis=1, out=table[1:, 1:])
+    return table
+
+
+def box_sums(table, size, offset, out_shape):
+    """
+    Sums of size x size boxes whose top-left corner is offset pixels before
+    each position of an out_shape grid.
+    """
+    rows, cols = out_shape
+    top, left = offset, offset
+    return (
+        table[top + size:top + size + rows, left + size:left + size + cols]
+        - table[top:top + rows, left + size:left + size + cols]
+        - table[top + size:top + size + rows, left:left + cols]
+        + table[top:top + rows, left:left + cols]
+    )
+
+
+def contrast_map(gray, valid, side):
+    """
+    Mean of each side x side box minus the mean of the ring out to 2*side.
+
+    Returns the map and the level coordinates of its [0, 0] entry (the
+    top-left pixel of the first inner box). Positions whose outer box touches
+    a transparent pixel get 0.
+    """
+    outer = 2 * side
+    margin = (outer - side) // 2
+    rows = gray.shape[0] - outer + 1
+    cols = gray.shape[1] - outer + 1
+    if rows <= 0 or cols <= 0:
+        return np.zeros((0, 0), dtype=np.float64), (margin, margin)
+
+    gray_table = integral(np.where(valid, gray, 0))
+    valid_table = integral(valid)
+    inner = box_sums(gray_table, side, margin, (rows, cols))
+    total = box_sums(gray_table, outer, 0, (rows, cols))
+    complete = box_sums(valid_table, outer, 0, (rows, cols)) == outer * outer
+
+    inner_area = side * side
+    ring_area = outer * outer - inner_area
+    contrast = inner / inner_area - (total - inner) / ring_area
+    return np.where(complete, contrast, 0), (margin, margin)
+
+
+def pick_peaks(contrast, count, min_contrast, polarity, exclusion):
+    """Strongest positions of contrast, at least exclusion pixels apart."""
+    if polarity == "bright":
+        score = contrast.copy()
+    elif polarity == "dark":
+        score = -contrast
+    else:
+        score = np.abs(contrast)
+
+    peaks = []
+    while len(peaks) < count and score.size:
+        row, col = np.unravel_index(np.argmax(score), score.shape)
+        if score[row, col] < min_contrast:
+            break
+        peaks.append((row, col, float(contrast[row, col])))
+        score[max(0, row - exclusion):row + exclusion + 1, max(0, col - exclusion):col + exclusion + 1] = -np.inf
+    return peaks
+
+
+def refine_region(pyramid, row, col, square_size):
+    """
+    Full-resolution (rgba, row_off, col_off) around a (row, col) guess,
+    covering every window refine_center can move to, so a marker is read
+    from the source once.
+    """
+    # Each iteration recenters by at most half a window (square_size)
+    reach = (REFINE_ITERATIONS + 1) * square_size
+    return pyramid.read(0, int(round(row)) - reach, 2 * reach, int(round(col)) - reach, 2 * reach)
+
+
+def refine_center(region, row, col, square_size, bright):
+    """
+    Centroid of the marker pixels around a full-resolution (row, col) guess,
+    in a region read by refine_region.
+
+    A window twice the marker size is thresholded halfway between the marker
+    and its surroundings and recentered on the centroid until it settles.
+    """
+    pixels, region_row, region_col = region
+    for _ in range(REFINE_ITERATIONS):
+        half = square_size
+        row_off = max(region_row, int(round(row)) - half)
+        col_off = max(region_col, int(round(col)) - half)
+        row_end = min(region_row + pixels.shape[0], int(round(row)) + half)
+        col_end = min(region_col + pixels.shape[1], int(round(col)) + half)
+        rgba = pixels[
+            row_off - region_row:max(row_off, row_end) - region_row,
+            col_off - region_col:max(col_off, col_end) - region_col,
+        ]
+        gray, valid = luminance(rgba)
+        if not valid.any():
+            break
+
+        # Pixels within the expected square vs. the rest of the window
+        rr, cc = np.mgrid[:gray.shape[0], :gray.shape[1]]
+        inside = (np.abs(rr + row_off - row) < half / 2) & (np.abs(cc + col_off - col) < half / 2)
+        if not (inside & valid).any() or not (~inside & valid).any():
+            break
+        threshold = (gray[inside & valid].mean() + gray[~inside & valid].mean()) / 2
+        marker = (gray > threshold if bright else gray < threshold) & valid
+        if not marker.any():
+            break
+
+        new_row = rr[marker].mean() + row_off
+        new_col = cc[marker].mean() + col_off
+        moved = max(abs(new_row - row), abs(new_col - col))
+        row, col = new_row, new_col
+        if moved < 0.25:
+            break
+    return row, col
+
+
+def find_centers(image_path, square_size, count=2, min_contrast=30.0, polarity="any", pyramid_dir=None):
+    """
+    Locate up to count square markers of about square_size pixels in an image.
+
+    Returns a list of dicts with the full-resolution center (row, col), the
+    coarse contrast score and the marker polarity, ordered top to bottom and
+    left to right.
+    """
+    with Pyramid(image_path, pyramid_dir) as pyramid:
+        level = 0
+        while level + 1 < pyramid.n_levels and square_size >> (level + 1) >= COARSE_SQUARE_PIXELS:
+            level += 1
+        factor = 1 << level
+        side = max(1, square_size // factor)
+
+        with phase("decode"):
+            height, width = pyramid.level_shape(level)
+            rgba, _, _ = pyramid.read(level, 0, height, 0, width)
+
+        with phase("compute"):
+            gray, valid = luminance(rgba)
+            contrast, (off_row, off_col) = contrast_map(gray, valid, side)
+            peaks = pick_peaks(contrast, count, min_contrast, polarity, exclusion=side)
+
+            # Centers of the inner boxes, in full-resolution pixels
+            guesses = [
+                ((row + off_row + side / 2) * factor - 0.5, (col + off_col + side / 2) * factor - 0.5, score)
+                for row, col, score in peaks
+            ]
+
+        centers = []
+        # Top to bottom, so the PNG decoder never has to restart for a region above the last one
+        for guess_row, guess_col, score in sorted(guesses):
+            with phase("decode"):
+                region = refine_region(pyramid, guess_row, guess_col, square_size)
+            with phase("compute"):
+                bright = score > 0
+                center_row, center_col = refine_center(region, guess_row, guess_col, square_size, bright)
+                centers.append({
+                    "row": round(float(center_row), 2),
+                    "col": round(float(center_col), 2),
+                    "score": round(abs(score), 1),
+                    "polarity": "bright" if bright else "dark",
+                })
+
+    centers.sort(key=lambda c: (c["row"], c["col"]))
+    print(f"🎯 {os.path.basename(image_path)}: {len(centers)} marker(s) found")
+    return centers
+
+
+def write_centers(results, out_path):
+    """
+    Write {image_path: [center, ...]} as CSV or YAML (chosen by extension).
+    Image paths are stored relative to the output file's folder and targets
+    are numbered from 1 in the order found by find_centers.
+    """
+    base_dir = os.path.dirname(os.path.abspath(out_path))
+    rows = [
+        {"image": os.path.relpath(os.path.abspath(path), base_dir), "target": i, **center}
+        for path, centers in results.items()
+        for i, center in enumerate(centers, start=1)
+    ]
+
+    if out_path.lower().endswith((".yaml", ".yml")):
+        data = {}
+        for row in rows:
+            data.setdefault(row.pop("image"), []).append(row)
+        with open(out_path, "w") as f:
+            yaml.safe_dump(data, f, sort_keys=False)
+    else:
+        with open(out_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["image", "target", "row", "col", "score", "polarity"])
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def read_centers(path, image_path):
+    """
+    Centers listed for image_path in a CSV or YAML written by write_centers,
+    as {target: (row, col)}. Relative paths are resolved against the file's
+    folder; if no entry matches the full path, a unique basename match is used.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    if path.lower().endswith((".yaml", ".yml")):
+        with open(path) as f:
+            data = yaml.safe_load(f) or {}
+        rows = [{"image": image, **entry} for image, entries in data.items() for entry in entries]
+    else:
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+
+    def matches(key):
+        return [r for r in rows if key(r["image"])]
+
+    target = os.path.realpath(image_path)
+    selected = matches(lambda image: os.path.realpath(os.path.join(base_dir, image)) == target)
+    if not selected:
+        name = os.path.basename(image_path)
+        selected = matches(lambda image: os.path.basename(image) == name)
+        if len({r["image"] for r in selected}) > 1:
+            raise ValueError(f"{path}: several entries named {name}; use full paths")
+    if not selected:
+        raise ValueError(f"{path}: no centers listed for {image_path}")
+
+    return {int(r["target"]): (float(r["row"]), float(r["col"])) for r in selected}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect square marker centers in mosaics (headless getcenter).")
+    parser.add_argument("--images", nargs="+", required=True, help="Mosaic images to search")
+    parser.add_argument("--square-size", type=int, required=True, help="Approximate marker side in pixels")
+    parser.add_argument("--count", type=int, default=2, help="Markers to find per image (default: 2)")
+    parser.add_argument(
+        "--min-contrast", type=float, default=30.0,
+        help="Minimum gray-level difference between a marker and its surroundings (default: 30)",
+    )
+    parser.add_argument(
+        "--polarity", choices=["any", "bright", "dark"], default="any",
+        help="Whether markers are brighter or darker than the seabed (default: any)",
+    )
+    parser.add_argument("--output", required=True, help="Output .csv or .yaml with the centers")
+    parser.add_argument("--pyramid-dir", help="Pyramid cache folder (single image only; default: next to each image)")
+    parser.add_argument("--jobs", type=int, default=1, help="Images processed in parallel (default: 1)")
+    add_report_argument(parser)
+    args = parser.parse_args()
+
+    if args.pyramid_dir and len(args.images) > 1:
+        parser.error("--pyramid-dir can only be used with a single image")
+
+    tasks = [
+        (path, image_pixels(path),
+         (path, args.square_size, args.count, args.min_contrast, args.polarity, args.pyramid_dir))
+        for path in args.images
+    ]
+    results = run_tasks(tasks, find_centers, args.jobs)
+
+    found = {key: centers for key, centers, error in results if error is None}
+    write_centers(found, args.output)
+    print(f"💾 Centers saved to {args.output}")
+
+    failures = print_summary(results, "images")
+    write_report(args.report, "findcenters", vars(args))
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
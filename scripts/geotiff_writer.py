@@ -0,0 +1,220 @@
+"""Shared tiled, compressed and Cloud-Optimized GeoTIFF output for the scripts."""
+import os
+import warnings
+from contextlib import contextmanager
+import numpy as np
+from instrument import count_read, count_written, phase
+from validmask import ValidityMask
+
+COMPRESS_CHOICES = ("deflate", "zstd", "lzw", "none")
+DEFAULT_COMPRESS = "deflate"
+DEFAULT_BLOCKSIZE = 512
+
+
+def add_geotiff_arguments(parser):
+    """Register the output layout options shared by every GeoTIFF writer."""
+    parser.add_argument(
+        "--compress", choices=COMPRESS_CHOICES, default=DEFAULT_COMPRESS,
+        help=f"GeoTIFF compression (default: {DEFAULT_COMPRESS})",
+    )
+    parser.add_argument(
+        "--blocksize", type=int, default=DEFAULT_BLOCKSIZE,
+        help=f"Tile size in pixels, multiple of 16 (default: {DEFAULT_BLOCKSIZE})",
+    )
+    parser.add_argument(
+        "--num-threads", default="ALL_CPUS",
+        help="Compression threads, a number or ALL_CPUS (default: ALL_CPUS)",
+    )
+    add_cog_argument(parser)
+
+
+def add_mask_argument(parser):
+    """Register the --internal-mask flag of the PNG → GeoTIFF writers."""
+    parser.add_argument(
+        "--internal-mask", action="store_true",
+        help="Store the folder's compare_pngs validity mask sidecar as the GeoTIFF internal mask",
+    )
+
+
+def add_cog_argument(parser):
+    """Register the --cog flag."""
+    parser.add_argument(
+        "--cog", action="store_true",
+        help="Write a Cloud-Optimized GeoTIFF with internal overviews",
+    )
+
+
+def creation_options(compress=DEFAULT_COMPRESS, blocksize=DEFAULT_BLOCKSIZE, num_threads="ALL_CPUS"):
+    """GTiff creation options for a tiled, optionally compressed output."""
+    if blocksize % 16:
+        raise ValueError(f"Block size must be a multiple of 16, got {blocksize}")
+
+    options = {
+        "tiled": True,
+        "blockxsize": blocksize,
+        "blockysize": blocksize,
+        "num_threads": str(num_threads),
+        "BIGTIFF": "IF_SAFER",
+    }
+    if compress and compress != "none":
+        # Horizontal differencing makes photographic mosaics compress much better
+        options.update(compress=compress, predictor=2)
+    return options
+
+
+def translate_to_cog(
+    src_path, out_path,
+    compress=DEFAULT_COMPRESS, blocksize=DEFAULT_BLOCKSIZE, num_threads="ALL_CPUS",
+):
+    """
+    Rewrite a GeoTIFF as a COG and check the result.
+
+    GDAL's COG driver computes every decimated overview level in a single
+    pass over the source and lays out all IFDs before the tile data.
+    """
+    options = {
+        "driver": "COG",
+        "blocksize": blocksize,
+        "overview_resampling": "average",
+        "num_threads": str(num_threads),
+        "BIGTIFF": "IF_SAFER",
+    }
+    if compress and compress != "none":
+        options.update(compress=compress, predictor="YES")
+    else:
+        options.update(compress="NONE")
+
+    import rasterio.shutil
+
+    with phase("cog"):
+        rasterio.shutil.copy(src_path, out_path, **options)
+
+    errors = validate_cog(out_path)
+    if errors:
+        raise ValueError(f"❌ {out_path} is not a valid COG: " + "; ".join(errors))
+    print(f"☁️  Valid COG layout: {out_path}")
+
+
+def validate_cog(path):
+    """
+    Check the Cloud-Optimized GeoTIFF layout of path.
+
+    Returns a list of problems; an empty list means the file is a valid COG.
+    """
+    errors = []
+
+    # GDAL records the layout in a ghost area right after the TIFF header
+    with open(path, "rb") as f:
+        header = f.read(1024)
+    if b"LAYOUT=IFDS_BEFORE_DATA" not in header:
+        errors.append("IFDs are not located before the image data")
+    if b"BLOCK_ORDER=ROW_MAJOR" not in header:
+        errors.append("tiles are not stored in row-major order")
+
+    import rasterio
+
+    with rasterio.open(path) as src:
+        if src.driver != "GTiff":
+            errors.append(f"driver is {src.driver}, expected GTiff")
+        if src.tags(ns="IMAGE_STRUCTURE").get("LAYOUT") != "COG":
+            errors.append("LAYOUT=COG metadata is missing")
+
+        if not src.profile.get("tiled", False):
+            errors.append("main image is not tiled")
+
+        block_height, block_width = src.block_shapes[0]
+        if src.width > block_width or src.height > block_height:
+            if not src.overviews(1):
+                errors.append("no internal overviews")
+
+    return errors
+
+
+@contextmanager
+def geotiff_output(
+    out_path, cog=False,
+    compress=DEFAULT_COMPRESS, blocksize=DEFAULT_BLOCKSIZE, num_threads="ALL_CPUS",
+):
+    """
+    Context manager yielding the path a writer should create.
+
+    Without cog this is out_path itself. With cog the writer fills a temporary
+    GeoTIFF which is turned into a validated COG at out_path on exit.
+    """
+    if not cog:
+        yield out_path
+        return
+
+    tmp_path = f"{out_path}.tmp.tif"
+    try:
+        yield tmp_path
+        translate_to_cog(tmp_path, out_path, compress, blocksize, num_threads)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_png_as_geotiff(
+    png_path, out_path, transform, crs,
+    compress=DEFAULT_COMPRESS, blocksize=DEFAULT_BLOCKSIZE, num_threads="ALL_CPUS", cog=False, cache=None,
+    internal_mask=False,
+):
+    """
+    Copy a PNG into a tiled GeoTIFF with the given transform and CRS.
+
+    The PNG is decoded one row strip of tiles at a time and every strip is
+    written straight to its window, so memory stays flat with image size.
+    Band order matches np.array(Image.open(png_path)). With cog the result is
+    converted to a Cloud-Optimized GeoTIFF. With a DecodedCache, RGBA PNGs are
+    copied from the cached decode instead. With internal_mask the validity
+    mask sidecar of the PNG's folder (see compare_pngs) is written as the
+    GeoTIFF's internal 1-bit mask.
+    """
+    # rasterio is only loaded when writing, so the scripts' --help and argument helpers stay light
+    import rasterio
+    from rasterio.crs import CRS
+    from rasterio.errors import NotGeoreferencedWarning
+    from rasterio.windows import Window
+
+    mask = ValidityMask.for_image(png_path) if internal_mask else None
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        src = rasterio.open(png_path)
+
+    with src:
+        # Cached arrays are RGBA, which only matches a 4-band PNG
+        cached = cache.open(png_path) if cache is not None and src.count == 4 else None
+        profile = {
+            "driver": "GTiff",
+            "height": src.height,
+            "width": src.width,
+            "count": src.count,
+            "dtype": src.dtypes[0],
+            "crs": CRS.from_string(crs),
+            "transform": transform,
+        }
+        profile.update(creation_options(compress, blocksize, num_threads))
+
+        with geotiff_output(out_path, cog, compress, blocksize, num_threads) as path, \
+                rasterio.Env(GDAL_TIFF_INTERNAL_MASK=True):
+            with rasterio.open(path, "w", **profile) as dst:
+                for row_off in range(0, src.height, blocksize):
+                    window = Window(0, row_off, src.width, min(blocksize, src.height - row_off))
+                    with phase("decode"):
+                        if cached is not None:
+                            rows = cached[window.row_off:window.row_off + window.height]
+                            data = np.moveaxis(rows, -1, 0)
+                        else:
+                            data = src.read(window=window)
+                    with phase("encode"):
+                        dst.write(data, window=window)
+                        if mask is not None:
+                            valid = mask.read(window.row_off, window.height)
+                            dst.write_mask(valid.astype(np.uint8) * 255, window=window)
+                with phase("encode"):
+                    dst.close()
+
+    count_read(png_path)
+    count_written(out_path)
+
+    return out_path
@@ -1,21 +1,99 @@
 import argparse
-from PIL import Image
-import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
-Image.MAX_IMAGE_PIXELS = None
+from decodecache import add_cache_arguments, cache_from_args
+from pyramid import Pyramid
 
 
 clicked_points = []
 
+# Extra fraction of the visible area loaded around it so small pans need no reload
+VIEW_MARGIN = 0.25
+
 def get_center(p1, p2):
     row = (p1[0] + p2[0]) / 2
     col = (p1[1] + p2[1]) / 2
     return row, col
 
-def make_on_click(ax, fig, img_np):
+class PyramidView:
+    """
+    Keep the axes showing the pyramid level that matches the current zoom.
+
+    A coarse overview always covers the whole image; on top of it a detail
+    image holds only the visible region at the level fitting the viewport
+    (full resolution when zoomed in far enough). Both are placed with imshow
+    extents in full-resolution pixel coordinates, so event.xdata/ydata are
+    full-resolution col/row at every level.
+    """
+
+    def __init__(self, ax, pyramid):
+        self.ax = ax
+        self.pyramid = pyramid
+        self._loaded = None
+
+        overview, factor = pyramid.overview()
+        self.overview = ax.imshow(overview, origin='upper', extent=self._extent(0, 0, overview.shape, factor))
+        self.detail = ax.imshow(overview[:1, :1], origin='upper', extent=(0, 1, 1, 0), visible=False)
+        ax.set_xlim(-0.5, pyramid.width - 0.5)
+        ax.set_ylim(pyramid.height - 0.5, -0.5)
+
+        ax.callbacks.connect('xlim_changed', self.refresh)
+        ax.callbacks.connect('ylim_changed', self.refresh)
+        ax.figure.canvas.mpl_connect('resize_event', self.refresh)
+
+    @staticmethod
+    def _extent(row_off, col_off, shape, factor):
+        """imshow extent of a level region, in full-resolution pixel coordinates."""
+        left = col_off * factor - 0.5
+        top = row_off * factor - 0.5
+        return (left, left + shape[1] * factor, top + shape[0] * factor, top)
+
+    def refresh(self, *_):
+        x0, x1 = sorted(self.ax.get_xlim())
+        y0, y1 = sorted(self.ax.get_ylim())
+        # Space available to the axes before the equal aspect shrinks one side;
+        # the image fills it along the axis needing the coarser level
+        fig_bbox = self.ax.figure.bbox
+        box = self.ax.get_position(original=True)
+        bbox = box.transformed(matplotlib.transforms.BboxTransformTo(fig_bbox))
+        level = max(
+            self.pyramid.level_for(int(x1 - x0), int(bbox.width)),
+            self.pyramid.level_for(int(y1 - y0), int(bbox.height)),
+        )
+        factor = 1 << level
+
+        # Nothing to do while the loaded region still covers the view at this level
+        visible = (int(y0 + 0.5) // factor, int(x0 + 0.5) // factor,
+                   int(y1 + 0.5) // factor, int(x1 + 0.5) // factor)
+        if self._loaded is not None and self._loaded[0] == level:
+            _, top, left, bottom, right = self._loaded
+            if top <= visible[0] and left <= visible[1] and visible[2] < bottom and visible[3] < right:
+                return
+
+        # Visible region plus a margin, in level pixels
+        margin_rows = int((visible[2] - visible[0]) * VIEW_MARGIN) + 1
+        margin_cols = int((visible[3] - visible[1]) * VIEW_MARGIN) + 1
+        row_off, col_off = visible[0] - margin_rows, visible[1] - margin_cols
+        rows = visible[2] + margin_rows + 1 - row_off
+        cols = visible[3] + margin_cols + 1 - col_off
+
+        rgba, row_off, col_off = self.pyramid.read(level, row_off, rows, col_off, cols)
+        if rgba.size == 0:
+            self.detail.set_visible(False)
+            self._loaded = None
+            return
+        self.detail.set_data(rgba)
+        self.detail.set_extent(self._extent(row_off, col_off, rgba.shape, factor))
+        self.detail.set_visible(True)
+        self._loaded = (level, row_off, col_off, row_off + rgba.shape[0], col_off + rgba.shape[1])
+        self.ax.figure.canvas.draw_idle()
+
+def make_on_click(ax, fig):
+    markers = []
+
     def on_click(event):
         toolbar = plt.get_current_fig_manager().toolbar
-        if toolbar.mode != '':
+        if toolbar is not None and toolbar.mode != '':
             return  # Skip click if zoom/pan tool active
 
         if event.inaxes:
@@ -23,7 +101,7 @@ def make_on_click(ax, fig, img_np):
             clicked_points.append((row, col))
             print(f"Clicked: (row={row}, col={col})")
 
-            ax.plot(col, row, 'ro')
+            markers.extend(ax.plot(col, row, 'ro'))
             fig.canvas.draw()
 
             if len(clicked_points) == 2:
@@ -32,25 +110,20 @@ def make_on_click(ax, fig, img_np):
                 print(f"Center of square = (row={center[0]:.2f}, col={center[1]:.2f})")
 
                 # Draw the square's diagonal and center
-                ax.plot([p1[1], p2[1]], [p1[0], p2[0]], 'g-')  # row = y, col = x
-                ax.plot(center[1], center[0], 'yx', markersize=10)
-                ax.text(center[1], center[0],
+                markers.extend(ax.plot([p1[1], p2[1]], [p1[0], p2[0]], 'g-'))  # row = y, col = x
+                markers.extend(ax.plot(center[1], center[0], 'yx', markersize=10))
+                markers.append(ax.text(center[1], center[0],
                         f"({center[0]:.1f}, {center[1]:.1f})",  # row,col in label
                         color='yellow', fontsize=10, ha='left',
-                        bbox=dict(facecolor='black', alpha=0.5))
+                        bbox=dict(facecolor='black', alpha=0.5)))
                 fig.canvas.draw()
 
-                xlim = ax.get_xlim()
-                ylim = ax.get_ylim()
-
+                # Remove only the annotations; the image layers stay as they are
                 plt.pause(1)
-                ax.clear()
-                ax.imshow(img_np, origin='upper')
-                ax.set_title("Click two opposite vertices of a square")
-                ax.set_xlim(xlim)
-                ax.set_ylim(ylim)
-                ax.grid(True, color="white", alpha=0.5)  # show grid
-                fig.canvas.draw()
+                for artist in markers:
+                    artist.remove()
+                markers.clear()
+                fig.canvas.draw_idle()
 
                 clicked_points.clear()
     return on_click
@@ -58,19 +131,29 @@ def make_on_click(ax, fig, img_np):
 def main():
     parser = argparse.ArgumentParser(description="Click two points to define a square and show its center.")
     parser.add_argument("--path", type=str, required=True, help="Path to the image file")
+    parser.add_argument(
+        "--pyramid-dir",
+        help="Where the image pyramid is cached (default: <path>.pyramid next to the image)",
+    )
+    add_cache_arguments(parser)
     args = parser.parse_args()
 
-    # Load image
-    img = Image.open(args.path)
-    img_np = np.array(img)
+    # Reduced levels are built once and reused; only the visible region is read.
+    # Images the band readers refuse are decoded whole by Pillow, as before the pyramid
+    try:
+        pyramid = Pyramid(args.path, args.pyramid_dir, cache=cache_from_args(args), fallback=True)
+    except (OSError, ValueError) as e:
+        parser.error(f"cannot open {args.path}: {e}")
 
     fig, ax = plt.subplots()
-    ax.imshow(img_np, origin='upper')
+    view = PyramidView(ax, pyramid)
     ax.set_title("Click two opposite vertices of a square")
     ax.grid(True, color="white", alpha=0.5)  # enable grid
-    fig.canvas.mpl_connect('button_press_event', make_on_click(ax, fig, img_np))
+    fig.canvas.mpl_connect('button_press_event', make_on_click(ax, fig))
+    view.refresh()
 
     plt.show()
+    pyramid.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,142 @@
+"""
+Per-phase timing, I/O counters and JSON run reports shared by the scripts.
+
+Scripts wrap their work in phase("decode"), phase("compute"), phase("encode")
+(or finer names) and count the bytes they read and write; --report path.json
+then dumps the totals together with the peak memory of the run.
+"""
+import json
+import os
+import platform
+import resource
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+def peak_rss_bytes():
+    """Peak resident set size of the current process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Recorder:
+    """
+    Accumulates wall time per phase and bytes read/written.
+
+    Phases may be entered from several threads; their times are summed, so
+    with a thread pool a phase can exceed the run's wall time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.phases = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.worker_peak_rss = 0
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def add_read(self, nbytes):
+        with self._lock:
+            self.bytes_read += nbytes
+
+    def add_written(self, nbytes):
+        with self._lock:
+            self.bytes_written += nbytes
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def snapshot(self):
+        """Picklable totals, used to ship a worker process's numbers to the parent."""
+        return {
+            "phases": dict(self.phases),
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+
+    def merge(self, snapshot):
+        """Add a worker's snapshot to this recorder."""
+        with self._lock:
+            for name, seconds in snapshot["phases"].items():
+                self.phases[name] = self.phases.get(name, 0.0) + seconds
+            self.bytes_read += snapshot["bytes_read"]
+            self.bytes_written += snapshot["bytes_written"]
+            self.worker_peak_rss = max(self.worker_peak_rss, snapshot["peak_rss_bytes"])
+
+    def print_phases(self):
+        total = self.elapsed()
+        print("⏱️  Stage timings:")
+        for name, seconds in self.phases.items():
+            share = 100 * seconds / total if total else 0
+            print(f"   {name:<12} {seconds:8.2f} s  ({share:4.1f}%)")
+        print(f"   {'total':<12} {total:8.2f} s")
+
+    def report(self, script, params=None):
+        """Machine-readable summary of the run."""
+        return {
+            "script": script,
+            "argv": sys.argv[1:],
+            "params": params or {},
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "wall_seconds": self.elapsed(),
+            "phases": self.phases,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "worker_peak_rss_bytes": self.worker_peak_rss,
+            "host": socket.gethostname(),
+            "python": platform.python_version(),
+            "pid": os.getpid(),
+        }
+
+
+# Recorder of the current process
+RUN = Recorder()
+
+
+def phase(name):
+    """Time the enclosed block under name."""
+    return RUN.phase(name)
+
+
+def count_read(path):
+    """Count the size of a file that was read."""
+    RUN.add_read(os.path.getsize(path))
+
+
+def count_written(path):
+    """Count the size of a file that was written."""
+    RUN.add_written(os.path.getsize(path))
+
+
+def add_report_argument(parser):
+    """Register the --report option."""
+    parser.add_argument("--report", help="Write a JSON run report (timings, bytes, peak memory) to this path")
+
+
+def write_report(path, script, params=None):
+    """Write the JSON report for this run if a path was given."""
+    if not path:
+        return
+    with open(path, "w") as f:
+        json.dump(RUN.report(script, params), f, indent=2)
+    print(f"📝 Report written to {path}")
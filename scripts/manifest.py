@@ -0,0 +1,83 @@
+"""Per-tree processing manifest so re-runs skip work that is already up to date."""
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = ".opencosmos_manifest.json"
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def file_sha256(path):
+    """SHA-256 of a file's content, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Sidecar JSON file at the root of a survey tree.
+
+    Each entry is keyed by a task name (e.g. 'rotate_folder:dive3/mosaic_x.png')
+    and stores the parameters used plus the size, mtime and content hash of
+    every file the task read or wrote. A task is up to date when the
+    parameters match and every file is unchanged. Files whose mtime changed
+    but whose content did not (e.g. after a copy) still count as unchanged.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.path = os.path.join(self.root, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f).get("entries", {})
+
+    def _rel(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def key(self, script, path):
+        """Manifest key for a task of script operating on path."""
+        return f"{script}:{self._rel(path)}"
+
+    def _signature(self, path):
+        stat = os.stat(path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_sha256(path)}
+
+    def _unchanged(self, path, recorded):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if stat.st_size != recorded["size"]:
+            return False
+        if stat.st_mtime_ns == recorded["mtime_ns"]:
+            return True
+        return file_sha256(path) == recorded["sha256"]
+
+    def is_up_to_date(self, key, files, params):
+        """True if key was recorded with the same params and the same, unchanged files."""
+        entry = self.entries.get(key)
+        if entry is None or entry["params"] != params:
+            return False
+
+        recorded = entry["files"]
+        if set(recorded) != {self._rel(p) for p in files}:
+            return False
+        return all(self._unchanged(os.path.join(self.root, rel), sig) for rel, sig in recorded.items())
+
+    def record(self, key, files, params):
+        """Store the current state of files for key."""
+        self.entries[key] = {
+            "params": params,
+            "files": {self._rel(p): self._signature(p) for p in files if os.path.exists(p)},
+        }
+
+    def save(self):
+        """Write the manifest atomically."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": 1, "entries": self.entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
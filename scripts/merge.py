@@ -0,0 +1,271 @@
+"""
+Merge georeferenced mosaics (e.g. one png2geotiff output per dive) into a single GeoTIFF.
+
+The output grid covers the union of the input footprints at the finest
+input resolution. It is filled window by window on a process pool: a grid
+index of the input footprints tells each window which inputs overlap it,
+and every input is read through a WarpedVRT onto the output grid, so only
+the pixels under the window are read. Pixels are transparent where an
+input's alpha (or mask) is 0, and also where a 'mosaic_x' input is black,
+as in compare_pngs. Windows no input covers are never written.
+
+python3 merge.py --inputs dive1/mosaic_x2.tif dive2/mosaic_x2.tif --output survey.tif --jobs 8
+python3 merge.py --inputs */mosaic_x2.tif --output survey.tif --rule max-alpha --cog
+"""
+import argparse
+import math
+import os
+from functools import lru_cache
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform, transform_bounds
+from rasterio.windows import Window
+from compare_pngs import build_transparency_mask
+from geotiff_writer import (
+    DEFAULT_BLOCKSIZE, DEFAULT_COMPRESS, add_geotiff_arguments, creation_options, geotiff_output,
+)
+from instrument import add_report_argument, count_read, count_written, phase, write_report
+from rasterbands import read_indexes, rgba_indexes, to_rgba
+from scheduler import print_summary, run_streamed
+
+RULES = ("first", "last", "max-alpha")
+# Output window side in blocks; a window is the unit of work of a worker
+WINDOW_BLOCKS = 4
+# Relative error of coord / res within which a coordinate is on a grid line;
+# projected coordinates are large, so a fixed fraction of a pixel would be
+# below float resolution
+GRID_TOLERANCE = 1e-12
+
+
+def footprint(src, crs):
+    """(left, bottom, right, top) of a dataset in crs, allowing for rotated transforms."""
+    corners = [src.transform * (col, row) for col in (0, src.width) for row in (0, src.height)]
+    xs, ys = zip(*corners)
+    bounds = (min(xs), min(ys), max(xs), max(ys))
+    if CRS.from_user_input(crs) != src.crs:
+        bounds = transform_bounds(src.crs, crs, *bounds)
+    return bounds
+
+
+def pixel_size(src, crs):
+    """(x, y) size of a dataset's pixels in crs units."""
+    if CRS.from_user_input(crs) == src.crs:
+        # Length of the column / row vectors, so rotated grids keep their scale
+        return math.hypot(src.transform.a, src.transform.d), math.hypot(src.transform.b, src.transform.e)
+    transform, _, _ = calculate_default_transform(src.crs, crs, src.width, src.height, *src.bounds)
+    return abs(transform.a), abs(transform.e)
+
+
+def snap(coord, res, rounding):
+    """
+    coord rounded down (math.floor) or up (math.ceil) to a multiple of res.
+    Coordinates within floating-point noise of a grid line stay on it.
+    """
+    steps = coord / res
+    nearest = round(steps)
+    if math.isclose(steps, nearest, rel_tol=GRID_TOLERANCE, abs_tol=GRID_TOLERANCE):
+        return nearest * res
+    return rounding(steps) * res
+
+
+def output_grid(paths, crs=None, resolution=None):
+    """
+    (crs, transform, width, height, footprints) of the north-up grid that
+    covers every input. crs defaults to the first input's and resolution to
+    the finest input pixel size. Grid lines fall on multiples of the
+    resolution, so merges of the same area line up.
+    """
+    footprints = []
+    sizes = []
+    for path in paths:
+        with rasterio.open(path) as src:
+            if src.crs is None:
+                raise ValueError(f"{path} has no CRS; georeference it first")
+            crs = crs or src.crs.to_string()
+            footprints.append(footprint(src, crs))
+            sizes.append(pixel_size(src, crs))
+
+    res_x, res_y = (resolution, resolution) if resolution else (min(s[0] for s in sizes), min(s[1] for s in sizes))
+    left = snap(min(f[0] for f in footprints), res_x, math.floor)
+    bottom = snap(min(f[1] for f in footprints), res_y, math.floor)
+    right = snap(max(f[2] for f in footprints), res_x, math.ceil)
+    top = snap(max(f[3] for f in footprints), res_y, math.ceil)
+    width = int(round((right - left) / res_x))
+    height = int(round((top - bottom) / res_y))
+    return crs, from_origin(left, top, res_x, res_y), width, height, footprints
+
+
+def grid_index(footprints, transform, width, height, window_size):
+    """
+    Spatial index of the input footprints over the output windows:
+    {(window_row, window_col): [input indices, in input order]}.
+    Windows no footprint touches are absent.
+    """
+    inverse = ~transform
+    n_rows = -(-height // window_size)
+    n_cols = -(-width // window_size)
+    index = {}
+    for i, (left, bottom, right, top) in enumerate(footprints):
+        col0, row0 = inverse * (left, top)
+        col1, row1 = inverse * (right, bottom)
+        for wr in range(max(0, int(row0 // window_size)), min(n_rows, int(math.ceil(row1 / window_size)))):
+            for wc in range(max(0, int(col0 // window_size)), min(n_cols, int(math.ceil(col1 / window_size)))):
+                index.setdefault((wr, wc), []).append(i)
+    return index
+
+
+@lru_cache(maxsize=None)
+def _dataset(path):
+    """Input dataset, kept open for the lifetime of a worker."""
+    return rasterio.open(path)
+
+
+def read_rgba(path, grid, window, resampling="nearest"):
+    """
+    Read window of the output grid from an input as (rows, cols, 4) RGBA.
+    Colour bands are picked by colour interpretation (see rasterbands), and
+    alpha combines the input's alpha band, if it declares one, with its
+    GDAL mask (internal mask, nodata, outside the footprint). Alpha is 0
+    wherever compare_pngs would treat the pixel as transparent.
+    """
+    crs, transform, width, height = grid
+    src = _dataset(path)
+    indexes = rgba_indexes(src)
+    with WarpedVRT(
+        src, crs=crs, transform=transform, width=width, height=height, resampling=Resampling[resampling],
+    ) as vrt:
+        data = vrt.read(indexes=read_indexes(indexes), window=window)
+        mask = vrt.dataset_mask(window=window)
+
+    rgba = to_rgba(data, indexes, mask)
+    rgba[build_transparency_mask([rgba], [os.path.basename(path)])] = 0
+    return rgba
+
+
+def merge_window(paths, grid, window, rule="first", resampling="nearest"):
+    """
+    Combine the inputs overlapping window (given in the order they were
+    listed) with rule: first or last valid input wins, or max-alpha takes
+    the most opaque input. Returns the RGBA window, or None if it is empty.
+    """
+    out = None
+    for path in paths:
+        with phase("decode"):
+            rgba = read_rgba(path, grid, window, resampling)
+        with phase("compute"):
+            alpha = rgba[..., 3]
+            if out is None:
+                out = rgba
+                continue
+            if rule == "first":
+                take = (alpha > 0) & (out[..., 3] == 0)
+            elif rule == "last":
+                take = alpha > 0
+            else:
+                take = alpha > out[..., 3]
+            out[take] = rgba[take]
+    if out is None or not out[..., 3].any():
+        return None
+    return out
+
+
+def merge_geotiffs(
+    paths, out_path, rule="first", crs=None, resolution=None, resampling="nearest", jobs=1,
+    compress=DEFAULT_COMPRESS, blocksize=DEFAULT_BLOCKSIZE, num_threads="ALL_CPUS", cog=False,
+):
+    """
+    Merge the 8-bit GeoTIFFs in paths into one RGBA GeoTIFF at out_path.
+
+    At most 2 * jobs windows of WINDOW_BLOCKS x WINDOW_BLOCKS blocks are in
+    flight, so memory does not grow with the survey extent. Returns the
+    number of failed windows.
+    """
+    for path in paths:
+        with rasterio.open(path) as src:
+            if any(dt != "uint8" for dt in src.dtypes):
+                raise ValueError(f"{path} is not 8-bit; convert it with uint8.py first")
+
+    with phase("index"):
+        crs, transform, width, height, footprints = output_grid(paths, crs, resolution)
+        window_size = WINDOW_BLOCKS * blocksize
+        index = grid_index(footprints, transform, width, height, window_size)
+    print(
+        f"🗺️  Merging {len(paths)} mosaics into a {width}x{height} grid ({crs}, "
+        f"{transform.a:.4g} m pixels); {len(index)} windows to fill"
+    )
+
+    grid = (crs, transform, width, height)
+    tasks = []
+    for wr, wc in sorted(index):
+        window = Window(
+            wc * window_size, wr * window_size,
+            min(window_size, width - wc * window_size), min(window_size, height - wr * window_size),
+        )
+        tasks.append(((wr, wc), ([paths[i] for i in index[(wr, wc)]], grid, window, rule, resampling)))
+
+    profile = {
+        "driver": "GTiff", "width": width, "height": height, "count": 4, "dtype": "uint8",
+        "crs": CRS.from_user_input(crs), "transform": transform, "photometric": "RGB", "alpha": "YES",
+        # Windows without data are left out of the file and read back as transparent
+        "sparse_ok": True,
+    }
+    profile.update(creation_options(compress, blocksize, num_threads))
+
+    with geotiff_output(out_path, cog, compress, blocksize, num_threads) as path:
+        with rasterio.open(path, "w", **profile) as dst:
+            def write(key, rgba):
+                if rgba is None:
+                    return 0
+                wr, wc = key
+                window = Window(wc * window_size, wr * window_size, rgba.shape[1], rgba.shape[0])
+                with phase("encode"):
+                    dst.write(np.moveaxis(rgba, -1, 0), window=window)
+                return 1
+
+            results = run_streamed(tasks, merge_window, write, jobs)
+            with phase("encode"):
+                dst.close()
+
+    for p in paths:
+        count_read(p)
+    count_written(out_path)
+    written = sum(r for _, r, error in results if error is None)
+    failures = print_summary(results, "windows")
+    print(f"✅ Merged into {out_path} ({written} windows with data)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge georeferenced mosaics into a single GeoTIFF.")
+    parser.add_argument("--inputs", nargs="+", required=True, help="8-bit GeoTIFFs, in priority order")
+    parser.add_argument("--output", required=True, help="Merged GeoTIFF")
+    parser.add_argument(
+        "--rule", choices=RULES, default="first",
+        help="Where inputs overlap: the first or last listed valid input, or the most opaque (default: first)",
+    )
+    parser.add_argument("--crs", help="Output CRS (default: that of the first input)")
+    parser.add_argument("--resolution", type=float, help="Output pixel size in CRS units (default: finest input)")
+    parser.add_argument(
+        "--resampling", choices=["nearest", "bilinear", "cubic", "lanczos"], default="nearest",
+        help="Resampling onto the output grid (default: nearest)",
+    )
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Worker processes (default: all CPUs)")
+    add_geotiff_arguments(parser)
+    add_report_argument(parser)
+    args = parser.parse_args()
+
+    failures = merge_geotiffs(
+        args.inputs, args.output, args.rule, args.crs, args.resolution, args.resampling, args.jobs,
+        args.compress, args.blocksize, args.num_threads, args.cog,
+    )
+    write_report(args.report, "merge", vars(args))
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
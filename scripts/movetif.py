@@ -1,30 +1,188 @@
 #!/usr/bin/env python3
 import argparse
+import csv
+import shutil
+import struct
 import rasterio
 from rasterio.transform import Affine
+from rasterio.windows import Window
 import os
+from geotiff_writer import DEFAULT_BLOCKSIZE, add_cog_argument, geotiff_output
+from instrument import add_report_argument, count_read, count_written, phase, write_report
+from scheduler import print_summary, run_tasks
 
-def move_geotiff(input_path, output_path, north_shift, east_shift):
+# GeoTIFF tags holding the raster → model placement (both stored as DOUBLE)
+MODEL_TIEPOINT_TAG = 33922
+MODEL_TRANSFORMATION_TAG = 34264
+TIFF_DOUBLE = 12
+
+
+def shifted_transform(transform, north_shift, east_shift):
+    """Return transform with its origin shifted by the given distances (in meters)."""
+    return transform * Affine.translation(east_shift / transform.a, -north_shift / transform.e)
+
+
+def _patch_geotiff_origin(path, dx, dy):
+    """
+    Add (dx, dy) to the model origin stored in the first IFD of a GeoTIFF,
+    overwriting only the affected doubles. Handles classic TIFF and BigTIFF
+    with a single tiepoint or a transformation matrix. Returns False if the
+    file does not have such a layout, leaving it untouched.
+    """
+    with open(path, "r+b") as f:
+        header = f.read(16)
+        byteorder = {b"II": "<", b"MM": ">"}.get(header[:2])
+        if byteorder is None:
+            return False
+
+        version = struct.unpack(byteorder + "H", header[2:4])[0]
+        if version == 42:
+            ifd_offset = struct.unpack(byteorder + "I", header[4:8])[0]
+            count_fmt, entry_fmt = "H", "HHII"
+        elif version == 43:
+            ifd_offset = struct.unpack(byteorder + "Q", header[8:16])[0]
+            count_fmt, entry_fmt = "Q", "HHQQ"
+        else:
+            return False
+
+        f.seek(ifd_offset)
+        count_size = struct.calcsize(count_fmt)
+        n_entries = struct.unpack(byteorder + count_fmt, f.read(count_size))[0]
+        entry_size = struct.calcsize(byteorder + entry_fmt)
+        entries = f.read(n_entries * entry_size)
+
+        for i in range(n_entries):
+            tag, field_type, n_values, value_offset = struct.unpack_from(
+                byteorder + entry_fmt, entries, i * entry_size
+            )
+            if field_type != TIFF_DOUBLE:
+                continue
+            if tag == MODEL_TIEPOINT_TAG and n_values == 6:
+                # (I, J, K, X, Y, Z): shift X and Y
+                slots = (3, 4)
+            elif tag == MODEL_TRANSFORMATION_TAG and n_values == 16:
+                # Row-major 4x4 matrix: translation is in column 3
+                slots = (3, 7)
+            else:
+                continue
+
+            f.seek(value_offset)
+            values = list(struct.unpack(byteorder + f"{n_values}d", f.read(8 * n_values)))
+            values[slots[0]] += dx
+            values[slots[1]] += dy
+            f.seek(value_offset)
+            f.write(struct.pack(byteorder + f"{n_values}d", *values))
+            return True
+
+    return False
+
+
+def shift_in_place(path, north_shift, east_shift):
+    """
+    Shift a GeoTIFF by rewriting only its geotransform; pixels are not touched.
+
+    The GeoTIFF origin doubles are patched directly, which keeps tiling,
+    compression and COG layout intact. Files without that layout fall back to
+    a GDAL metadata update.
+    """
+    with rasterio.open(path) as src:
+        transform = src.transform
+    moved_transform = shifted_transform(transform, north_shift, east_shift)
+
+    patched = _patch_geotiff_origin(path, moved_transform.c - transform.c, moved_transform.f - transform.f)
+    if patched:
+        with rasterio.open(path) as src:
+            patched = src.transform.almost_equals(moved_transform)
+
+    if not patched:
+        with rasterio.open(path, "r+", IGNORE_COG_LAYOUT_BREAK="YES") as dst:
+            dst.transform = moved_transform
+
+    return moved_transform
+
+
+def move_geotiff(input_path, output_path, north_shift, east_shift, cog=False, in_place=False):
     """
     Move a GeoTIFF by given distances (in meters).
     Positive north_shift moves north (up),
     Positive east_shift moves east (right).
+
+    With in_place the input file itself is updated and output_path is ignored.
+    Otherwise the file is copied byte for byte (compressed tiles are never
+    decoded) and the copy is shifted. With cog the output is re-encoded as a
+    Cloud-Optimized GeoTIFF instead.
     """
+    if in_place:
+        with phase("geotransform"):
+            shift_in_place(input_path, north_shift, east_shift)
+        print(f"✅ Moved {os.path.basename(input_path)} by ({north_shift} m north, {east_shift} m east)")
+        print(f"💾 Updated in place: {input_path}")
+        return input_path
+
+    if not cog:
+        with phase("copy"):
+            shutil.copyfile(input_path, output_path)
+        count_read(input_path)
+        count_written(output_path)
+        with phase("geotransform"):
+            shift_in_place(output_path, north_shift, east_shift)
+        print(f"✅ Moved {os.path.basename(input_path)} by ({north_shift} m north, {east_shift} m east)")
+        print(f"💾 Saved as: {output_path}")
+        return output_path
+
     with rasterio.open(input_path) as src:
-        transform = src.transform
-        
         # Modify the affine transform: shift origin
-        moved_transform = transform * Affine.translation(east_shift / transform.a, -north_shift / transform.e)
-        
+        moved_transform = shifted_transform(src.transform, north_shift, east_shift)
+
         # Copy metadata and update transform
         meta = src.meta.copy()
         meta.update(transform=moved_transform)
-        
-        with rasterio.open(output_path, 'w', **meta) as dst:
-            dst.write(src.read())
+
+        # Copied in row strips, so memory stays flat with the raster size
+        with geotiff_output(output_path, cog) as path:
+            with rasterio.open(path, 'w', **meta) as dst:
+                for row_off in range(0, src.height, DEFAULT_BLOCKSIZE):
+                    window = Window(0, row_off, src.width, min(DEFAULT_BLOCKSIZE, src.height - row_off))
+                    with phase("decode"):
+                        data = src.read(window=window)
+                    with phase("encode"):
+                        dst.write(data, window=window)
+    count_read(input_path)
+    count_written(output_path)
 
     print(f"✅ Moved {os.path.basename(input_path)} by ({north_shift} m north, {east_shift} m east)")
     print(f"💾 Saved as: {output_path}")
+    return output_path
+
+
+def read_offsets_csv(csv_path):
+    """
+    Read per-file offsets from a CSV with columns input, north, east and an
+    optional output. Relative paths are resolved against the CSV's folder.
+    """
+    base_dir = os.path.dirname(os.path.abspath(csv_path))
+    rows = []
+    with open(csv_path, newline="") as f:
+        for row in csv.DictReader(f):
+            input_path = os.path.join(base_dir, row["input"].strip())
+            output_path = (row.get("output") or "").strip()
+            if output_path:
+                output_path = os.path.join(base_dir, output_path)
+            else:
+                base, ext = os.path.splitext(input_path)
+                output_path = f"{base}_moved{ext}"
+            rows.append((input_path, output_path, float(row["north"]), float(row["east"])))
+    return rows
+
+
+def move_batch(csv_path, cog=False, in_place=False):
+    """Shift every file listed in csv_path, returning per-file results."""
+    tasks = [
+        (input_path, 0, (input_path, output_path, north, east, cog, in_place))
+        for input_path, output_path, north, east in read_offsets_csv(csv_path)
+    ]
+    return run_tasks(tasks, move_geotiff)
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -34,11 +192,32 @@ def main():
     parser.add_argument("--output", help="Output GeoTIFF file (.tif)")
     parser.add_argument("--north", type=float, default=0.0, help="Shift north (meters, positive = north)")
     parser.add_argument("--east", type=float, default=0.0, help="Shift east (meters, positive = east)")
+    parser.add_argument("--in-place", action="store_true", help="Update only the geotransform of the input file")
+    parser.add_argument(
+        "--batch",
+        help="CSV with columns input,north,east[,output] to shift many files in one call",
+    )
+    add_cog_argument(parser)
+    add_report_argument(parser)
 
     args = parser.parse_args()
 
-    move_geotiff(args.input, args.output, args.north, args.east)
+    if args.in_place and args.cog:
+        parser.error("--in-place cannot be combined with --cog")
+
+    if args.batch:
+        results = move_batch(args.batch, args.cog, args.in_place)
+        failures = print_summary(results, "files")
+        write_report(args.report, "movetif", vars(args))
+        if failures:
+            raise SystemExit(1)
+        return
+
+    if not args.input or not (args.output or args.in_place):
+        parser.error("--input and either --output or --in-place are required")
+
+    move_geotiff(args.input, args.output, args.north, args.east, args.cog, args.in_place)
+    write_report(args.report, "movetif", vars(args))
 
 if __name__ == "__main__":
     main()
-
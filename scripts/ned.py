@@ -0,0 +1,83 @@
+"""
+Conversion from a local North-East-Down frame to WGS84 geodetic coordinates.
+
+Vectorized replacement for cola2_lib.utils.ned.NED.ned2geodetic: NED offsets
+are rotated into Earth-centered Earth-fixed coordinates about the origin and
+converted back to latitude/longitude with Zhu's closed-form solution, for
+whole arrays of points at once and with nothing beyond numpy.
+"""
+import numpy as np
+
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+# First and second eccentricity squared
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+WGS84_EP2 = WGS84_E2 / (1 - WGS84_E2)
+
+
+def geodetic_to_ecef(lat, lon, height=0.0):
+    """ECEF (x, y, z) in meters of geodetic lat/lon (degrees) and ellipsoidal height."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    radius = WGS84_A / np.sqrt(1 - WGS84_E2 * np.sin(lat) ** 2)
+    return (
+        (radius + height) * np.cos(lat) * np.cos(lon),
+        (radius + height) * np.cos(lat) * np.sin(lon),
+        (radius * (1 - WGS84_E2) + height) * np.sin(lat),
+    )
+
+
+def ecef_to_geodetic(x, y, z):
+    """
+    Geodetic (lat, lon, height) of ECEF coordinates, in degrees and meters.
+
+    J. Zhu, "Conversion of Earth-centered Earth-fixed coordinates to geodetic
+    coordinates", IEEE Trans. Aerospace and Electronic Systems 30 (1994).
+    """
+    r2 = x ** 2 + y ** 2
+    r = np.sqrt(r2)
+    f = 54 * WGS84_B ** 2 * z ** 2
+    g = r2 + (1 - WGS84_E2) * z ** 2 - WGS84_E2 * (WGS84_A ** 2 - WGS84_B ** 2)
+    c = WGS84_E2 ** 2 * f * r2 / g ** 3
+    s = np.cbrt(1 + c + np.sqrt(c ** 2 + 2 * c))
+    p = f / (3 * (s + 1 / s + 1) ** 2 * g ** 2)
+    q = np.sqrt(1 + 2 * WGS84_E2 ** 2 * p)
+    r0 = -p * WGS84_E2 * r / (1 + q) + np.sqrt(
+        0.5 * WGS84_A ** 2 * (1 + 1 / q) - p * (1 - WGS84_E2) * z ** 2 / (q * (1 + q)) - 0.5 * p * r2
+    )
+    u = np.sqrt((r - WGS84_E2 * r0) ** 2 + z ** 2)
+    v = np.sqrt((r - WGS84_E2 * r0) ** 2 + (1 - WGS84_E2) * z ** 2)
+    z0 = WGS84_B ** 2 * z / (WGS84_A * v)
+    height = u * (1 - WGS84_B ** 2 / (WGS84_A * v))
+    lat = np.arctan2(z + WGS84_EP2 * z0, r)
+    lon = np.arctan2(y, x)
+    return np.degrees(lat), np.degrees(lon), height
+
+
+def ned_rotation(lat, lon):
+    """Rows are the north, east and down unit vectors at lat/lon (degrees) in ECEF."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    sin_lon, cos_lon = np.sin(lon), np.cos(lon)
+    return np.array([
+        [-sin_lat * cos_lon, -sin_lat * sin_lon, cos_lat],
+        [-sin_lon, cos_lon, 0.0],
+        [-cos_lat * cos_lon, -cos_lat * sin_lon, -sin_lat],
+    ])
+
+
+def ned_to_geodetic(north, east, down, origin_lat, origin_lon, origin_height=0.0):
+    """
+    Geodetic (lat, lon, height) of NED offsets in meters from the origin.
+
+    north, east and down may be scalars or arrays of any (broadcastable)
+    shape; the result has the broadcast shape.
+    """
+    ned = np.stack(np.broadcast_arrays(
+        np.asarray(north, dtype=np.float64), np.asarray(east, dtype=np.float64),
+        np.asarray(down, dtype=np.float64),
+    ))
+    origin = np.array(geodetic_to_ecef(origin_lat, origin_lon, origin_height))
+    offsets = np.tensordot(ned_rotation(origin_lat, origin_lon).T, ned, axes=1)
+    x, y, z = offsets + origin.reshape((3,) + (1,) * (ned.ndim - 1))
+    return ecef_to_geodetic(x, y, z)
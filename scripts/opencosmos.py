@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Single entry point for the mosaic scripts: opencosmos <command> [args].
+
+Each command is an existing script, run through its main() with the
+remaining arguments. Only the script a command names is imported, so
+rasterio, pyproj, matplotlib and the other heavy dependencies are loaded
+when a command needs them, and listing the commands imports nothing.
+
+python3 opencosmos.py                                  # list the commands
+python3 opencosmos.py compare-pngs --folder ../data/mosaics --jobs 4
+python3 opencosmos.py png2geotiff --survey ../data/mosaics/stelm --ned_origin_lat 39.578535 --ned_origin_lon 2.3502617
+python3 opencosmos.py merge --help
+"""
+import importlib
+import sys
+
+# command: (module, summary)
+COMMANDS = {
+    "compare-pngs": ("compare_pngs", "Remove pixels transparent in any PNG of each folder"),
+    "deleteblack": ("deleteblack", "Make black pixels transparent in a PNG"),
+    "rotate": ("rotate", "Rotate a PNG 90° counterclockwise"),
+    "rotate-folder": ("rotate_folder", "Rotate every PNG in a folder tree"),
+    "getcenter": ("getcenter", "Click two points to find a square marker's center"),
+    "findcenters": ("findcenters", "Detect square marker centers in mosaics (headless)"),
+    "png2geotiff": ("png2geotiff", "Georeference PNGs from HM YAMLs or control points"),
+    "png2geotiff-simple": ("png2geotiff_simple", "Georeference a PNG from pixel size and top-left corner"),
+    "movetif": ("movetif", "Move GeoTIFFs north/east by given distances"),
+    "align": ("align", "Estimate (and apply) GeoTIFF co-registration shifts"),
+    "uint8": ("uint8", "Convert uint16 GeoTIFFs to uint8"),
+    "merge": ("merge", "Merge georeferenced mosaics into a single GeoTIFF"),
+    "tiles": ("tiles", "Export a GeoTIFF as XYZ/TMS tiles or MBTiles"),
+    "pipeline": ("pipeline", "Run the mosaic processing chain in one pass"),
+    "benchmark": ("benchmark", "Benchmark the scripts on synthetic mosaics"),
+}
+
+
+def usage():
+    width = max(len(name) for name in COMMANDS)
+    lines = ["usage: opencosmos <command> [args]", "", "commands:"]
+    lines += [f"  {name:<{width}}  {summary}" for name, (_, summary) in COMMANDS.items()]
+    lines += ["", "Run 'opencosmos <command> --help' for a command's options."]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print(usage())
+        return
+    name, rest = argv[0], argv[1:]
+    if name not in COMMANDS:
+        print(f"opencosmos: unknown command '{name}'\n\n{usage()}", file=sys.stderr)
+        raise SystemExit(2)
+
+    module = importlib.import_module(COMMANDS[name][0])
+    # The script parses sys.argv itself; its usage lines read "opencosmos <command>"
+    sys.argv = [f"opencosmos {name}", *rest]
+    module.main()
+
+
+if __name__ == "__main__":
+    main()
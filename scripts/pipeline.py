@@ -0,0 +1,419 @@
+"""
+Run the mosaic processing chain in a single streaming pass.
+
+Instead of running deleteblack → compare_pngs → rotate → png2geotiff → uint8
+as separate CLIs, each re-encoding the full image on disk, the stages are
+applied to row bands of the input as they are read, and the result is
+encoded once. Rotation needs whole columns, so a rotate stage spools the
+band stream to a raw memory-mapped temporary file and continues from there.
+
+Example pipeline config (relative paths are resolved against the config's
+folder):
+
+    input: 3/mosaic_x2.png
+    max_memory: 1G
+    stages:
+      - deleteblack: {threshold: 4}
+      - compare: {with: [3/mosaic_x1.png]}
+      - rotate: {}
+    output:
+      path: 3/mosaic_x2.tif
+      compress: zstd
+      cog: true
+      georeference:
+        top_left_lat: 39.5785
+        top_left_lon: 2.3502
+        pixel_size_x: 0.005
+        pixel_size_y: 0.005
+        crs: EPSG:25831
+      tiles:                      # optional web export of the GeoTIFF, see tiles.py
+        path: 3/tiles.mbtiles
+        format: webp
+        zoom: [16, 22]
+
+For two-point georeferencing use yaml1, yaml2, pixel1, pixel2,
+ned_origin_lat and ned_origin_lon (plus crs) instead, as in png2geotiff.
+
+python3 pipeline.py --config pipeline.yaml
+"""
+import argparse
+import os
+import tempfile
+import warnings
+import numpy as np
+import rasterio
+import yaml
+from rasterio.crs import CRS
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.windows import Window
+from compare_pngs import build_transparency_mask
+from deleteblack import make_black_transparent
+import instrument
+from instrument import add_report_argument, count_read, count_written, write_report
+from geotiff_writer import DEFAULT_BLOCKSIZE, DEFAULT_COMPRESS, creation_options, geotiff_output
+from pngstream import PngBandReader, PngBandWriter, iter_bands, parse_size, rows_per_band
+from tiles import export_tiles
+from uint8 import apply_band_metadata, convert_block
+
+DEFAULT_MAX_MEMORY = "512M"
+
+
+class RasterSource:
+    """
+    Band reader for the pipeline input, yielding (rows, width, bands) arrays.
+
+    8-bit PNGs are expanded to RGBA exactly like Image.convert('RGBA');
+    other rasters (e.g. uint16 GeoTIFFs) keep their native bands and dtype.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._png = None
+        self._src = None
+        self.transform = None
+        self.crs = None
+        self.nodata = None
+        self.tags = {}
+        self.band_tags = []
+        if path.lower().endswith(".png"):
+            try:
+                self._png = PngBandReader(path)
+            except ValueError:
+                self._png = None
+        if self._png is None:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", NotGeoreferencedWarning)
+                self._src = rasterio.open(path)
+            self.transform = self._src.transform
+            self.crs = self._src.crs
+            self.nodata = self._src.nodata
+            self.tags = self._src.tags()
+            self.band_tags = [self._src.tags(i) for i in self._src.indexes]
+            self.width, self.height = self._src.width, self._src.height
+        else:
+            self.width, self.height = self._png.width, self._png.height
+
+    def read(self, row_off, rows):
+        if self._png is not None:
+            return self._png.read_rgba(row_off, rows)
+        data = self._src.read(window=Window(0, row_off, self.width, rows))
+        return np.moveaxis(data, 0, -1)
+
+    def close(self):
+        if self._png is not None:
+            self._png.close()
+        if self._src is not None:
+            self._src.close()
+
+
+def require_rgba(band, stage):
+    if band.dtype != np.uint8 or band.shape[-1] != 4:
+        raise ValueError(f"Stage '{stage}' needs 8-bit RGBA input, got {band.shape[-1]} bands of {band.dtype}")
+
+
+def require_uint16(band, stage):
+    # 8-bit input would map every value below 256 to nodata, i.e. an all-black output
+    if band.dtype != np.uint16:
+        raise ValueError(f"Stage '{stage}' needs 16-bit input, got {band.shape[-1]} bands of {band.dtype}")
+
+
+def deleteblack_stage(params, ctx):
+    """Make (near-)black pixels transparent, see deleteblack.py."""
+    threshold = int(params.get("threshold", 0))
+
+    def apply(bands):
+        for row_off, band in bands:
+            with ctx.timings.phase("deleteblack"):
+                require_rgba(band, "deleteblack")
+                make_black_transparent(band, threshold)
+            yield row_off, band
+    return apply
+
+
+def compare_stage(params, ctx):
+    """
+    Apply the compare_pngs transparency rule against sibling mosaics.
+
+    The siblings are only read to build the combined mask; they are not
+    rewritten (run compare_pngs for that).
+    """
+    siblings = [ctx.resolve(p) for p in params.get("with", [])]
+    names = [ctx.input_path] + siblings
+
+    def apply(bands):
+        readers = [PngBandReader(p) for p in siblings]
+        try:
+            for row_off, band in bands:
+                with ctx.timings.phase("compare"):
+                    require_rgba(band, "compare")
+                    for reader in readers:
+                        if (reader.width, reader.height) != (band.shape[1], ctx.height):
+                            raise ValueError(f"{reader.path} does not match the input size")
+                    arrays = [band] + [r.read_rgba(row_off, band.shape[0]) for r in readers]
+                    band[build_transparency_mask(arrays, names)] = 0
+                yield row_off, band
+        finally:
+            for reader in readers:
+                reader.close()
+    return apply
+
+
+def rotate_stage(params, ctx):
+    """Rotate 90° counterclockwise like Image.rotate(90, expand=True)."""
+    if int(params.get("angle", 90)) != 90:
+        raise ValueError("Only 90° counterclockwise rotation is supported")
+
+    def apply(bands):
+        spool = None
+        try:
+            height = ctx.height
+            for row_off, band in bands:
+                with ctx.timings.phase("rotate"):
+                    if spool is None:
+                        tmp = tempfile.NamedTemporaryFile(dir=ctx.tmp_dir, suffix=".raw", delete=False)
+                        tmp.close()
+                        spool = np.memmap(tmp.name, dtype=band.dtype, mode="w+",
+                                          shape=(height,) + band.shape[1:])
+                    spool[row_off:row_off + band.shape[0]] = band
+
+            width = spool.shape[1]
+            ctx.height = width
+            band_rows = ctx.band_rows(height)
+            for row_off, rows in iter_bands(width, band_rows):
+                with ctx.timings.phase("rotate"):
+                    # Output rows [r0, r1) are input columns [w - r1, w - r0), turned CCW
+                    strip = spool[:, width - row_off - rows:width - row_off]
+                    band = np.ascontiguousarray(np.rot90(strip, 1))
+                yield row_off, band
+        finally:
+            if spool is not None:
+                path = spool.filename
+                del spool
+                os.remove(path)
+    return apply
+
+
+def uint8_stage(params, ctx):
+    """Apply the uint8.py uint16 → uint8 rule, including its band metadata on GeoTIFF output."""
+    nodata = params.get("nodata", ctx.nodata)
+    ctx.finalizers.append(
+        lambda dst: apply_band_metadata(dst, dst.count, ctx.source.tags, ctx.source.band_tags)
+    )
+
+    def apply(bands):
+        for row_off, band in bands:
+            with ctx.timings.phase("uint8"):
+                require_uint16(band, "uint8")
+                band = convert_block(band, nodata)
+            yield row_off, band
+    return apply
+
+
+STAGES = {
+    "deleteblack": deleteblack_stage,
+    "compare": compare_stage,
+    "rotate": rotate_stage,
+    "uint8": uint8_stage,
+}
+
+
+class PipelineContext:
+    def __init__(self, config_dir, input_path, source, max_memory, n_images, tmp_dir, align):
+        self.config_dir = config_dir
+        self.input_path = input_path
+        self.source = source
+        self.height = source.height
+        self.nodata = source.nodata
+        # Callables run on the open GeoTIFF output before it is closed
+        self.finalizers = []
+        self.max_memory = max_memory
+        self.n_images = n_images
+        self.tmp_dir = tmp_dir
+        self.align = align
+        self.timings = instrument.RUN
+
+    def resolve(self, path):
+        return os.path.join(self.config_dir, path)
+
+    def band_rows(self, width):
+        """Rows per band for the given width, aligned to the output tile height."""
+        rows = rows_per_band(width, self.n_images, self.max_memory)
+        if self.align:
+            rows = max(self.align, rows // self.align * self.align)
+        return rows
+
+
+def output_transform(geo, source, rotated):
+    """Transform and CRS for the output GeoTIFF."""
+    if geo is None:
+        if source.crs is None or rotated:
+            raise ValueError("A GeoTIFF output needs a 'georeference' section")
+        return source.transform, source.crs
+
+    crs = geo.get("crs", "EPSG:25831")
+    if "top_left_lat" in geo:
+        from png2geotiff_simple import transform_from_top_left
+        transform = transform_from_top_left(
+            geo["top_left_lat"], geo["top_left_lon"], geo["pixel_size_x"], geo["pixel_size_y"], crs
+        )
+    else:
+        from png2geotiff import get_world_from_hm_yamls, transform_from_two_points
+        # Both cameras in one call, projected to the output CRS
+        map1, map2 = get_world_from_hm_yamls(
+            [geo["yaml1"], geo["yaml2"]], geo["ned_origin_lat"], geo["ned_origin_lon"], crs
+        )
+        transform = transform_from_two_points(tuple(geo["pixel1"]), map1, tuple(geo["pixel2"]), map2)
+    return transform, CRS.from_string(crs)
+
+
+def write_png(bands, out_path, height, timings):
+    """Encode the band stream as an RGBA PNG; height() is read once the first band arrives."""
+    writer = None
+    try:
+        for _, band in bands:
+            with timings.phase("write"):
+                require_rgba(band, "png output")
+                if writer is None:
+                    writer = PngBandWriter(out_path, band.shape[1], height())
+                writer.write(band)
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    with timings.phase("write"):
+        writer.close()
+
+
+def write_geotiff(bands, out_path, output, transform, crs, height, timings, finalizers=()):
+    """Write the band stream to a tiled GeoTIFF (or COG) window by window."""
+    compress = output.get("compress", DEFAULT_COMPRESS)
+    blocksize = int(output.get("blocksize", DEFAULT_BLOCKSIZE))
+    num_threads = output.get("num_threads", "ALL_CPUS")
+
+    with geotiff_output(out_path, output.get("cog", False), compress, blocksize, num_threads) as path:
+        dst = None
+        try:
+            for row_off, band in bands:
+                with timings.phase("write"):
+                    if dst is None:
+                        profile = {
+                            "driver": "GTiff",
+                            "height": height(),
+                            "width": band.shape[1],
+                            "count": band.shape[2],
+                            "dtype": band.dtype.name,
+                            "crs": crs,
+                            "transform": transform,
+                        }
+                        profile.update(creation_options(compress, blocksize, num_threads))
+                        dst = rasterio.open(path, "w", **profile)
+                    window = Window(0, row_off, band.shape[1], band.shape[0])
+                    dst.write(np.moveaxis(band, -1, 0), window=window)
+            for finalize in finalizers:
+                finalize(dst)
+        finally:
+            if dst is not None:
+                with timings.phase("write"):
+                    dst.close()
+
+
+def run_pipeline(config_path):
+    """Run the pipeline described by a YAML config and report stage timings."""
+    with open(config_path) as f:
+        config = yaml.safe_load(f)
+
+    config_dir = os.path.dirname(os.path.abspath(config_path))
+    input_path = os.path.join(config_dir, config["input"])
+    output = config["output"]
+    if isinstance(output, str):
+        output = {"path": output}
+    out_path = os.path.join(config_dir, output["path"])
+    is_png = out_path.lower().endswith(".png")
+
+    stage_specs = []
+    for entry in config.get("stages", []):
+        # Each entry is either a bare stage name or a one-key {name: params} mapping
+        if isinstance(entry, str):
+            name, params = entry, {}
+        else:
+            (name, params), = entry.items()
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage '{name}' (available: {', '.join(STAGES)})")
+        stage_specs.append((name, params or {}))
+
+    n_images = 1 + sum(len(p.get("with", [])) for n, p in stage_specs if n == "compare")
+    align = None if is_png else int(output.get("blocksize", DEFAULT_BLOCKSIZE))
+
+    source = RasterSource(input_path)
+    ctx = PipelineContext(
+        config_dir, input_path, source,
+        parse_size(config.get("max_memory", DEFAULT_MAX_MEMORY)), n_images,
+        config.get("tmp_dir"), align,
+    )
+    print(f"🚀 Pipeline: {' → '.join(['read'] + [n for n, _ in stage_specs] + ['write'])}")
+
+    try:
+        def read_bands():
+            for row_off, rows in iter_bands(source.height, ctx.band_rows(source.width)):
+                with ctx.timings.phase("read"):
+                    band = source.read(row_off, rows)
+                yield row_off, band
+
+        bands = read_bands()
+        for name, params in stage_specs:
+            bands = STAGES[name](params, ctx)(bands)
+
+        # A rotate stage updates ctx.height before yielding its first band
+        if is_png:
+            write_png(bands, out_path, lambda: ctx.height, ctx.timings)
+        else:
+            rotated = any(n == "rotate" for n, _ in stage_specs)
+            transform, crs = output_transform(
+                _resolve_paths(output.get("georeference"), config_dir), source, rotated
+            )
+            write_geotiff(
+                bands, out_path, output, transform, crs, lambda: ctx.height, ctx.timings, ctx.finalizers
+            )
+    finally:
+        source.close()
+
+    count_read(input_path)
+    count_written(out_path)
+    print(f"✅ Pipeline output written to {out_path}")
+
+    tiles = output.get("tiles")
+    if tiles and not is_png:
+        with ctx.timings.phase("tiles"):
+            failures = export_tiles(
+                out_path, os.path.join(config_dir, tiles["path"]), tiles.get("zoom"),
+                tiles.get("format", "png"), tiles.get("scheme", "xyz"),
+                tiles.get("resampling", "bilinear"), int(tiles.get("jobs", os.cpu_count())),
+            )
+        if failures:
+            raise RuntimeError(f"{failures} tile batches failed")
+    ctx.timings.print_phases()
+    return out_path
+
+
+def _resolve_paths(geo, config_dir):
+    if geo is None:
+        return None
+    geo = dict(geo)
+    for key in ("yaml1", "yaml2"):
+        if key in geo:
+            geo[key] = os.path.join(config_dir, geo[key])
+    return geo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the mosaic processing chain in a single streaming pass.")
+    parser.add_argument("--config", required=True, help="Pipeline YAML config")
+    add_report_argument(parser)
+    args = parser.parse_args()
+
+    run_pipeline(args.config)
+    write_report(args.report, "pipeline", {"config": args.config})
+
+
+if __name__ == "__main__":
+    main()
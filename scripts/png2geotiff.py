@@ -1,14 +1,20 @@
 import argparse
-import rasterio
-from rasterio.transform import from_origin
-from rasterio.crs import CRS
+import csv
+import os
+from functools import lru_cache
 import numpy as np
-from PIL import Image
 import yaml
-from pyproj import Transformer
-from cola2_lib.utils.ned import NED
+from decodecache import add_cache_arguments, cache_from_args
+from instrument import add_report_argument, write_report
+from ned import ned_to_geodetic
+from geotiff_writer import (
+    DEFAULT_BLOCKSIZE, DEFAULT_COMPRESS, add_geotiff_arguments, add_mask_argument, write_png_as_geotiff,
+)
+from scheduler import image_pixels, print_summary, run_tasks
+
+# Control point file looked up in every folder of a --survey tree
+CONTROL_POINTS_NAME = "control_points.csv"
 
-Image.MAX_IMAGE_PIXELS = None
 
 """CALL
 
@@ -23,6 +29,18 @@ python png2geotiff.py
     --ned_origin_lon 2.3515                   # Longitude of the ROS NED origin (decimal degrees)
     --crs EPSG:25831                           # CRS for output GeoTIFF (UTM Zone 31N)
 
+Instead of --pixel1/--pixel2, --pixels centers.csv takes them from findcenters.py output
+(targets 1 and 2 by default, see --targets).
+
+Batch mode fits each mosaic from any number of control points (least squares,
+full affine from 3+ points) and prints the residuals:
+
+python3 png2geotiff.py --points control_points.csv --ned_origin_lat 39.578535 --ned_origin_lon 2.3502617
+python3 png2geotiff.py --survey ../data/mosaics/stelm --ned_origin_lat 39.578535 --ned_origin_lon 2.3502617 --jobs 4
+
+control_points.csv columns: mosaic,yaml,row,col[,out] (paths relative to the CSV; out defaults to <mosaic>.tif).
+--survey uses every control_points.csv found below the folder.
+
 python3 png2geotiff.py --mosaic_path ../data/mosaics/stelm/3/mosaic_x2.png --out_path ../data/mosaics/stelm/3/mosaic_x2.tif --yaml1 ../data/mosaics/stelm/3/12.yaml --yaml2 ../data/mosaics/stelm/3/14.yaml --pixel1 4333 2901 --pixel2 3157 3375 --ned_origin_lat 39.578535 --ned_origin_lon 2.3502617 --crs EPSG:25831
 
 
@@ -30,15 +48,15 @@ python3 png2geotiff.py --mosaic_path ../data/mosaics/stelm/3/mosaic_x2.png --out
 
 
 
-def georeference_png_to_geotiff(mosaic_path, out_path, pixel1, map1, pixel2, map2, crs="EPSG:25831"):
+def transform_from_two_points(pixel1, map1, pixel2, map2):
+    """Affine transform mapping pixel (row, col) reference points onto map (Y, X) points."""
+    from rasterio.transform import from_origin
+
     row1, col1 = pixel1
     y1, x1 = map1
     row2, col2 = pixel2
     y2, x2 = map2
 
-    img = Image.open(mosaic_path)
-    arr = np.array(img)
-
     pixel_width = (x2 - x1) / (col2 - col1)
     pixel_height = (y2 - y1) / (row2 - row1)
     
@@ -49,79 +67,282 @@ def georeference_png_to_geotiff(mosaic_path, out_path, pixel1, map1, pixel2, map
     x_origin = x1 - (col1 + 0.5) * pixel_width
     y_origin = y1 - (row1 + 0.5) * pixel_height
 
-    transform = from_origin(x_origin, y_origin, pixel_width, -pixel_height)
+    return from_origin(x_origin, y_origin, pixel_width, -pixel_height)
 
-    if arr.ndim == 2:
-        count = 1
-    else:
-        arr = np.transpose(arr, (2, 0, 1))
-        count = arr.shape[0]
-
-    with rasterio.open(
-        out_path,
-        "w",
-        driver="GTiff",
-        height=arr.shape[-2],
-        width=arr.shape[-1],
-        count=count,
-        dtype=arr.dtype,
-        crs=CRS.from_string(crs),
-        transform=transform,
-    ) as dst:
-        if count == 1:
-            dst.write(arr, 1)
-        else:
-            dst.write(arr)
+
+def georeference_png_to_geotiff(
+    mosaic_path, out_path, pixel1, map1, pixel2, map2, crs="EPSG:25831",
+    compress=DEFAULT_COMPRESS, blocksize=DEFAULT_BLOCKSIZE, num_threads="ALL_CPUS", cog=False, cache=None,
+    internal_mask=False,
+):
+    transform = transform_from_two_points(pixel1, map1, pixel2, map2)
+
+    write_png_as_geotiff(
+        mosaic_path, out_path, transform, crs,
+        compress=compress, blocksize=blocksize, num_threads=num_threads, cog=cog, cache=cache,
+        internal_mask=internal_mask,
+    )
 
     print(f"GeoTIFF written to {out_path}")
 
-def get_world_from_hm_yaml_utm(yaml_path, ned_origin_lat, ned_origin_lon):
-    """
-    Reads a YAML HM, converts camera position from NED meters to UTM EPSG:25831.
-    """
+@lru_cache(maxsize=None)
+def get_transformer(crs):
+    """WGS84 lat/lon → crs transformer, built once per CRS."""
+    # pyproj and rasterio are imported where used, so --help and the pipeline's imports stay light
+    from pyproj import Transformer
+
+    return Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+
+
+def read_hm_position(yaml_path):
+    """Camera (north, east) position in NED meters from a YAML HM."""
     with open(yaml_path, 'r') as f:
         data = yaml.safe_load(f)
 
     hm = np.array(data['HM']['data']).reshape((3,3))
-    x_cam = hm[0,2]
-    y_cam = hm[1,2]
+    return hm[0,2], hm[1,2]
 
-    # Convert NED → lat/lon
-    ned = NED(ned_origin_lat, ned_origin_lon, 0.0)
-    lat, lon, _ = ned.ned2geodetic([x_cam, y_cam, 0.0])
 
-    # Convert lat/lon → UTM 31N
-    transformer = Transformer.from_crs("EPSG:4326", "EPSG:25831", always_xy=True)
-    easting, northing = transformer.transform(lon, lat)
+def get_world_from_hm_yamls(yaml_paths, ned_origin_lat, ned_origin_lon, crs="EPSG:25831"):
+    """
+    Camera positions of many YAML HMs in crs, as an (N, 2) array of (Y, X).
+
+    NED → lat/lon and the projection to crs are each a single vectorized
+    call over all points.
+    """
+    positions = np.array([read_hm_position(p) for p in yaml_paths], dtype=np.float64).reshape(-1, 2)
+    lat, lon, _ = ned_to_geodetic(positions[:, 0], positions[:, 1], 0.0, ned_origin_lat, ned_origin_lon)
+
+    easting, northing = get_transformer(crs).transform(lon, lat)
+    return np.column_stack([northing, easting])  # rasterio expects (Y, X)
 
+
+def get_world_from_hm_yaml_utm(yaml_path, ned_origin_lat, ned_origin_lon, crs="EPSG:25831"):
+    """
+    Reads a YAML HM, converts camera position from NED meters to crs (UTM EPSG:25831 by default).
+    """
+    northing, easting = get_world_from_hm_yamls([yaml_path], ned_origin_lat, ned_origin_lon, crs)[0]
     return northing, easting  # rasterio expects (Y, X)
 
+
+def fit_transform(pixels, maps, model="affine"):
+    """
+    Least-squares affine transform from N pixel (row, col) points to map (Y, X) points.
+
+    model "affine" fits all six parameters (scale, rotation and shear) and
+    needs at least three points that are not collinear. model "scale" fits
+    the axis-aligned pixel size and origin, like transform_from_two_points,
+    from two or more points. Returns the transform and the per-point
+    residuals (map minus fitted, in map units) as an (N, 2) array of (dY, dX).
+    """
+    pixels = np.asarray(pixels, dtype=np.float64)
+    maps = np.asarray(maps, dtype=np.float64)
+    # Map coordinates refer to pixel centers
+    rows, cols = pixels[:, 0] + 0.5, pixels[:, 1] + 0.5
+    ys, xs = maps[:, 0], maps[:, 1]
+    ones = np.ones_like(cols)
+
+    if model == "affine":
+        if len(pixels) < 3:
+            raise ValueError("an affine fit needs at least 3 control points")
+        design = np.column_stack([cols, rows, ones])
+        if np.linalg.matrix_rank(design) < 3:
+            raise ValueError("control points are collinear; use the 'scale' model")
+        (a, b, c), *_ = np.linalg.lstsq(design, xs, rcond=None)
+        (d, e, f), *_ = np.linalg.lstsq(design, ys, rcond=None)
+    elif model == "scale":
+        if len(np.unique(cols)) < 2 or len(np.unique(rows)) < 2:
+            raise ValueError("control points must differ in both row and col")
+        (a, c), *_ = np.linalg.lstsq(np.column_stack([cols, ones]), xs, rcond=None)
+        (e, f), *_ = np.linalg.lstsq(np.column_stack([rows, ones]), ys, rcond=None)
+        b = d = 0.0
+    else:
+        raise ValueError(f"unknown model '{model}'")
+
+    from rasterio.transform import Affine
+
+    transform = Affine(a, b, c, d, e, f)
+    fitted_x = a * cols + b * rows + c
+    fitted_y = d * cols + e * rows + f
+    return transform, np.column_stack([ys - fitted_y, xs - fitted_x])
+
+
+def print_residuals(labels, pixels, residuals):
+    """Per-point residuals and their RMS, in map units."""
+    print("📐 Control point residuals (m):")
+    for label, (row, col), (dy, dx) in zip(labels, pixels, residuals):
+        print(f"   {label:<24} row={row:9.2f} col={col:9.2f}  dY={dy:8.3f}  dX={dx:8.3f}")
+    rms = float(np.sqrt(np.mean(np.sum(residuals ** 2, axis=1))))
+    print(f"   RMS = {rms:.3f} m")
+    return rms
+
+
+def read_control_points(csv_path):
+    """
+    Read control points from a CSV with columns mosaic, yaml, row, col and
+    an optional out. Relative paths are resolved against the CSV's folder.
+    Returns {mosaic_path: {"out": out_path, "yamls": [...], "pixels": [(row, col), ...]}},
+    with out defaulting to the mosaic path with a .tif extension.
+    """
+    base_dir = os.path.dirname(os.path.abspath(csv_path))
+    mosaics = {}
+    with open(csv_path, newline="") as f:
+        for row in csv.DictReader(f):
+            mosaic_path = os.path.join(base_dir, row["mosaic"].strip())
+            entry = mosaics.setdefault(
+                mosaic_path, {"out": os.path.splitext(mosaic_path)[0] + ".tif", "yamls": [], "pixels": []}
+            )
+            out_path = (row.get("out") or "").strip()
+            if out_path:
+                entry["out"] = os.path.join(base_dir, out_path)
+            entry["yamls"].append(os.path.join(base_dir, row["yaml"].strip()))
+            entry["pixels"].append((float(row["row"]), float(row["col"])))
+    return mosaics
+
+
+def find_control_point_files(survey_dir):
+    """Every control point CSV below survey_dir, in sorted order."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(survey_dir):
+        dirnames.sort()
+        if CONTROL_POINTS_NAME in filenames:
+            found.append(os.path.join(dirpath, CONTROL_POINTS_NAME))
+    return found
+
+
+def georeference_with_control_points(
+    mosaic_path, out_path, pixels, maps, labels, model, crs="EPSG:25831",
+    compress=DEFAULT_COMPRESS, blocksize=DEFAULT_BLOCKSIZE, num_threads="ALL_CPUS", cog=False, cache=None,
+    internal_mask=False,
+):
+    """Fit the transform from N control points, print its residuals and write the GeoTIFF."""
+    if model == "auto":
+        model = "affine" if len(pixels) >= 3 else "scale"
+    transform, residuals = fit_transform(pixels, maps, model)
+
+    print(f"🗺️  {os.path.basename(mosaic_path)}: {model} fit from {len(pixels)} control points")
+    rms = print_residuals(labels, pixels, residuals)
+
+    write_png_as_geotiff(
+        mosaic_path, out_path, transform, crs,
+        compress=compress, blocksize=blocksize, num_threads=num_threads, cog=cog, cache=cache,
+        internal_mask=internal_mask,
+    )
+    print(f"GeoTIFF written to {out_path}")
+    return {"out": out_path, "model": model, "rms": rms}
+
+
+def georeference_batch(
+    csv_paths, ned_origin_lat, ned_origin_lon, crs="EPSG:25831", model="auto", jobs=1,
+    compress=DEFAULT_COMPRESS, blocksize=DEFAULT_BLOCKSIZE, num_threads="ALL_CPUS", cog=False, cache=None,
+    internal_mask=False,
+):
+    """
+    Georeference every mosaic listed in the control point CSVs.
+
+    All YAMLs of the batch are converted to map coordinates in one call, then
+    the mosaics are fitted and written, in parallel with jobs > 1.
+    """
+    mosaics = {}
+    for csv_path in csv_paths:
+        mosaics.update(read_control_points(csv_path))
+
+    yaml_paths = [y for entry in mosaics.values() for y in entry["yamls"]]
+    world = get_world_from_hm_yamls(yaml_paths, ned_origin_lat, ned_origin_lon, crs)
+
+    tasks = []
+    start = 0
+    for mosaic_path, entry in mosaics.items():
+        n = len(entry["yamls"])
+        labels = [os.path.basename(y) for y in entry["yamls"]]
+        args = (mosaic_path, entry["out"], entry["pixels"], world[start:start + n], labels, model, crs,
+                compress, blocksize, num_threads, cog, cache, internal_mask)
+        tasks.append((mosaic_path, image_pixels(mosaic_path), args))
+        start += n
+
+    return run_tasks(tasks, georeference_with_control_points, jobs)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Georeference a PNG using two HM YAMLs")
     parser.add_argument("--mosaic_path")
     parser.add_argument("--out_path")
-    parser.add_argument("--yaml1", required=True)
-    parser.add_argument("--yaml2", required=True)
-    parser.add_argument("--pixel1", nargs=2, type=int, required=True)
-    parser.add_argument("--pixel2", nargs=2, type=int, required=True)
+    parser.add_argument("--yaml1")
+    parser.add_argument("--yaml2")
+    parser.add_argument("--pixel1", nargs=2, type=float)
+    parser.add_argument("--pixel2", nargs=2, type=float)
+    parser.add_argument(
+        "--pixels",
+        help="CSV/YAML from findcenters.py providing pixel1/pixel2 for --mosaic_path instead of clicking",
+    )
+    parser.add_argument(
+        "--targets", nargs=2, type=int, default=[1, 2],
+        help="Targets in the --pixels file matching yaml1 and yaml2 (default: 1 2)",
+    )
     parser.add_argument("--ned_origin_lat", type=float, required=True)
     parser.add_argument("--ned_origin_lon", type=float, required=True)
     parser.add_argument("--crs", default="EPSG:25831")
+    parser.add_argument("--points", nargs="+", help="Control point CSVs (mosaic,yaml,row,col[,out]) for batch mode")
+    parser.add_argument("--survey", help=f"Folder searched recursively for {CONTROL_POINTS_NAME} files (batch mode)")
+    parser.add_argument(
+        "--model", choices=["auto", "affine", "scale"], default="auto",
+        help="Batch fit: full affine, axis-aligned scale, or affine from 3+ points (default: auto)",
+    )
+    parser.add_argument("--jobs", type=int, default=1, help="Mosaics georeferenced in parallel in batch mode")
+    add_geotiff_arguments(parser)
+    add_mask_argument(parser)
+    add_cache_arguments(parser)
+    add_report_argument(parser)
     args = parser.parse_args()
+    cache = cache_from_args(args)
 
-    map1 = get_world_from_hm_yaml_utm(args.yaml1, args.ned_origin_lat, args.ned_origin_lon)
-    map2 = get_world_from_hm_yaml_utm(args.yaml2, args.ned_origin_lat, args.ned_origin_lon)
+    if args.points or args.survey:
+        csv_paths = list(args.points or [])
+        if args.survey:
+            csv_paths += find_control_point_files(args.survey)
+        results = georeference_batch(
+            csv_paths, args.ned_origin_lat, args.ned_origin_lon, args.crs, args.model, args.jobs,
+            compress=args.compress, blocksize=args.blocksize, num_threads=args.num_threads, cog=args.cog,
+            cache=cache, internal_mask=args.internal_mask,
+        )
+        failures = print_summary(results, "mosaics")
+        write_report(args.report, "png2geotiff", vars(args))
+        if failures:
+            raise SystemExit(1)
+        return
+
+    if not (args.mosaic_path and args.out_path and args.yaml1 and args.yaml2):
+        parser.error("--mosaic_path, --out_path, --yaml1 and --yaml2 are required without --points/--survey")
+
+    if args.pixels:
+        from findcenters import read_centers
+        centers = read_centers(args.pixels, args.mosaic_path)
+        missing = [t for t in args.targets if t not in centers]
+        if missing:
+            parser.error(f"{args.pixels}: no target {missing[0]} for {args.mosaic_path}")
+        pixel1, pixel2 = (centers[t] for t in args.targets)
+    elif args.pixel1 and args.pixel2:
+        pixel1 = tuple(args.pixel1)
+        pixel2 = tuple(args.pixel2)
+    else:
+        parser.error("either --pixels or both --pixel1 and --pixel2 are required")
 
-    pixel1 = tuple(args.pixel1)
-    pixel2 = tuple(args.pixel2)
+    map1, map2 = get_world_from_hm_yamls([args.yaml1, args.yaml2], args.ned_origin_lat, args.ned_origin_lon, args.crs)
 
     georeference_png_to_geotiff(
         args.mosaic_path,
         args.out_path,
         pixel1, map1,
         pixel2, map2,
-        crs=args.crs
+        crs=args.crs,
+        compress=args.compress,
+        blocksize=args.blocksize,
+        num_threads=args.num_threads,
+        cog=args.cog,
+        cache=cache,
+        internal_mask=args.internal_mask,
     )
+    write_report(args.report, "png2geotiff", vars(args))
 
 if __name__ == "__main__":
     main()
@@ -1,17 +1,28 @@
 import argparse
-import rasterio
 from rasterio.transform import from_origin
-from rasterio.crs import CRS
-import numpy as np
-from PIL import Image
 from pyproj import Transformer
+from decodecache import add_cache_arguments, cache_from_args
+from instrument import add_report_argument, write_report
+from geotiff_writer import (
+    DEFAULT_BLOCKSIZE, DEFAULT_COMPRESS, add_geotiff_arguments, add_mask_argument, write_png_as_geotiff,
+)
 
-Image.MAX_IMAGE_PIXELS = None
+
+def transform_from_top_left(top_left_lat, top_left_lon, pixel_size_x, pixel_size_y, crs="EPSG:25831"):
+    """Affine transform for a known top-left corner (lat/lon) and pixel size in meters."""
+    # Convert top-left lat/lon to projected CRS (e.g. UTM)
+    transformer = Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+    x_origin, y_origin = transformer.transform(top_left_lon, top_left_lat)
+
+    # Rasterio expects transform from top-left corner
+    return from_origin(x_origin, y_origin, pixel_size_x, pixel_size_y)
 
 
 def georeference_png_to_geotiff(
     mosaic_path, out_path, top_left_lat, top_left_lon,
-    pixel_size_x, pixel_size_y, crs="EPSG:25831"
+    pixel_size_x, pixel_size_y, crs="EPSG:25831",
+    compress=DEFAULT_COMPRESS, blocksize=DEFAULT_BLOCKSIZE, num_threads="ALL_CPUS", cog=False, cache=None,
+    internal_mask=False,
 ):
     """
     Georeferences a PNG mosaic using known top-left corner position and pixel size.
@@ -24,37 +35,21 @@ def georeference_png_to_geotiff(
         pixel_size_x: Pixel size in meters (E-W direction).
         pixel_size_y: Pixel size in meters (N-S direction, usually positive).
         crs: Output CRS (e.g. EPSG:25831).
+        compress: GeoTIFF compression (deflate, zstd, lzw or none).
+        blocksize: Tile size in pixels.
+        num_threads: Compression threads (number or ALL_CPUS).
+        cog: Write a Cloud-Optimized GeoTIFF with internal overviews.
+        cache: Optional DecodedCache to read the PNG pixels from.
+        internal_mask: Write the folder's validity mask sidecar as the internal mask.
     """
-    # Convert top-left lat/lon to projected CRS (e.g. UTM)
-    transformer = Transformer.from_crs("EPSG:4326", crs, always_xy=True)
-    x_origin, y_origin = transformer.transform(top_left_lon, top_left_lat)
+    transform = transform_from_top_left(top_left_lat, top_left_lon, pixel_size_x, pixel_size_y, crs)
 
-    # Load image
-    img = Image.open(mosaic_path)
-    arr = np.array(img)
-
-    # Rasterio expects transform from top-left corner
-    transform = from_origin(x_origin, y_origin, pixel_size_x, pixel_size_y)
-
-    if arr.ndim == 2:
-        count = 1
-    else:
-        arr = np.transpose(arr, (2, 0, 1))
-        count = arr.shape[0]
-
-    # Write GeoTIFF
-    with rasterio.open(
-        out_path,
-        "w",
-        driver="GTiff",
-        height=arr.shape[-2],
-        width=arr.shape[-1],
-        count=count,
-        dtype=arr.dtype,
-        crs=CRS.from_string(crs),
-        transform=transform,
-    ) as dst:
-        dst.write(arr if count > 1 else arr, 1 if count == 1 else None)
+    # Write GeoTIFF strip by strip
+    write_png_as_geotiff(
+        mosaic_path, out_path, transform, crs,
+        compress=compress, blocksize=blocksize, num_threads=num_threads, cog=cog, cache=cache,
+        internal_mask=internal_mask,
+    )
 
     print(f"✅ GeoTIFF written to {out_path}")
     print(f"   Top-left corner (lat/lon): ({top_left_lat}, {top_left_lon})")
@@ -71,6 +66,10 @@ def main():
     parser.add_argument("--pixel_size_x", type=float, required=True, help="Pixel size in meters (X direction)")
     parser.add_argument("--pixel_size_y", type=float, required=True, help="Pixel size in meters (Y direction, positive number)")
     parser.add_argument("--crs", default="EPSG:25831", help="Output CRS (default: EPSG:25831)")
+    add_geotiff_arguments(parser)
+    add_mask_argument(parser)
+    add_cache_arguments(parser)
+    add_report_argument(parser)
     args = parser.parse_args()
 
     georeference_png_to_geotiff(
@@ -80,8 +79,15 @@ def main():
         args.top_left_lon,
         args.pixel_size_x,
         args.pixel_size_y,
-        crs=args.crs
+        crs=args.crs,
+        compress=args.compress,
+        blocksize=args.blocksize,
+        num_threads=args.num_threads,
+        cog=args.cog,
+        cache=cache_from_args(args),
+        internal_mask=args.internal_mask,
     )
+    write_report(args.report, "png2geotiff_simple", vars(args))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,379 @@
+"""Row-band PNG reading and writing with bounded memory.
+
+PNGs are read through GDAL, which decodes non-interlaced files scanline by
+scanline, so reading bands top to bottom never holds the whole image. Output
+PNGs are written with a small streaming encoder (zlib + Sub filter) so each
+band can be flushed to disk as soon as it is processed. With several
+threads, bands are deflated in independent chunks, pigz style, which costs
+a little compression for a near-linear speed-up.
+"""
+import os
+import struct
+import warnings
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Flush an IDAT chunk once this much compressed data has accumulated
+IDAT_CHUNK_SIZE = 1 << 20
+
+DEFAULT_COMPRESS_LEVEL = 6
+# zlib strategies selectable with --png-strategy
+STRATEGIES = {
+    "default": zlib.Z_DEFAULT_STRATEGY,
+    "filtered": zlib.Z_FILTERED,
+    "huffman": zlib.Z_HUFFMAN_ONLY,
+    "rle": zlib.Z_RLE,
+    "fixed": zlib.Z_FIXED,
+}
+# Smallest piece of a band deflated on its own by the threaded encoder
+MIN_DEFLATE_CHUNK = 1 << 20
+# Back-reference window carried into the next chunk as a preset dictionary
+DEFLATE_WINDOW = 1 << 15
+# Uncompressed bytes per thread in each band save_png hands to the writer
+SAVE_BAND_BYTES = 8 << 20
+# Header of a zlib stream with a 32K window and no preset dictionary
+ZLIB_HEADER = b"\x78\x9c"
+
+_SIZE_SUFFIXES = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(text):
+    """Parse a human readable size such as '512M' or '2G' into bytes."""
+    text = str(text).strip().upper().rstrip("B")
+    if text and text[-1] in _SIZE_SUFFIXES:
+        return int(float(text[:-1]) * _SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+
+def rows_per_band(width, n_images, max_memory):
+    """
+    Number of rows that can be processed per band for n_images RGBA images
+    of the given width so the working set stays within max_memory bytes.
+
+    Per row and image we hold the band-first GDAL read, the RGBA copy and
+    the filtered scanline handed to zlib, plus one mask byte per pixel.
+    """
+    per_row = width * (n_images * 4 * 3 + 1)
+    return max(1, int(max_memory // per_row))
+
+
+def iter_bands(height, band_rows):
+    """Yield (row_off, rows) pairs covering height in bands of band_rows."""
+    for row_off in range(0, height, band_rows):
+        yield row_off, min(band_rows, height - row_off)
+
+
+def is_png(path):
+    """Whether path starts with the PNG signature."""
+    with open(path, "rb") as f:
+        return f.read(8) == PNG_SIGNATURE
+
+
+def png_header(path):
+    """
+    (bit_depth, colour_type, trns) of a PNG, read from the chunks before its
+    image data; trns is the raw tRNS payload, or None.
+    """
+    bit_depth = colour_type = trns = None
+    with open(path, "rb") as f:
+        if f.read(8) != PNG_SIGNATURE:
+            raise ValueError(f"{os.path.basename(path)} is not a PNG")
+        while True:
+            head = f.read(8)
+            if len(head) < 8:
+                break
+            length, tag = struct.unpack(">I4s", head)
+            # tRNS must come before the first IDAT
+            if tag == b"IDAT":
+                break
+            if tag == b"IHDR":
+                bit_depth, colour_type = f.read(length)[8:10]
+            elif tag == b"tRNS":
+                trns = f.read(length)
+            else:
+                f.seek(length, os.SEEK_CUR)
+            f.seek(4, os.SEEK_CUR)
+    return bit_depth, colour_type, trns
+
+
+def unstreamable_reason(path):
+    """
+    None if PngBandReader decodes path exactly as Image.convert('RGBA') does,
+    otherwise what keeps it from doing so.
+    """
+    return _unstreamable(*png_header(path))
+
+
+def _unstreamable(bit_depth, colour_type, trns):
+    if bit_depth == 16:
+        return "16-bit samples"
+    if colour_type == 0 and bit_depth in (2, 4) and trns is not None:
+        # Pillow honours the transparent colour of 1-bit but not of 2- and 4-bit grayscale
+        return f"{bit_depth}-bit grayscale with a transparent colour"
+    return None
+
+
+class PngBandReader:
+    """
+    Read a PNG as RGBA row bands, matching Image.convert('RGBA').
+
+    16-bit PNGs and 2- or 4-bit grayscale PNGs with a transparent colour
+    are refused (see unstreamable_reason) before any pixel is read.
+    """
+
+    def __init__(self, path):
+        bit_depth, colour_type, trns = png_header(path)
+        reason = _unstreamable(bit_depth, colour_type, trns)
+        if reason is not None:
+            raise ValueError(f"{os.path.basename(path)}: PNGs with {reason} cannot be streamed")
+
+        # rasterio is only needed to stream, so commands that never do skip its import
+        import rasterio
+        from rasterio.errors import NotGeoreferencedWarning
+
+        self.path = path
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", NotGeoreferencedWarning)
+            self._src = rasterio.open(path)
+
+        self.width = self._src.width
+        self.height = self._src.height
+        # GDAL returns 1-, 2- and 4-bit grayscale unscaled; Pillow stretches it to 0-255
+        self._scale = 255 // ((1 << bit_depth) - 1) if colour_type == 0 and bit_depth < 8 else 1
+        # tRNS colour key of grayscale (one value) or RGB (three) PNGs, as 16-bit samples
+        self._key = None
+        if trns is not None and colour_type in (0, 2):
+            self._key = np.array(struct.unpack(f">{len(trns) // 2}H", trns))[:, None, None]
+        self._lut = None
+        if self._src.count == 1 and self._has_colormap():
+            lut = np.zeros((256, 4), dtype=np.uint8)
+            for idx, rgba in self._src.colormap(1).items():
+                lut[idx] = rgba
+            self._lut = lut
+
+    def _has_colormap(self):
+        try:
+            self._src.colormap(1)
+        except ValueError:
+            return False
+        return True
+
+    def read_rgba(self, row_off, rows, col_off=0, cols=None):
+        """
+        Return rows starting at row_off as a (rows, width, 4) uint8 array.
+        col_off and cols restrict the read to a column range.
+        """
+        if cols is None:
+            cols = self.width - col_off
+        data = self._src.read(window=((row_off, row_off + rows), (col_off, col_off + cols)))
+        count = data.shape[0]
+
+        if self._lut is not None:
+            return self._lut[data[0]]
+
+        out = np.empty((rows, cols, 4), dtype=np.uint8)
+        if count >= 3:
+            out[..., :3] = np.moveaxis(data[:3], 0, -1)
+        else:
+            out[..., :3] = (data[0] * self._scale)[..., None]
+
+        if count in (2, 4):
+            out[..., 3] = data[-1]
+        else:
+            out[..., 3] = 255
+            if self._key is not None:
+                out[..., 3][(data == self._key).all(axis=0)] = 0
+        return out
+
+    def close(self):
+        self._src.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PngBandWriter:
+    """
+    Stream an RGBA PNG to disk band by band.
+
+    Data goes to a temporary file next to the target and is renamed over it
+    on close(), so the target can also be one of the files being read.
+
+    With threads > 1 each band is split into chunks that are deflated in
+    parallel as separate raw deflate streams, each primed with the last 32K
+    of the data before it and ended on a byte boundary, and joined into one
+    zlib stream, so any PNG decoder reads the result.
+    """
+
+    def __init__(
+        self, path, width, height, compress_level=DEFAULT_COMPRESS_LEVEL, strategy="default", threads=1
+    ):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.compress_level = compress_level
+        self.strategy = STRATEGIES[strategy]
+        self._rows_written = 0
+        self._tmp_path = f"{path}.tmp"
+        self._fh = open(self._tmp_path, "wb")
+        self._pending = []
+        self._pending_size = 0
+        self._pool = None
+        if threads > 1:
+            self._pool = ThreadPoolExecutor(max_workers=threads)
+            self._threads = threads
+            self._adler = zlib.adler32(b"")
+            self._window = b""
+            self._queue(ZLIB_HEADER)
+        else:
+            self._zlib = zlib.compressobj(compress_level, zlib.DEFLATED, zlib.MAX_WBITS, 8, self.strategy)
+
+        self._fh.write(PNG_SIGNATURE)
+        # 8-bit depth, colour type 6 (RGBA), deflate, adaptive filtering, no interlace
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+
+    def _write_chunk(self, tag, data):
+        self._fh.write(struct.pack(">I", len(data)))
+        self._fh.write(tag)
+        self._fh.write(data)
+        self._fh.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag))))
+
+    def _queue(self, data):
+        if not data:
+            return
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= IDAT_CHUNK_SIZE:
+            self._flush_idat()
+
+    def _flush_idat(self):
+        if self._pending:
+            self._write_chunk(b"IDAT", b"".join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+
+    def write(self, rgba):
+        """Append a (rows, width, 4) uint8 band below the rows already written."""
+        rows = rgba.shape[0]
+        if rgba.shape[1:] != (self.width, 4):
+            raise ValueError(f"Band shape {rgba.shape} does not match width {self.width}")
+        if self._rows_written + rows > self.height:
+            raise ValueError(f"Too many rows written to {self.path}")
+
+        # Sub filter (type 1): each byte minus the same channel of the pixel to its left
+        scanlines = np.empty((rows, 1 + self.width * 4), dtype=np.uint8)
+        scanlines[:, 0] = 1
+        filtered = scanlines[:, 1:].reshape(rows, self.width, 4)
+        filtered[:, 0] = rgba[:, 0]
+        np.subtract(rgba[:, 1:], rgba[:, :-1], out=filtered[:, 1:])
+
+        if self._pool is None:
+            self._queue(self._zlib.compress(scanlines.tobytes()))
+        else:
+            self._deflate_parallel(scanlines.tobytes())
+        self._rows_written += rows
+
+    def _deflate_chunk(self, data, zdict):
+        params = (self.compress_level, zlib.DEFLATED, -zlib.MAX_WBITS, 8, self.strategy)
+        deflater = zlib.compressobj(*params, zdict) if zdict else zlib.compressobj(*params)
+        return deflater.compress(data) + deflater.flush(zlib.Z_SYNC_FLUSH)
+
+    def _deflate_parallel(self, data):
+        size = max(MIN_DEFLATE_CHUNK, -(-len(data) // self._threads))
+        view = memoryview(data)
+        chunks = []
+        for start in range(0, len(data), size):
+            zdict = self._window if start == 0 else bytes(view[max(0, start - DEFLATE_WINDOW):start])
+            chunks.append(self._pool.submit(self._deflate_chunk, view[start:start + size], zdict))
+        self._adler = zlib.adler32(data, self._adler)
+        self._window = (self._window + data[-DEFLATE_WINDOW:])[-DEFLATE_WINDOW:]
+        for chunk in chunks:
+            self._queue(chunk.result())
+
+    def close(self):
+        """Finish the PNG and move it into place."""
+        if self._rows_written != self.height:
+            self.abort()
+            raise ValueError(
+                f"{self.path}: wrote {self._rows_written} rows, expected {self.height}"
+            )
+        if self._pool is None:
+            self._queue(self._zlib.flush())
+        else:
+            # Empty final block, then the checksum of all the uncompressed data
+            self._queue(zlib.compressobj(0, zlib.DEFLATED, -zlib.MAX_WBITS).flush())
+            self._queue(struct.pack(">I", self._adler))
+            self._pool.shutdown()
+        self._flush_idat()
+        self._write_chunk(b"IEND", b"")
+        self._fh.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """Discard the partially written file."""
+        if self._pool is not None:
+            self._pool.shutdown()
+        self._fh.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def save_png(img, path, compress_level=DEFAULT_COMPRESS_LEVEL, strategy="default", threads=1):
+    """
+    Save a PIL image as a PNG at path via a temporary file and a rename, so a
+    failed save never leaves a truncated file in place of the original.
+
+    RGBA images use the threaded PngBandWriter when threads > 1; everything
+    else goes through Pillow with the given zlib level and strategy.
+    """
+    if threads > 1 and img.mode == "RGBA":
+        writer = PngBandWriter(path, img.width, img.height, compress_level, strategy, threads)
+        rgba = np.asarray(img)
+        band_rows = max(1, threads * SAVE_BAND_BYTES // (img.width * 4))
+        try:
+            for row_off, rows in iter_bands(img.height, band_rows):
+                writer.write(rgba[row_off:row_off + rows])
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+        return
+
+    tmp_path = f"{path}.tmp"
+    try:
+        img.save(tmp_path, "PNG", compress_level=compress_level, compress_type=STRATEGIES[strategy])
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def add_png_arguments(parser):
+    """Register the --png-compress-level, --png-strategy and --png-threads options."""
+    parser.add_argument(
+        "--png-compress-level", type=int, default=DEFAULT_COMPRESS_LEVEL, choices=range(10), metavar="0-9",
+        help=f"zlib level of written PNGs; 1 is much faster for large mosaics (default: {DEFAULT_COMPRESS_LEVEL})",
+    )
+    parser.add_argument(
+        "--png-strategy", default="default", choices=sorted(STRATEGIES),
+        help="zlib strategy of written PNGs (default: default)",
+    )
+    parser.add_argument(
+        "--png-threads", type=int, default=1,
+        help="Deflate RGBA PNGs in parallel chunks on this many threads (default: 1)",
+    )
+
+
+def png_options_from_args(args):
+    """Keyword arguments for PngBandWriter / save_png from the parsed PNG options."""
+    return {
+        "compress_level": args.png_compress_level,
+        "strategy": args.png_strategy,
+        "threads": args.png_threads,
+    }
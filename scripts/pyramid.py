@@ -0,0 +1,183 @@
+"""Cached multi-resolution pyramids of large mosaics.
+
+Level k holds the image reduced by 2**k with a 2x2 box average per step
+(partial edge pixels are dropped). Levels 1..n are stored as .npy files in a
+sidecar folder next to the image and opened as memory maps, so any region of
+any level can be read without loading the rest. Level 0 is the source itself.
+"""
+import json
+import os
+import shutil
+import numpy as np
+from decodecache import open_band_reader
+from pngstream import iter_bands
+
+# Stop adding levels once the coarsest one fits in this many pixels per side
+TOP_LEVEL_SIZE = 1024
+# Full-resolution rows per band while building, before rounding to the level factor
+BUILD_BAND_ROWS = 256
+META_NAME = "pyramid.json"
+
+
+def default_pyramid_dir(path):
+    """Sidecar folder used for the pyramid of path."""
+    return f"{path}.pyramid"
+
+
+def level_count(width, height, top_size=TOP_LEVEL_SIZE):
+    """Number of reduced levels needed for the coarsest one to fit top_size."""
+    levels = 0
+    while max(width, height) >> levels > top_size:
+        levels += 1
+    return levels
+
+
+def downsample(rgba):
+    """Halve an RGBA array with a 2x2 box average, dropping an odd last row/column."""
+    rows, cols = rgba.shape[0] // 2, rgba.shape[1] // 2
+    blocks = rgba[:rows * 2, :cols * 2].reshape(rows, 2, cols, 2, 4)
+    total = blocks.sum(axis=(1, 3), dtype=np.uint16)
+    return ((total + 2) >> 2).astype(np.uint8)
+
+
+def _source_stamp(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def build_pyramid(path, pyramid_dir=None, top_size=TOP_LEVEL_SIZE, cache=None, fallback=False):
+    """
+    Build the pyramid of path in one streaming pass over the source.
+
+    Bands of the source are reduced level by level and appended to each
+    level's memory map, so memory stays at a few bands regardless of the
+    image size. With a DecodedCache the source bands come from the cache.
+    fallback is passed on to open_band_reader. Returns the pyramid folder.
+    """
+    pyramid_dir = pyramid_dir or default_pyramid_dir(path)
+    tmp_dir = f"{pyramid_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    with open_band_reader(path, cache, fallback) as reader:
+        width, height = reader.width, reader.height
+        levels = level_count(width, height, top_size)
+        maps = [
+            np.lib.format.open_memmap(
+                os.path.join(tmp_dir, f"level_{k}.npy"), mode="w+", dtype=np.uint8,
+                shape=(height >> k, width >> k, 4),
+            )
+            for k in range(1, levels + 1)
+        ]
+        written = [0] * levels
+
+        # Bands must be a multiple of the coarsest factor so every level splits evenly
+        factor = 1 << levels
+        band_rows = max(factor, BUILD_BAND_ROWS // factor * factor)
+        for row_off, rows in iter_bands(height, band_rows):
+            band = reader.read_rgba(row_off, rows)
+            for k in range(levels):
+                band = downsample(band)
+                maps[k][written[k]:written[k] + band.shape[0]] = band[:, :maps[k].shape[1]]
+                written[k] += band.shape[0]
+
+    for level in maps:
+        level.flush()
+    del maps
+
+    meta = {"source": _source_stamp(path), "width": width, "height": height, "levels": levels}
+    with open(os.path.join(tmp_dir, META_NAME), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    shutil.rmtree(pyramid_dir, ignore_errors=True)
+    os.replace(tmp_dir, pyramid_dir)
+    return pyramid_dir
+
+
+class Pyramid:
+    """
+    Read access to an image and its cached pyramid.
+
+    The pyramid is built on first use and rebuilt whenever the source file's
+    size or mtime no longer match the ones it was built from. Full-resolution
+    reads go through the DecodedCache when one is given. With fallback,
+    images the band readers refuse are decoded whole by Pillow.
+    """
+
+    def __init__(self, path, pyramid_dir=None, top_size=TOP_LEVEL_SIZE, cache=None, fallback=False):
+        self.path = path
+        self.pyramid_dir = pyramid_dir or default_pyramid_dir(path)
+        if not self._is_current():
+            print(f"🧱 Building pyramid for {os.path.basename(path)} in {self.pyramid_dir}")
+            build_pyramid(path, self.pyramid_dir, top_size, cache, fallback)
+
+        with open(os.path.join(self.pyramid_dir, META_NAME)) as f:
+            meta = json.load(f)
+        self.width = meta["width"]
+        self.height = meta["height"]
+        self.levels = [
+            np.load(os.path.join(self.pyramid_dir, f"level_{k}.npy"), mmap_mode="r")
+            for k in range(1, meta["levels"] + 1)
+        ]
+        self._reader = open_band_reader(path, cache, fallback)
+
+    def _is_current(self):
+        meta_path = os.path.join(self.pyramid_dir, META_NAME)
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path) as f:
+            meta = json.load(f)
+        return meta.get("source") == _source_stamp(self.path)
+
+    @property
+    def n_levels(self):
+        """Number of levels including full resolution."""
+        return len(self.levels) + 1
+
+    def level_shape(self, level):
+        """(height, width) of a level."""
+        if level == 0:
+            return self.height, self.width
+        return self.levels[level - 1].shape[:2]
+
+    def level_for(self, source_pixels, screen_pixels):
+        """
+        Coarsest level that still shows at least one level pixel per screen
+        pixel when source_pixels full-resolution pixels span screen_pixels.
+        """
+        level = 0
+        while level + 1 < self.n_levels and source_pixels >> (level + 1) >= screen_pixels:
+            level += 1
+        return level
+
+    def read(self, level, row_off, rows, col_off, cols):
+        """
+        Read a region of a level, in that level's pixel coordinates, clipped to
+        the level. Returns (rgba, row_off, col_off) of what was actually read.
+        """
+        height, width = self.level_shape(level)
+        row_off, col_off = max(0, row_off), max(0, col_off)
+        rows = max(0, min(rows, height - row_off))
+        cols = max(0, min(cols, width - col_off))
+        if level == 0:
+            rgba = self._reader.read_rgba(row_off, rows, col_off, cols)
+        else:
+            rgba = np.asarray(self.levels[level - 1][row_off:row_off + rows, col_off:col_off + cols])
+        return rgba, row_off, col_off
+
+    def overview(self):
+        """The coarsest level as an array, with its reduction factor."""
+        level = self.n_levels - 1
+        height, width = self.level_shape(level)
+        rgba, _, _ = self.read(level, 0, height, 0, width)
+        return rgba, 1 << level
+
+    def close(self):
+        self._reader.close()
+        self.levels = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
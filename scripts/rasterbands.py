@@ -0,0 +1,97 @@
+"""
+RGBA reading of GeoTIFFs and the other rasters GDAL opens.
+
+Bands are picked by colour interpretation, not position, so a uint8.py
+output (NIR, red, green, blue) shows its red, green and blue bands. Alpha
+comes from a band interpreted as alpha; without one, from GDAL's dataset
+mask (internal mask or nodata), so nodata pixels read as transparent.
+"""
+import os
+import warnings
+import numpy as np
+
+RGB_NAMES = ("red", "green", "blue")
+
+
+def rgba_indexes(src):
+    """
+    (rgb, alpha) 1-based band indexes of a dataset: the bands shown as red,
+    green and blue (one band three times for grayscale), and the alpha
+    band, or None when the dataset has none.
+    """
+    names = [ci.name for ci in src.colorinterp]
+    alpha = names.index("alpha") + 1 if "alpha" in names else None
+    if all(name in names for name in RGB_NAMES):
+        return [names.index(name) + 1 for name in RGB_NAMES], alpha
+    colour = [i for i, name in enumerate(names, start=1) if name != "alpha"]
+    return (colour[:3] if len(colour) >= 3 else colour[:1] * 3), alpha
+
+
+def read_indexes(indexes):
+    """Sorted distinct bands to read for rgba_indexes' (rgb, alpha)."""
+    rgb, alpha = indexes
+    return sorted(set(rgb) if alpha is None else set(rgb) | {alpha})
+
+
+def to_rgba(data, indexes, mask):
+    """
+    (rows, cols, 4) RGBA of a (bands, rows, cols) read of the bands in
+    read_indexes(indexes), with mask as alpha where the dataset has no
+    alpha band (otherwise the lower of the two).
+    """
+    rgb, alpha = indexes
+    bands = dict(zip(read_indexes(indexes), data))
+    rgba = np.empty(data.shape[1:] + (4,), dtype=np.uint8)
+    for channel, index in enumerate(rgb):
+        rgba[..., channel] = bands[index]
+    rgba[..., 3] = mask if alpha is None else np.minimum(bands[alpha], mask)
+    return rgba
+
+
+class RasterBandReader:
+    """
+    PngBandReader counterpart for GeoTIFFs and other 8-bit rasters, read
+    through rasterio by window.
+    """
+
+    def __init__(self, path):
+        import rasterio
+        from rasterio.errors import NotGeoreferencedWarning
+
+        self.path = path
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", NotGeoreferencedWarning)
+            self._src = rasterio.open(path)
+        if any(dt != "uint8" for dt in self._src.dtypes):
+            self._src.close()
+            raise ValueError(f"{os.path.basename(path)} is not 8-bit; convert it with uint8.py first")
+
+        self.width = self._src.width
+        self.height = self._src.height
+        self._indexes = rgba_indexes(self._src)
+        self._lut = None
+        if self._src.colorinterp[0].name == "palette":
+            self._lut = np.zeros((256, 4), dtype=np.uint8)
+            for idx, rgba in self._src.colormap(1).items():
+                self._lut[idx] = rgba
+
+    def read_rgba(self, row_off, rows, col_off=0, cols=None):
+        """Same as PngBandReader.read_rgba."""
+        if cols is None:
+            cols = self.width - col_off
+        window = ((row_off, row_off + rows), (col_off, col_off + cols))
+        if self._lut is not None:
+            return self._lut[self._src.read(1, window=window)]
+        data = self._src.read(read_indexes(self._indexes), window=window)
+        # With an alpha band the dataset mask is that band
+        mask = 255 if self._indexes[1] is not None else self._src.dataset_mask(window=window)
+        return to_rgba(data, self._indexes, mask)
+
+    def close(self):
+        self._src.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,27 +1,175 @@
 import argparse
 import os
+import shutil
+import numpy as np
 from PIL import Image
+from decodecache import add_cache_arguments, cache_from_args, open_image
+from geotiff_writer import creation_options
+from instrument import add_report_argument, count_read, count_written, phase, write_report
+from pngstream import add_png_arguments, iter_bands, parse_size, png_options_from_args, save_png
+from rotation import (
+    DEFAULT_MAX_MEMORY, OPERATIONS, orient, pixel_transform, rotate_in_memory, rotate_png, rotated_size,
+    source_strip,
+)
 Image.MAX_IMAGE_PIXELS = None
 
-def main():
-    parser = argparse.ArgumentParser(description="Rotate a PNG image 90° counterclockwise.")
-    parser.add_argument("--input", required=True, help="Path to the input PNG image")
-    args = parser.parse_args()
+GEOTIFF_EXTENSIONS = (".tif", ".tiff")
+
+
+def rotate_geotiff(input_path, output_path, operation="90", in_place=False):
+    """
+    Rotate a GeoTIFF by rewriting only its geotransform; pixels are not moved.
+
+    The raster lands on the map where a pixel-rotated copy keeping the
+    original transform would. The file is copied byte for byte (or updated
+    in place), so tiling and compression are kept.
+    """
+    # Only GeoTIFFs need rasterio, so rotating PNGs does not import it
+    import rasterio
+    from rasterio.transform import Affine
+
+    with rasterio.open(input_path) as src:
+        if src.transform.is_identity:
+            raise ValueError(f"{input_path} has no geotransform to rotate")
+        rotated = src.transform * Affine(*pixel_transform(src.width, src.height, operation))
+
+    if in_place:
+        output_path = input_path
+    else:
+        with phase("copy"):
+            shutil.copyfile(input_path, output_path)
+        count_read(input_path)
+        count_written(output_path)
+    with phase("geotransform"):
+        with rasterio.open(output_path, "r+", IGNORE_COG_LAYOUT_BREAK="YES") as dst:
+            dst.transform = rotated
+    return output_path
+
+
+def rotate_geotiff_pixels(input_path, output_path, operation="90", max_memory=parse_size(DEFAULT_MAX_MEMORY)):
+    """
+    Rotate the pixels of a GeoTIFF into a tiled GeoTIFF with the input's
+    transform, CRS, nodata and band metadata.
+
+    The output lands on the map where rotate_geotiff puts it, with a
+    north-up geotransform. Output bands are read as strips of the source by
+    window, about max_memory bytes at a time, so any band count and data
+    type are kept. An internal mask is rotated with the pixels.
+    """
+    import rasterio
+    from rasterio.enums import MaskFlags
+    from rasterio.windows import Window
 
-    # Open image
-    img = Image.open(args.input)
+    with rasterio.open(input_path) as src:
+        width, height = src.width, src.height
+        out_width, out_height = rotated_size(width, height, operation)
+        profile = src.profile
+        profile.update(driver="GTiff", width=out_width, height=out_height, **creation_options())
+        has_mask = MaskFlags.per_dataset in src.mask_flag_enums[0]
+        # The source strip and its rotated copy of each band
+        per_row = out_width * src.count * np.dtype(src.dtypes[0]).itemsize * 2
+        band_rows = max(1, int(max_memory // per_row))
 
-    # Rotate 90 degrees counterclockwise
-    rotated = img.rotate(90, expand=True)
+        with rasterio.Env(GDAL_TIFF_INTERNAL_MASK=True), rasterio.open(output_path, "w", **profile) as dst:
+            dst.colorinterp = src.colorinterp
+            dst.update_tags(**src.tags())
+            for i in range(1, src.count + 1):
+                dst.set_band_description(i, src.descriptions[i - 1])
+                dst.update_tags(i, **src.tags(i))
+            for row_off, rows in iter_bands(out_height, band_rows):
+                strip_row, strip_rows, col_off, cols = source_strip(width, height, operation, row_off, rows)
+                window = Window(col_off, strip_row, cols, strip_rows)
+                out_window = Window(0, row_off, out_width, rows)
+                with phase("decode"):
+                    data = src.read(window=window)
+                with phase("compute"):
+                    band = np.moveaxis(orient(np.moveaxis(data, 0, -1), operation), -1, 0)
+                with phase("encode"):
+                    dst.write(band, window=out_window)
+                if has_mask:
+                    dst.write_mask(orient(src.dataset_mask(window=window), operation), window=out_window)
+
+    count_read(input_path)
+    count_written(output_path)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rotate (counterclockwise) or flip a PNG image, or the georeferencing of a GeoTIFF."
+    )
+    parser.add_argument("--input", required=True, help="Path to the input PNG image or GeoTIFF")
+    parser.add_argument(
+        "--rotation", choices=OPERATIONS, default="90",
+        help="Counterclockwise rotation in degrees, or a left-right / top-bottom flip (default: 90)",
+    )
+    parser.add_argument(
+        "--max-memory",
+        help="Stream a PNG through a bounded-memory rotation using about this much memory (e.g. 512M); output is RGBA. "
+             f"Also bounds --pixels (default: {DEFAULT_MAX_MEMORY})",
+    )
+    parser.add_argument(
+        "--in-place", action="store_true",
+        help="GeoTIFF only: update the input's geotransform instead of writing a _rotated copy",
+    )
+    parser.add_argument(
+        "--pixels", action="store_true",
+        help="GeoTIFF only: rotate the pixels into a north-up _rotated copy instead of rotating only the "
+             "geotransform (by default GeoTIFF pixels are left unchanged)",
+    )
+    add_png_arguments(parser)
+    add_cache_arguments(parser)
+    add_report_argument(parser)
+    args = parser.parse_args()
 
     # Build output path: same folder, add _rotated before extension
     base, ext = os.path.splitext(args.input)
     output_path = f"{base}_rotated{ext}"
+    is_geotiff = ext.lower() in GEOTIFF_EXTENSIONS
+    if args.in_place and not is_geotiff:
+        parser.error("--in-place only applies to GeoTIFFs")
+    if args.pixels and not is_geotiff:
+        parser.error("--pixels only applies to GeoTIFFs; PNG pixels are always rotated")
+    if args.pixels and args.in_place:
+        parser.error("--pixels writes a new file and cannot be combined with --in-place")
 
-    # Save result
-    rotated.save(output_path)
-    print(f"Rotated image saved as: {output_path}")
+    if is_geotiff and args.pixels:
+        output_path = rotate_geotiff_pixels(
+            args.input, output_path, args.rotation, parse_size(args.max_memory or DEFAULT_MAX_MEMORY)
+        )
+        print(f"Rotated GeoTIFF saved as: {output_path}")
+    elif is_geotiff:
+        # Without --pixels GeoTIFFs are rotated on the map by their geotransform alone
+        output_path = rotate_geotiff(args.input, output_path, args.rotation, args.in_place)
+        print(f"Rotated georeferencing saved in: {output_path} (pixels unchanged)")
+    elif args.max_memory:
+        rotate_png(
+            args.input, output_path, args.rotation, parse_size(args.max_memory), cache_from_args(args),
+            png_options_from_args(args),
+        )
+        print(f"Rotated image saved as: {output_path}")
+    else:
+        # Open image
+        with phase("decode"):
+            img = open_image(args.input, cache_from_args(args))
+        count_read(args.input)
+
+        with phase("compute"):
+            rotated = rotate_in_memory(img, args.rotation)
+
+        # Save result via a temporary file, so a failed save leaves no partial output
+        with phase("encode"):
+            save_png(rotated, output_path, **png_options_from_args(args))
+        count_written(output_path)
+        print(f"Rotated image saved as: {output_path}")
+
+    write_report(
+        args.report, "rotate",
+        {
+            "input": args.input, "rotation": args.rotation, "max_memory": args.max_memory, "pixels": args.pixels,
+            **png_options_from_args(args),
+        },
+    )
 
 if __name__ == "__main__":
     main()
-
@@ -1,47 +1,162 @@
 import argparse
 import os
+from functools import partial
 from PIL import Image
+from decodecache import add_cache_arguments, cache_from_args, open_image
+from instrument import add_report_argument, count_read, count_written, phase, write_report
+from manifest import Manifest
+from pngstream import add_png_arguments, parse_size, png_options_from_args, save_png
+from rotation import OPERATIONS, rotate_in_memory, rotate_png
+from scheduler import DEFAULT_PREFETCH, add_prefetch_argument, image_pixels, print_summary, run_pipelined, run_tasks
 
 # Disable pixel limit warning for large images
 Image.MAX_IMAGE_PIXELS = None
 
 
-def rotate_image(path):
-    """Rotate a single image 90° counterclockwise and save as _rotated."""
+def manifest_params(operation):
+    """Recorded in the manifest; change it when the output of rotate_image changes."""
+    return {"rotation": operation}
+
+
+def output_path_for(path):
+    """Path of the _rotated output of path."""
     base, ext = os.path.splitext(path)
+    return f"{base}_rotated{ext}"
+
+
+def load_image(path, cache=None):
+    """Decode path; the first step of rotate_image."""
+    with phase("decode"):
+        img = open_image(path, cache)
+    count_read(path)
+    return path, img
+
+
+def rotate_loaded(loaded, operation="90"):
+    """Rotate a decoded image; the second step of rotate_image."""
+    path, img = loaded
+    with phase("compute"):
+        rotated = rotate_in_memory(img, operation)
+    return output_path_for(path), rotated
+
+
+def save_rotated(rotated_image, png_options=None):
+    """Encode a rotated image (atomically, see save_png); the last step of rotate_image."""
+    output_path, rotated = rotated_image
+    with phase("encode"):
+        save_png(rotated, output_path, **(png_options or {}))
+    count_written(output_path)
+    print(f"✅ Saved: {output_path}")
+    return output_path
+
+
+def rotate_image(path, cache=None, png_options=None, operation="90", max_memory=None):
+    """
+    Rotate (counterclockwise) or flip a single image and save as _rotated.
+    With max_memory the image is streamed through rotate_png instead of
+    being decoded whole, and written as RGBA.
+    """
+    base, _ = os.path.splitext(path)
     if base.endswith("_rotated"):
         # Skip already rotated images
         return
 
-    output_path = f"{base}_rotated{ext}"
+    if max_memory is None:
+        return save_rotated(rotate_loaded(load_image(path, cache), operation), png_options)
+
+    output_path = rotate_png(path, output_path_for(path), operation, max_memory, cache, png_options)
+    print(f"✅ Saved: {output_path}")
+    return output_path
 
-    try:
-        img = Image.open(path)
-        rotated = img.rotate(90, expand=True)
-        rotated.save(output_path)
-        print(f"✅ Saved: {output_path}")
-    except Exception as e:
-        print(f"❌ Failed to process {path}: {e}")
 
+def process_folder_recursively(
+    root_folder, jobs=1, force=False, cache=None, prefetch=DEFAULT_PREFETCH, png_options=None,
+    operation="90", max_memory=None,
+):
+    """
+    Recursively process all PNGs in all subfolders, returning per-file results.
 
-def process_folder_recursively(root_folder):
-    """Recursively process all PNGs in all subfolders."""
+    Images whose source and _rotated output are unchanged since the last run
+    (according to the tree's manifest) are skipped unless force is set.
+    With a single job, up to prefetch images are decoded ahead of and
+    encoded behind the one being rotated, unless max_memory streams them.
+    """
+    manifest = Manifest(root_folder)
+    params = manifest_params(operation)
+    tasks = []
+    skipped = 0
     for dirpath, _, filenames in os.walk(root_folder):
         for filename in filenames:
             if filename.lower().endswith(".png"):
                 image_path = os.path.join(dirpath, filename)
-                rotate_image(image_path)
+                base, _ = os.path.splitext(image_path)
+                if base.endswith("_rotated"):
+                    continue
+                files = [image_path, output_path_for(image_path)]
+                if not force and manifest.is_up_to_date(manifest.key("rotate_folder", image_path), files, params):
+                    skipped += 1
+                    continue
+                tasks.append((
+                    image_path, image_pixels(image_path), (image_path, cache, png_options, operation, max_memory)
+                ))
+
+    if jobs <= 1 and max_memory is None:
+        items = sorted((image_path, (image_path, cache)) for image_path, _, _ in tasks)
+        rotate = partial(rotate_loaded, operation=operation)
+        save = partial(save_rotated, png_options=png_options)
+        results = run_pipelined(items, load_image, rotate, save, prefetch)
+    else:
+        results = run_tasks(tasks, rotate_image, jobs)
+
+    for image_path, output_path, error in results:
+        if error is None:
+            manifest.record(manifest.key("rotate_folder", image_path), [image_path, output_path], params)
+    manifest.save()
+
+    if skipped:
+        print(f"⏭️  Skipped {skipped} up-to-date images (use --force to redo them)")
+    return results
 
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Recursively rotate all PNG images in a folder 90° counterclockwise."
+        description="Recursively rotate (counterclockwise) or flip all PNG images in a folder."
     )
     parser.add_argument("--folder", required=True, help="Path to the folder to process.")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes (default: 1).")
+    parser.add_argument("--force", action="store_true", help="Reprocess images even if they are up to date.")
+    parser.add_argument(
+        "--rotation", choices=OPERATIONS, default="90",
+        help="Counterclockwise rotation in degrees, or a left-right / top-bottom flip (default: 90).",
+    )
+    parser.add_argument(
+        "--max-memory",
+        help=(
+            "Stream each image through a bounded-memory rotation using about this much memory "
+            "(e.g. 512M, 4G) instead of decoding it whole; output is RGBA. The budget applies to each worker."
+        ),
+    )
+    add_prefetch_argument(parser)
+    add_png_arguments(parser)
+    add_cache_arguments(parser)
+    add_report_argument(parser)
     args = parser.parse_args()
 
-    process_folder_recursively(args.folder)
-    print("🎯 Done.")
+    max_memory = parse_size(args.max_memory) if args.max_memory else None
+    results = process_folder_recursively(
+        args.folder, args.jobs, args.force, cache_from_args(args), args.prefetch, png_options_from_args(args),
+        args.rotation, max_memory,
+    )
+    failures = print_summary(results, "images")
+    write_report(
+        args.report, "rotate_folder",
+        {
+            "folder": args.folder, "jobs": args.jobs, "prefetch": args.prefetch, "rotation": args.rotation,
+            "max_memory": max_memory, **png_options_from_args(args),
+        },
+    )
+    if failures:
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
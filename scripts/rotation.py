@@ -0,0 +1,149 @@
+"""
+Rotation and flipping of mosaics, in memory or with bounded memory.
+
+The streaming engine writes the output PNG band by band, each band built
+from one strip of the source: a column strip for 90° and 270°, a row strip
+for 180° and the flips. A left-right flip reads its strips straight from
+the PNG in order. The other operations need the source in another order
+than PNGs decode, so it is first decoded band by band into a scratch file
+next to the output, laid out strip after strip so each output band is one
+contiguous read (the decoded cache, when given, is read directly instead).
+Memory use is set by max_memory, not by the image size; the scratch file
+takes the decoded size on disk.
+"""
+import os
+import tempfile
+import numpy as np
+from PIL import Image
+from decodecache import open_band_reader
+from instrument import count_read, count_written, phase
+from pngstream import PngBandWriter, iter_bands, parse_size, rows_per_band
+
+# Counterclockwise rotations and flips, as Pillow transposes
+TRANSPOSES = {
+    "90": Image.Transpose.ROTATE_90,
+    "180": Image.Transpose.ROTATE_180,
+    "270": Image.Transpose.ROTATE_270,
+    "flip-h": Image.Transpose.FLIP_LEFT_RIGHT,
+    "flip-v": Image.Transpose.FLIP_TOP_BOTTOM,
+}
+OPERATIONS = tuple(TRANSPOSES)
+DEFAULT_MAX_MEMORY = "512M"
+# GDAL block cache while streaming; PNG rows are decoded once, so caching them only costs memory
+STREAM_GDAL_CACHE = 16 << 20
+
+
+def rotated_size(width, height, operation):
+    """(width, height) of an image of the given size after operation."""
+    if operation in ("90", "270"):
+        return height, width
+    return width, height
+
+
+def pixel_transform(width, height, operation):
+    """
+    Affine coefficients (a, b, c, d, e, f) taking pixel coordinates of a
+    width x height image to those of the same point after operation.
+    """
+    return {
+        "90": (0, 1, 0, -1, 0, width),
+        "180": (-1, 0, width, 0, -1, height),
+        "270": (0, -1, height, 1, 0, 0),
+        "flip-h": (-1, 0, width, 0, 1, 0),
+        "flip-v": (1, 0, 0, 0, -1, height),
+    }[operation]
+
+
+def source_strip(width, height, operation, row_off, rows):
+    """(row_off, rows, col_off, cols) of the source holding output rows row_off to row_off + rows."""
+    if operation == "90":
+        return 0, height, width - row_off - rows, rows
+    if operation == "270":
+        return 0, height, row_off, rows
+    if operation in ("180", "flip-v"):
+        return height - row_off - rows, rows, 0, width
+    return row_off, rows, 0, width
+
+
+def orient(strip, operation):
+    """Apply operation to a (rows, cols, 4) array, as a view where possible."""
+    if operation == "90":
+        return np.rot90(strip)
+    if operation == "270":
+        return np.rot90(strip, -1)
+    if operation == "180":
+        return strip[::-1, ::-1]
+    if operation == "flip-h":
+        return strip[:, ::-1]
+    return strip[::-1]
+
+
+def rotate_in_memory(img, operation="90"):
+    """Rotated or flipped copy of a PIL image, keeping its mode."""
+    return img.transpose(TRANSPOSES[operation])
+
+
+def _stage(reader, scratch, strips, max_memory):
+    """
+    Decode reader band by band into scratch, storing each (row_off, rows,
+    col_off, cols) strip contiguously. Returns the file offset of each strip.
+    """
+    offsets = np.cumsum([0] + [rows * cols * 4 for _, rows, _, cols in strips])[:-1]
+    for row_off, rows in iter_bands(reader.height, rows_per_band(reader.width, 1, max_memory)):
+        band = reader.read_rgba(row_off, rows)
+        for (strip_row, strip_rows, col_off, cols), offset in zip(strips, offsets):
+            first, last = max(row_off, strip_row), min(row_off + rows, strip_row + strip_rows)
+            if first >= last:
+                continue
+            scratch.seek(offset + (first - strip_row) * cols * 4)
+            scratch.write(np.ascontiguousarray(band[first - row_off:last - row_off, col_off:col_off + cols]))
+    return offsets
+
+
+def rotate_png(
+    in_path, out_path, operation="90", max_memory=parse_size(DEFAULT_MAX_MEMORY), cache=None, png_options=None
+):
+    """
+    Rotate or flip the 8-bit PNG at in_path into an RGBA PNG at out_path,
+    holding about max_memory bytes of pixels at a time.
+    """
+    import rasterio
+
+    with rasterio.Env(GDAL_CACHEMAX=STREAM_GDAL_CACHE), open_band_reader(in_path, cache) as reader, \
+            tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(out_path))) as scratch:
+        width, height = reader.width, reader.height
+        out_width, out_height = rotated_size(width, height, operation)
+        # The source strip and the writer's filtered copy of each band
+        band_rows = rows_per_band(out_width, 2, max_memory)
+
+        strips = [
+            source_strip(width, height, operation, row_off, rows) for row_off, rows in iter_bands(out_height, band_rows)
+        ]
+        staged = operation != "flip-h" and cache is None
+        if staged:
+            with phase("decode"):
+                offsets = _stage(reader, scratch, strips, max_memory)
+
+        writer = PngBandWriter(out_path, out_width, out_height, **(png_options or {}))
+        try:
+            for i, (strip_row, strip_rows, col_off, cols) in enumerate(strips):
+                with phase("decode"):
+                    if staged:
+                        scratch.seek(offsets[i])
+                        strip = np.frombuffer(scratch.read(strip_rows * cols * 4), np.uint8)
+                        strip = strip.reshape(strip_rows, cols, 4)
+                    else:
+                        strip = reader.read_rgba(strip_row, strip_rows, col_off, cols)
+                with phase("compute"):
+                    band = orient(strip, operation)
+                with phase("encode"):
+                    writer.write(band)
+        except BaseException:
+            writer.abort()
+            raise
+        with phase("encode"):
+            writer.close()
+
+    count_read(in_path)
+    count_written(out_path)
+    return out_path
@@ -0,0 +1,208 @@
+"""Process-pool scheduling of per-folder / per-file work across survey trees."""
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from PIL import Image
+import instrument
+
+Image.MAX_IMAGE_PIXELS = None
+
+# Items decoded ahead of (and encoded behind) the one being processed
+DEFAULT_PREFETCH = 2
+
+
+def image_pixels(path):
+    """Pixel count of an image, read from its header only."""
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+    except OSError:
+        return 0
+    return width * height
+
+
+def folder_pixels(folder_path, filenames):
+    """Total pixel count of the PNGs among filenames in folder_path."""
+    return sum(
+        image_pixels(os.path.join(folder_path, f))
+        for f in filenames
+        if f.lower().endswith(".png")
+    )
+
+
+def _instrumented_call(func, args):
+    """Run func in a worker and return its result with the worker's instrumentation."""
+    instrument.RUN.reset()
+    result = func(*args)
+    return result, instrument.RUN.snapshot()
+
+
+def run_tasks(tasks, func, jobs=1):
+    """
+    Run func(*args) for every (key, weight, args) in tasks.
+
+    With jobs > 1 the tasks are spread over a process pool, heaviest first, so
+    a single huge mosaic starts early instead of holding up the end of the run.
+    A failing task does not stop the others. Returns a list of
+    (key, result, error) tuples sorted by key, independent of completion order.
+    Timings and byte counts recorded by the workers are merged into this
+    process's instrument.RUN.
+    """
+    results = []
+
+    if jobs <= 1:
+        for key, _, args in tasks:
+            try:
+                results.append((key, func(*args), None))
+            except Exception as e:
+                results.append((key, None, e))
+        return sorted(results, key=lambda r: r[0])
+
+    ordered = sorted(tasks, key=lambda t: (-t[1], t[0]))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(_instrumented_call, func, args): key for key, _, args in ordered}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                result, snapshot = future.result()
+            except Exception as e:
+                results.append((key, None, e))
+                continue
+            instrument.RUN.merge(snapshot)
+            results.append((key, result, None))
+
+    return sorted(results, key=lambda r: r[0])
+
+
+def run_streamed(tasks, func, consume, jobs=1):
+    """
+    Run func(*args) for every (key, args) in tasks and hand each result to
+    consume(key, result) in this process as soon as it is ready.
+
+    Unlike run_tasks nothing is collected: at most 2 * jobs tasks are in
+    flight, in the given order, so tasks returning large arrays keep memory
+    bounded however many there are. Returns (key, consume's return value,
+    error) tuples sorted by key; an error in func or consume fails only
+    that task.
+    """
+    results = []
+
+    if jobs <= 1:
+        for key, args in tasks:
+            try:
+                results.append((key, consume(key, func(*args)), None))
+            except Exception as e:
+                results.append((key, None, e))
+        return sorted(results, key=lambda r: r[0])
+
+    remaining = iter(tasks)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = {}
+
+        def submit_next():
+            task = next(remaining, None)
+            if task is not None:
+                key, args = task
+                pending[pool.submit(_instrumented_call, func, args)] = key
+
+        for _ in range(2 * jobs):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                try:
+                    result, snapshot = future.result()
+                    instrument.RUN.merge(snapshot)
+                    results.append((key, consume(key, result), None))
+                except Exception as e:
+                    results.append((key, None, e))
+                submit_next()
+
+    return sorted(results, key=lambda r: r[0])
+
+
+def run_pipelined(items, load, process, save, depth=DEFAULT_PREFETCH, fail_fast=False):
+    """
+    Run save(process(load(*args))) for every (key, args) in items, overlapping the stages.
+
+    load runs on a reader thread up to depth items ahead, process runs on the
+    calling thread and save runs on a writer thread that may fall up to depth
+    items behind, so the next item is decoded and the previous one encoded
+    while the current one is processed. At most 2 * depth + 1 items are held
+    at once, and items are saved in order. depth 0 runs the stages one after
+    another. Returns (key, result, error) tuples in item order, like
+    run_tasks; with fail_fast the first error is raised instead.
+    """
+    results = []
+    if depth <= 0:
+        for key, args in items:
+            try:
+                results.append((key, save(process(load(*args))), None))
+            except Exception as e:
+                if fail_fast:
+                    raise
+                results.append((key, None, e))
+        return results
+
+    pending_loads = deque()
+    pending_saves = deque()
+    remaining = iter(items)
+
+    def load_next(reader):
+        item = next(remaining, None)
+        if item is not None:
+            key, args = item
+            pending_loads.append((key, reader.submit(load, *args)))
+
+    def collect_save():
+        key, future = pending_saves.popleft()
+        try:
+            results.append((key, future.result(), None))
+        except Exception as e:
+            if fail_fast:
+                raise
+            results.append((key, None, e))
+
+    with ThreadPoolExecutor(max_workers=1) as reader, ThreadPoolExecutor(max_workers=1) as writer:
+        for _ in range(depth):
+            load_next(reader)
+        while pending_loads:
+            key, future = pending_loads.popleft()
+            load_next(reader)
+            try:
+                processed = process(future.result())
+            except Exception as e:
+                if fail_fast:
+                    raise
+                results.append((key, None, e))
+                continue
+            pending_saves.append((key, writer.submit(save, processed)))
+            while len(pending_saves) > depth:
+                collect_save()
+        while pending_saves:
+            collect_save()
+
+    # A failed load or process is recorded before the earlier items finish saving
+    order = {key: i for i, (key, _) in enumerate(items)}
+    return sorted(results, key=lambda r: order[r[0]])
+
+
+def add_prefetch_argument(parser):
+    """Register the --prefetch option."""
+    parser.add_argument(
+        "--prefetch", type=int, default=DEFAULT_PREFETCH,
+        help=(
+            "Decode up to this many items ahead and encode up to this many behind the one being "
+            f"processed; 0 runs the steps one after another (default: {DEFAULT_PREFETCH})."
+        ),
+    )
+
+
+def print_summary(results, label="tasks"):
+    """Print failures and a one-line total; return the number of failures."""
+    failures = [(key, error) for key, _, error in results if error is not None]
+    for key, error in failures:
+        print(f"❌ Failed to process {key}: {error}")
+    print(f"🎯 Done: {len(results) - len(failures)}/{len(results)} {label} succeeded.")
+    return len(failures)
@@ -0,0 +1,313 @@
+"""
+Export a georeferenced GeoTIFF as a web tile pyramid (XYZ/TMS folders or MBTiles).
+
+The deepest zoom level is rendered straight from the GeoTIFF: every tile is
+warped to Web Mercator through its own WarpedVRT, so only the source window
+under the tile is read. Shallower levels are built from the four tiles below
+them instead of going back to the source. Tiles are rendered on a process
+pool and fully transparent tiles are never written.
+
+python3 tiles.py --input mosaic.tif --output tiles/ --format webp
+python3 tiles.py --input mosaic.tif --output mosaic.mbtiles --zoom 15 21 --jobs 8
+"""
+import argparse
+import math
+import os
+import shutil
+import sqlite3
+import tempfile
+import numpy as np
+import rasterio
+from PIL import Image
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform, transform_bounds
+from instrument import add_report_argument, count_read, phase, write_report
+from rasterbands import read_indexes, rgba_indexes, to_rgba
+from scheduler import print_summary, run_tasks
+
+TILE_SIZE = 256
+WEB_MERCATOR = "EPSG:3857"
+# Half the Web Mercator world width in meters
+ORIGIN_SHIFT = math.pi * 6378137.0
+FORMATS = {"png": "PNG", "webp": "WEBP"}
+# Tiles handed to a worker per task
+TILES_PER_TASK = 64
+
+
+def tile_bounds(x, y, zoom):
+    """Web Mercator (left, bottom, right, top) of an XYZ tile."""
+    size = 2 * ORIGIN_SHIFT / (1 << zoom)
+    left = -ORIGIN_SHIFT + x * size
+    top = ORIGIN_SHIFT - y * size
+    return left, top - size, left + size, top
+
+
+def tile_range(bounds, zoom):
+    """Inclusive XYZ (x0, y0, x1, y1) of the tiles covering Web Mercator bounds."""
+    left, bottom, right, top = bounds
+    size = 2 * ORIGIN_SHIFT / (1 << zoom)
+    last = (1 << zoom) - 1
+
+    def clamp(v):
+        return min(last, max(0, v))
+
+    return (
+        clamp(int((left + ORIGIN_SHIFT) // size)),
+        clamp(int((ORIGIN_SHIFT - top) // size)),
+        clamp(int(math.ceil((right + ORIGIN_SHIFT) / size)) - 1),
+        clamp(int(math.ceil((ORIGIN_SHIFT - bottom) / size)) - 1),
+    )
+
+
+def auto_zoom_range(src):
+    """
+    Zoom levels from the one whose pixels match the source resolution down
+    to the one where the whole image fits in a single tile.
+    """
+    transform, width, height = calculate_default_transform(
+        src.crs, WEB_MERCATOR, src.width, src.height, *src.bounds
+    )
+    resolution = abs(transform.a)
+    max_zoom = max(0, int(math.ceil(math.log2(2 * ORIGIN_SHIFT / (TILE_SIZE * resolution)))))
+    levels = max(0, int(math.ceil(math.log2(max(width, height) / TILE_SIZE))))
+    min_zoom = max(0, max_zoom - levels)
+    return min_zoom, max_zoom
+
+
+def tile_path(out_dir, zoom, x, y, fmt, scheme="xyz"):
+    """File path of a tile; TMS counts rows from the bottom."""
+    if scheme == "tms":
+        y = (1 << zoom) - 1 - y
+    return os.path.join(out_dir, str(zoom), str(x), f"{y}.{fmt}")
+
+
+def save_tile(rgba, path, fmt):
+    """Encode a tile, dropping the alpha band when it is fully opaque."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    image = Image.fromarray(rgba if (rgba[..., 3] < 255).any() else np.ascontiguousarray(rgba[..., :3]))
+    image.save(path, FORMATS[fmt])
+
+
+def load_tile(path):
+    """A tile as a (TILE_SIZE, TILE_SIZE, 4) array, or None if it was skipped."""
+    if not os.path.exists(path):
+        return None
+    with Image.open(path) as image:
+        return np.asarray(image.convert("RGBA"))
+
+
+def _tile_rgba(vrt, indexes):
+    # Alpha band, nodata or internal mask; outside the source it is 0
+    return to_rgba(vrt.read(indexes=read_indexes(indexes)), indexes, vrt.dataset_mask())
+
+
+def render_tiles(src_path, zoom, tiles, out_dir, fmt, scheme, resampling):
+    """
+    Render XYZ tiles of one zoom level from the source GeoTIFF.
+    Returns (written, skipped) counts.
+    """
+    written = skipped = 0
+    with rasterio.open(src_path) as src:
+        # Red, green and blue by colour interpretation, so uint8.py's NIR band is not shown
+        indexes = rgba_indexes(src)
+        for x, y in tiles:
+            transform = from_bounds(*tile_bounds(x, y, zoom), TILE_SIZE, TILE_SIZE)
+            with phase("decode"):
+                with WarpedVRT(
+                    src, crs=WEB_MERCATOR, transform=transform, width=TILE_SIZE, height=TILE_SIZE,
+                    resampling=Resampling[resampling],
+                ) as vrt:
+                    rgba = _tile_rgba(vrt, indexes)
+            if not rgba[..., 3].any():
+                skipped += 1
+                continue
+            with phase("encode"):
+                save_tile(rgba, tile_path(out_dir, zoom, x, y, fmt, scheme), fmt)
+            written += 1
+    return written, skipped
+
+
+def downsample(rgba):
+    """
+    Halve an RGBA array with a 2x2 average whose colours are weighted by
+    alpha, so transparent pixels (RGB 0) do not darken the pixels next to them.
+    """
+    rows, cols = rgba.shape[0] // 2, rgba.shape[1] // 2
+    blocks = rgba[:rows * 2, :cols * 2].reshape(rows, 2, cols, 2, 4).astype(np.uint32)
+    alpha = blocks[..., 3:]
+    alpha_sum = alpha.sum(axis=(1, 3))
+    colour = (blocks[..., :3] * alpha).sum(axis=(1, 3))
+    out = np.zeros((rows, cols, 4), dtype=np.uint8)
+    # Rounded weighted mean; fully opaque blocks get the plain box average
+    out[..., :3] = (colour + alpha_sum // 2) // np.maximum(alpha_sum, 1)
+    out[..., 3:] = (alpha_sum + 2) >> 2
+    return out
+
+
+def build_parent_tiles(zoom, tiles, out_dir, fmt, scheme):
+    """
+    Build tiles of zoom from their four children at zoom + 1 with an
+    alpha-weighted 2x2 average. Returns (written, skipped) counts.
+    """
+    written = skipped = 0
+    for x, y in tiles:
+        with phase("decode"):
+            children = [
+                [load_tile(tile_path(out_dir, zoom + 1, 2 * x + dx, 2 * y + dy, fmt, scheme)) for dx in (0, 1)]
+                for dy in (0, 1)
+            ]
+        if all(child is None for row in children for child in row):
+            skipped += 1
+            continue
+
+        with phase("compute"):
+            mosaic = np.zeros((2 * TILE_SIZE, 2 * TILE_SIZE, 4), dtype=np.uint8)
+            for dy, row in enumerate(children):
+                for dx, child in enumerate(row):
+                    if child is not None:
+                        mosaic[dy * TILE_SIZE:(dy + 1) * TILE_SIZE, dx * TILE_SIZE:(dx + 1) * TILE_SIZE] = child
+            rgba = downsample(mosaic)
+        if not rgba[..., 3].any():
+            skipped += 1
+            continue
+        with phase("encode"):
+            save_tile(rgba, tile_path(out_dir, zoom, x, y, fmt, scheme), fmt)
+        written += 1
+    return written, skipped
+
+
+def _chunks(tiles):
+    for start in range(0, len(tiles), TILES_PER_TASK):
+        yield tiles[start:start + TILES_PER_TASK]
+
+
+def export_tile_folder(src_path, out_dir, min_zoom, max_zoom, fmt="png", scheme="xyz",
+                       resampling="bilinear", jobs=1):
+    """Write the tile pyramid of src_path as out_dir/z/x/y.fmt; return (written, skipped, failures)."""
+    with rasterio.open(src_path) as src:
+        if src.crs is None:
+            raise ValueError(f"{src_path} has no CRS; georeference it first")
+        if any(dt != "uint8" for dt in src.dtypes):
+            raise ValueError(f"{src_path} is not 8-bit; convert it with uint8.py first")
+        bounds = transform_bounds(src.crs, WEB_MERCATOR, *src.bounds)
+
+    totals = [0, 0, 0]
+    for zoom in range(max_zoom, min_zoom - 1, -1):
+        x0, y0, x1, y1 = tile_range(bounds, zoom)
+        tiles = [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+        if zoom == max_zoom:
+            func = render_tiles
+            tasks = [(i, len(chunk), (src_path, zoom, chunk, out_dir, fmt, scheme, resampling))
+                     for i, chunk in enumerate(_chunks(tiles))]
+        else:
+            func = build_parent_tiles
+            tasks = [(i, len(chunk), (zoom, chunk, out_dir, fmt, scheme))
+                     for i, chunk in enumerate(_chunks(tiles))]
+
+        results = run_tasks(tasks, func, jobs)
+        written = sum(r[0] for _, r, error in results if error is None)
+        skipped = sum(r[1] for _, r, error in results if error is None)
+        failures = print_summary(results, f"tile batches at zoom {zoom}")
+        print(f"🧩 Zoom {zoom}: {written} tiles written, {skipped} empty tiles skipped")
+        totals[0] += written
+        totals[1] += skipped
+        totals[2] += failures
+
+    count_read(src_path)
+    return tuple(totals)
+
+
+def write_mbtiles(tile_dir, mbtiles_path, min_zoom, max_zoom, fmt, bounds, name):
+    """Pack an XYZ tile folder into an MBTiles file (rows in TMS order, as the spec requires)."""
+    tmp_path = f"{mbtiles_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    db = sqlite3.connect(tmp_path)
+    db.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+    db.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+    db.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+    metadata = {
+        "name": name, "format": fmt, "type": "overlay", "version": "1.0",
+        "minzoom": str(min_zoom), "maxzoom": str(max_zoom),
+        "bounds": ",".join(f"{v:.7f}" for v in bounds),
+    }
+    db.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+
+    for zoom in range(min_zoom, max_zoom + 1):
+        zoom_dir = os.path.join(tile_dir, str(zoom))
+        if not os.path.isdir(zoom_dir):
+            continue
+        for x in sorted(os.listdir(zoom_dir), key=int):
+            for filename in os.listdir(os.path.join(zoom_dir, x)):
+                y = int(os.path.splitext(filename)[0])
+                with open(os.path.join(zoom_dir, x, filename), "rb") as f:
+                    data = f.read()
+                db.execute(
+                    "INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                    (zoom, int(x), (1 << zoom) - 1 - y, sqlite3.Binary(data)),
+                )
+    db.commit()
+    db.close()
+    os.replace(tmp_path, mbtiles_path)
+
+
+def export_tiles(src_path, output, zoom=None, fmt="png", scheme="xyz", resampling="bilinear", jobs=1):
+    """
+    Export src_path as tiles into output: a folder, or an MBTiles file when
+    output ends in .mbtiles. zoom is a (min, max) pair or None for automatic.
+    Returns the number of failed tile batches.
+    """
+    with rasterio.open(src_path) as src:
+        min_zoom, max_zoom = zoom or auto_zoom_range(src)
+        lonlat_bounds = transform_bounds(src.crs, "EPSG:4326", *src.bounds) if src.crs else None
+    print(f"🌍 Exporting {os.path.basename(src_path)} as zoom {min_zoom}-{max_zoom} {fmt} tiles")
+
+    if not output.lower().endswith(".mbtiles"):
+        written, skipped, failures = export_tile_folder(
+            src_path, output, min_zoom, max_zoom, fmt, scheme, resampling, jobs
+        )
+        print(f"✅ {written} tiles written to {output} ({skipped} empty skipped)")
+        return failures
+
+    tile_dir = tempfile.mkdtemp(prefix=".tiles-", dir=os.path.dirname(os.path.abspath(output)))
+    try:
+        written, skipped, failures = export_tile_folder(
+            src_path, tile_dir, min_zoom, max_zoom, fmt, "xyz", resampling, jobs
+        )
+        with phase("package"):
+            name = os.path.splitext(os.path.basename(src_path))[0]
+            write_mbtiles(tile_dir, output, min_zoom, max_zoom, fmt, lonlat_bounds, name)
+    finally:
+        shutil.rmtree(tile_dir, ignore_errors=True)
+    print(f"✅ {written} tiles written to {output} ({skipped} empty skipped)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a GeoTIFF as XYZ/TMS tiles or an MBTiles file.")
+    parser.add_argument("--input", required=True, help="Georeferenced 8-bit GeoTIFF")
+    parser.add_argument("--output", required=True, help="Tile folder, or a .mbtiles file")
+    parser.add_argument("--zoom", nargs=2, type=int, metavar=("MIN", "MAX"),
+                        help="Zoom range (default: from the GeoTIFF resolution and size)")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="png", help="Tile image format (default: png)")
+    parser.add_argument("--scheme", choices=["xyz", "tms"], default="xyz",
+                        help="Row numbering of tile folders (default: xyz; MBTiles always uses TMS)")
+    parser.add_argument("--resampling", choices=["nearest", "bilinear", "cubic", "lanczos"], default="bilinear",
+                        help="Resampling for the deepest zoom level (default: bilinear)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Worker processes (default: all CPUs)")
+    add_report_argument(parser)
+    args = parser.parse_args()
+
+    failures = export_tiles(
+        args.input, args.output, tuple(args.zoom) if args.zoom else None,
+        args.format, args.scheme, args.resampling, args.jobs,
+    )
+    write_report(args.report, "tiles", vars(args))
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,85 +1,301 @@
 #!/usr/bin/env python3
 import argparse
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import rasterio
 from rasterio.enums import ColorInterp
+from rasterio.windows import Window
+from instrument import add_report_argument, count_read, count_written, phase, write_report
+from geotiff_writer import add_cog_argument, geotiff_output
 
-def convert_to_uint8(path_in):
+def build_lut():
+    """
+    Lookup table for the uint16 → uint8 rule: values < 256 become 0, the rest
+    scale linearly to 0–255. Computed with the same float32 arithmetic the
+    per-pixel conversion used, so the result is bit-identical.
+    """
+    values = np.arange(65536, dtype=np.float32)
+    lut = np.clip((values / 65535) * 255, 0, 255).astype(np.uint8)
+    lut[:256] = 0
+    return lut
+
+
+LUT = build_lut()
+
+STRETCH_CHOICES = ("fixed", "percentile")
+DEFAULT_PERCENTILES = (2.0, 98.0)
+# Size of the windows read for the histograms, per thread
+HISTOGRAM_WINDOW_BYTES = 16 << 20
+
+
+def convert_block(data, nodata_value=None, luts=None):
+    """
+    Convert a (bands, rows, cols) block to uint8, with the fixed rule or,
+    given per-band luts (see stretch_luts), with a stretch.
+    """
+    if luts is not None:
+        data_uint8 = np.empty(data.shape, dtype=np.uint8)
+        for band, lut in enumerate(luts):
+            data_uint8[band] = lut[data[band]]
+    elif data.dtype in (np.uint8, np.uint16):
+        data_uint8 = LUT[data]
+    else:
+        # Other dtypes fall outside the table; use the float rule directly
+        data_float = data.astype(np.float32)
+        data_float[data_float < 256] = 0
+        data_uint8 = np.clip((data_float / 65535) * 255, 0, 255).astype(np.uint8)
+
+    # Handle nodata properly (preserve nodata mask if present)
+    if nodata_value is not None:
+        data_uint8[data == nodata_value] = 0  # set nodata areas to 0
+
+    return data_uint8
+
+
+def histogram_windows(src, target_bytes=HISTOGRAM_WINDOW_BYTES):
+    """
+    Windows of about target_bytes covering src, made of whole blocks: full
+    rows where a row of blocks fits, otherwise runs of blocks along a row.
+    """
+    block_rows, block_cols = src.block_shapes[0]
+    pixel_bytes = src.count * np.dtype(src.dtypes[0]).itemsize
+    rows, cols = block_rows, src.width
+    if block_rows * src.width * pixel_bytes <= target_bytes:
+        rows = target_bytes // (src.width * pixel_bytes) // block_rows * block_rows
+    else:
+        cols = max(block_cols, target_bytes // (block_rows * pixel_bytes) // block_cols * block_cols)
+    return [
+        Window(col_off, row_off, min(cols, src.width - col_off), min(rows, src.height - row_off))
+        for row_off in range(0, src.height, rows)
+        for col_off in range(0, src.width, cols)
+    ]
+
+
+def band_histograms(path_in, num_threads=None):
+    """
+    Exact per-band histograms of a uint8/uint16 GeoTIFF as a (bands, 65536)
+    array, built in one pass over multi-megabyte windows. Each thread counts
+    into its own histograms, added up once at the end. Nodata pixels are not
+    counted.
+    """
+    num_threads = num_threads or os.cpu_count() or 1
+    with rasterio.open(path_in) as src:
+        if any(dt not in ("uint8", "uint16") for dt in src.dtypes):
+            raise ValueError(f"{path_in}: histogram stretch needs uint8 or uint16 bands, got {src.dtypes[0]}")
+        nodata_value = src.nodata
+        count = src.count
+        # Workers take windows in file order, so reads stay sequential
+        windows = iter(histogram_windows(src))
+        read_lock = threading.Lock()
+
+        def process():
+            histograms = np.zeros((count, 65536), dtype=np.int64)
+            while True:
+                with read_lock:
+                    window = next(windows, None)
+                    if window is None:
+                        return histograms
+                    with phase("decode"):
+                        data = src.read(window=window)
+                with phase("histogram"):
+                    for band, values in enumerate(data):
+                        counts = np.bincount(values.ravel())
+                        histograms[band, :counts.size] += counts
+
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            futures = [executor.submit(process) for _ in range(num_threads)]
+            histograms = sum(future.result() for future in futures)
+
+    # Nodata pixels all land in one bin; anything outside the value range matches no pixel
+    if nodata_value is not None and float(nodata_value).is_integer() and 0 <= nodata_value < 65536:
+        histograms[:, int(nodata_value)] = 0
+
+    count_read(path_in)
+    return histograms
+
+
+def stretch_luts(histograms, percentiles=DEFAULT_PERCENTILES, nodata_value=None):
+    """
+    Per-band lookup tables stretching the values between the given low and
+    high percentiles of each histogram linearly onto 0-255. With a nodata
+    value, valid pixels map to 1-255 so they stay distinct from nodata (0).
+    Returns the (bands, 65536) tables and the (low, high) value of each band.
+    """
+    low_pct, high_pct = percentiles
+    floor = 1 if nodata_value is not None else 0
+    values = np.arange(65536, dtype=np.float64)
+    luts = np.zeros(histograms.shape, dtype=np.uint8)
+    ranges = []
+    for band, histogram in enumerate(histograms):
+        cdf = np.cumsum(histogram)
+        total = cdf[-1]
+        if not total:
+            ranges.append((0, 0))
+            continue
+        low = int(np.searchsorted(cdf, total * low_pct / 100, side="right"))
+        high = max(low + 1, int(np.searchsorted(cdf, total * high_pct / 100, side="left")))
+        luts[band] = np.clip(np.round((values - low) * 255 / (high - low)), floor, 255)
+        ranges.append((low, high))
+    return luts, ranges
+
+
+def print_ranges(ranges, label):
+    print(f"📊 Stretch for {label}: " + ", ".join(f"band {i} {lo}-{hi}" for i, (lo, hi) in enumerate(ranges, 1)))
+
+
+def apply_band_metadata(dst, count, src_tags, src_band_tags):
+    """Set NIR/RGB color interpretation and band names, then restore the source tags."""
+    # Restore correct band interpretations (NIR, Red, Green, Blue)
+    if count == 4:
+        dst.colorinterp = (
+            ColorInterp.gray,   # Band 1: NIR
+            ColorInterp.red,    # Band 2: Red
+            ColorInterp.green,  # Band 3: Green
+            ColorInterp.blue    # Band 4: Blue
+        )
+    elif count == 3:
+        dst.colorinterp = (
+            ColorInterp.red,
+            ColorInterp.green,
+            ColorInterp.blue
+        )
+    else:
+        dst.colorinterp = tuple([ColorInterp.undefined] * count)
+
+    # Add band name metadata (visible in QGIS metadata)
+    band_names = ["NIR", "Red", "Green", "Blue"]
+    for i, name in enumerate(band_names[:count], start=1):
+        dst.update_tags(i, BAND_NAME=name)
+
+    # Preserve dataset-level and per-band metadata
+    dst.update_tags(**src_tags)
+    for i, band_tags in enumerate(src_band_tags, start=1):
+        if band_tags:
+            dst.update_tags(i, **band_tags)
+
+
+def convert_to_uint8(path_in, num_threads=None, cog=False, luts=None):
+    """
+    Write path_in as <name>_uint8.tif, with the fixed uint16 rule or with
+    per-band stretch luts (see stretch_luts).
+    """
     # Generate output path
     base, ext = os.path.splitext(path_in)
     path_out = f"{base}_uint8{ext}"
+    num_threads = num_threads or os.cpu_count() or 1
 
     # Read GeoTIFF
     with rasterio.open(path_in) as src:
         profile = src.profile
-        data = src.read()  # shape: (bands, height, width), dtype=uint16
+        count = src.count
+        windows = [window for _, window in src.block_windows(1)]
 
         # Save metadata and color info
         src_tags = src.tags()
         src_band_tags = [src.tags(i + 1) for i in range(src.count)]
         src_colorinterp = src.colorinterp
 
-    # Convert from uint16 → uint8 (custom scaling)
-    data_float = data.astype(np.float32)
+        nodata_value = profile.get("nodata", None)
 
-    # Force all values <256 → 0, scale the rest linearly to 0–255
-    data_float[data_float < 256] = 0
-    data_uint8 = np.clip((data_float / 65535) * 255, 0, 255).astype(np.uint8)
+        # Update profile
+        profile.update(dtype=rasterio.uint8, count=count)
 
-    # Handle nodata properly (preserve nodata mask if present)
-    nodata_value = profile.get("nodata", None)
-    if nodata_value is not None:
-        for b in range(data.shape[0]):
-            mask = data[b] == nodata_value
-            data_uint8[b][mask] = 0  # set nodata areas to 0
-
-    # Update profile
-    profile.update(dtype=rasterio.uint8, count=data_uint8.shape[0])
-
-    # Write GeoTIFF
-    with rasterio.open(path_out, 'w', **profile) as dst:
-        dst.write(data_uint8)
-
-        # Restore correct band interpretations (NIR, Red, Green, Blue)
-        if data_uint8.shape[0] == 4:
-            dst.colorinterp = (
-                ColorInterp.gray,   # Band 1: NIR
-                ColorInterp.red,    # Band 2: Red
-                ColorInterp.green,  # Band 3: Green
-                ColorInterp.blue    # Band 4: Blue
-            )
-        elif data_uint8.shape[0] == 3:
-            dst.colorinterp = (
-                ColorInterp.red,
-                ColorInterp.green,
-                ColorInterp.blue
-            )
-        else:
-            dst.colorinterp = tuple([ColorInterp.undefined] * data_uint8.shape[0])
-
-        # Add band name metadata (visible in QGIS metadata)
-        band_names = ["NIR", "Red", "Green", "Blue"]
-        for i, name in enumerate(band_names[:data_uint8.shape[0]], start=1):
-            dst.update_tags(i, BAND_NAME=name)
-
-        # Preserve dataset-level and per-band metadata
-        dst.update_tags(**src_tags)
-        for i, band_tags in enumerate(src_band_tags, start=1):
-            if band_tags:
-                dst.update_tags(i, **band_tags)
+        # Write GeoTIFF block by block; rasterio datasets are not thread-safe,
+        # so reads and writes are serialized while the conversion runs in parallel
+        with geotiff_output(path_out, cog) as path:
+            with rasterio.open(path, 'w', **profile) as dst:
+                read_lock = threading.Lock()
+                write_lock = threading.Lock()
+
+                def process(window):
+                    with read_lock, phase("decode"):
+                        data = src.read(window=window)
+                    with phase("compute"):
+                        data_uint8 = convert_block(data, nodata_value, luts)
+                    with write_lock, phase("encode"):
+                        dst.write(data_uint8, window=window)
+
+                with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                    for _ in executor.map(process, windows):
+                        pass
+
+                apply_band_metadata(dst, count, src_tags, src_band_tags)
+                with phase("encode"):
+                    dst.close()
+
+    count_read(path_in)
+    count_written(path_out)
 
     print(f"✅ Converted file saved as: {path_out}")
 
 
+def convert_files(
+    paths, num_threads=None, cog=False, stretch="fixed", percentiles=DEFAULT_PERCENTILES, shared=False,
+):
+    """
+    Convert every file in paths. The percentile stretch reads each file
+    twice: once for its histograms, once to convert. With shared, the
+    histograms of all files are added up first so they share one stretch.
+    """
+    if stretch == "fixed":
+        for path in paths:
+            convert_to_uint8(path, num_threads, cog)
+        return
+
+    def nodata(path):
+        with rasterio.open(path) as src:
+            return src.nodata
+
+    if shared:
+        histograms = None
+        for path in paths:
+            counts = band_histograms(path, num_threads)
+            if histograms is not None and counts.shape != histograms.shape:
+                raise ValueError(f"{path} has {counts.shape[0]} bands, expected {histograms.shape[0]}")
+            histograms = counts if histograms is None else histograms + counts
+        # Keep valid pixels off 0 if any of the files uses nodata
+        nodata_value = next((v for v in map(nodata, paths) if v is not None), None)
+        luts, ranges = stretch_luts(histograms, percentiles, nodata_value)
+        print_ranges(ranges, f"all {len(paths)} files")
+        for path in paths:
+            convert_to_uint8(path, num_threads, cog, luts)
+        return
+
+    for path in paths:
+        luts, ranges = stretch_luts(band_histograms(path, num_threads), percentiles, nodata(path))
+        print_ranges(ranges, os.path.basename(path))
+        convert_to_uint8(path, num_threads, cog, luts)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Convert uint16 GeoTIFF to uint8")
-    parser.add_argument("--path_in", required=True, help="Path to the input GeoTIFF")
+    parser.add_argument("--path_in", required=True, nargs="+", help="Path(s) to the input GeoTIFF(s)")
+    parser.add_argument("--num-threads", type=int, default=None, help="Worker threads (default: CPU count)")
+    parser.add_argument(
+        "--stretch", choices=STRETCH_CHOICES, default="fixed",
+        help="fixed: values below 256 become 0, the rest scale from 0-65535; "
+             "percentile: per-band histogram stretch (default: fixed)",
+    )
+    parser.add_argument(
+        "--percentiles", nargs=2, type=float, default=DEFAULT_PERCENTILES, metavar=("LOW", "HIGH"),
+        help="Percentiles mapped to 0 and 255 by the percentile stretch (default: 2 98)",
+    )
+    parser.add_argument(
+        "--shared", action="store_true",
+        help="Compute one percentile stretch over all inputs, so a survey is scaled the same way",
+    )
+    add_cog_argument(parser)
+    add_report_argument(parser)
     args = parser.parse_args()
+    low, high = args.percentiles
+    if not 0 <= low < high <= 100:
+        parser.error(f"--percentiles must satisfy 0 <= LOW < HIGH <= 100, got {low:g} {high:g}")
 
-    convert_to_uint8(args.path_in)
+    convert_files(args.path_in, args.num_threads, args.cog, args.stretch, tuple(args.percentiles), args.shared)
+    write_report(args.report, "uint8", vars(args))
 
 
 if __name__ == "__main__":
     main()
-
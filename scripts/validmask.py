@@ -0,0 +1,137 @@
+"""
+Bit-packed validity mask sidecars for compare_pngs folders.
+
+The combined mask of a folder (True where no image is transparent, and no
+mosaic_x image is black) is kept next to the images as 1 bit per pixel:
+.opencosmos_mask.npy holds np.packbits rows and .opencosmos_mask.json lists
+the images, with size, mtime and hash, whose masks are already folded in. Adding
+an image to the folder then only needs that image's mask ANDed into the
+sidecar, and png2geotiff can write the mask as the GeoTIFF's internal mask.
+"""
+import json
+import os
+import numpy as np
+from PIL import Image
+from manifest import file_sha256
+
+MASK_NAME = ".opencosmos_mask"
+
+
+def pack_rows(valid):
+    """Pack a boolean (rows, width) array into (rows, ceil(width / 8)) bytes."""
+    return np.packbits(valid, axis=1)
+
+
+def unpack_rows(bits, width):
+    """Inverse of pack_rows."""
+    return np.unpackbits(bits, axis=1, count=width).astype(bool)
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": file_sha256(path)}
+
+
+class ValidityMask:
+    """
+    The packed validity mask of a folder, read from or written to its sidecar.
+
+    Bits are memory-mapped, so row bands can be read or written without
+    holding the whole mask.
+    """
+
+    def __init__(self, folder_path, bits, width, members):
+        self.folder_path = folder_path
+        self.bits = bits
+        self.width = width
+        self.height = bits.shape[0]
+        self.members = members
+
+    @staticmethod
+    def paths(folder_path):
+        base = os.path.join(folder_path, MASK_NAME)
+        return f"{base}.npy", f"{base}.json"
+
+    @classmethod
+    def load(cls, folder_path, width=None, height=None):
+        """
+        The folder's sidecar, or None if there is none or (when width and
+        height are given) it was built for images of another size.
+        """
+        bits_path, meta_path = cls.paths(folder_path)
+        if not (os.path.exists(bits_path) and os.path.exists(meta_path)):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if width is not None and (meta["width"], meta["height"]) != (width, height):
+            return None
+        bits = np.load(bits_path, mmap_mode="r")
+        return cls(folder_path, bits, meta["width"], meta["members"])
+
+    @classmethod
+    def create(cls, folder_path, width, height):
+        """A new all-valid mask, written to a temporary file until save()."""
+        bits_path, _ = cls.paths(folder_path)
+        bits = np.lib.format.open_memmap(
+            f"{bits_path}.tmp.npy", mode="w+", dtype=np.uint8, shape=(height, (width + 7) // 8)
+        )
+        bits[:] = 0xFF
+        return cls(folder_path, bits, width, {})
+
+    @classmethod
+    def for_image(cls, image_path):
+        """The sidecar of image_path's folder; raises ValueError if it does not fit the image."""
+        with Image.open(image_path) as img:
+            width, height = img.size
+        folder_path = os.path.dirname(os.path.abspath(image_path))
+        mask = cls.load(folder_path, width, height)
+        if mask is None:
+            raise ValueError(
+                f"No {width}x{height} mask sidecar in {folder_path}; run compare_pngs.py on the folder first"
+            )
+        return mask
+
+    def is_member(self, path):
+        """
+        Whether path's mask is folded in and the file is unchanged since. As in
+        the manifest, a changed mtime with identical content still counts.
+        """
+        known = self.members.get(os.path.basename(path))
+        if known is None:
+            return False
+        st = os.stat(path)
+        if known["size"] != st.st_size:
+            return False
+        return known["mtime_ns"] == st.st_mtime_ns or known["sha256"] == file_sha256(path)
+
+    def read(self, row_off, rows):
+        """Validity of rows starting at row_off as a boolean (rows, width) array."""
+        return unpack_rows(np.asarray(self.bits[row_off:row_off + rows]), self.width)
+
+    def write(self, row_off, valid):
+        """Store a boolean band of validity starting at row_off."""
+        self.bits[row_off:row_off + valid.shape[0]] = pack_rows(valid)
+
+    def save(self, member_paths):
+        """Move a created mask into place with the member list (and current stamps)."""
+        bits_path, meta_path = self.paths(self.folder_path)
+        self.bits.flush()
+        self.bits = None
+
+        meta = {
+            "width": self.width,
+            "height": self.height,
+            "members": {os.path.basename(p): _stamp(p) for p in member_paths},
+        }
+        with open(f"{meta_path}.tmp", "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(f"{bits_path}.tmp.npy", bits_path)
+        os.replace(f"{meta_path}.tmp", meta_path)
+        self.bits = np.load(bits_path, mmap_mode="r")
+
+    def discard(self):
+        """Drop a created mask that will not be saved."""
+        bits_path, _ = self.paths(self.folder_path)
+        self.bits = None
+        if os.path.exists(f"{bits_path}.tmp.npy"):
+            os.remove(f"{bits_path}.tmp.npy")
@@ -0,0 +1,66 @@
+"""PNGs of any bit depth and colour type, written byte by byte for reader tests."""
+import struct
+import zlib
+import numpy as np
+
+SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+
+def write_raw_png(path, samples, bit_depth, colour_type, palette=None, trns=None):
+    """
+    Write samples, an (H, W, channels) array of raw sample values, as a PNG
+    with the given IHDR bit depth and colour type, optional PLTE entries and
+    optional raw tRNS payload.
+    """
+    height, width, _ = samples.shape
+    scanlines = []
+    for row in samples:
+        if bit_depth == 16:
+            raw = row.astype(">u2").tobytes()
+        elif bit_depth == 8:
+            raw = row.astype(np.uint8).tobytes()
+        else:
+            bits = np.unpackbits(row.reshape(-1, 1).astype(np.uint8), axis=1)[:, 8 - bit_depth:]
+            raw = np.packbits(bits.reshape(-1)).tobytes()
+        scanlines.append(b"\0" + raw)
+
+    data = SIGNATURE + _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, bit_depth, colour_type, 0, 0, 0))
+    if palette is not None:
+        data += _chunk(b"PLTE", np.asarray(palette, dtype=np.uint8).tobytes())
+    if trns is not None:
+        data += _chunk(b"tRNS", trns)
+    data += _chunk(b"IDAT", zlib.compress(b"".join(scanlines))) + _chunk(b"IEND", b"")
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+# (name, bit depth, colour type, tRNS) of the PNGs PngBandReader must decode like Pillow
+STREAMABLE = [
+    ("gray1", 1, 0, None), ("gray1_key", 1, 0, struct.pack(">H", 1)), ("gray2", 2, 0, None),
+    ("gray4", 4, 0, None), ("gray8", 8, 0, None), ("gray8_key", 8, 0, struct.pack(">H", 3)),
+    ("rgb8", 8, 2, None), ("rgb8_key", 8, 2, struct.pack(">HHH", 5, 6, 7)),
+    ("pal1", 1, 3, None), ("pal4_alpha", 4, 3, bytes([0, 128, 255])), ("pal8", 8, 3, None),
+    ("gray_alpha8", 8, 4, None), ("rgba8", 8, 6, None),
+]
+# (name, bit depth, colour type, tRNS) of the PNGs it must refuse
+UNSTREAMABLE = [
+    ("gray2_key", 2, 0, struct.pack(">H", 1)), ("gray4_key", 4, 0, struct.pack(">H", 3)),
+    ("gray16", 16, 0, None), ("rgb16", 16, 2, None), ("rgba16", 16, 6, None),
+]
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+def make_png(path, bit_depth, colour_type, trns, seed=0):
+    """A small random PNG in the given format, with the tested colour keys present."""
+    rng = np.random.default_rng(seed)
+    top = (1 << bit_depth) - 1
+    samples = rng.integers(0, top + 1, (9, 13, CHANNELS[colour_type]))
+    # Make sure colour keys occur
+    samples[0, :3] = [5, 6, 7][:samples.shape[2]] if colour_type == 2 else min(3, top)
+    palette = rng.integers(0, 256, (1 << bit_depth, 3)) if colour_type == 3 else None
+    write_raw_png(path, samples, bit_depth, colour_type, palette, trns)
+    return path
@@ -0,0 +1,71 @@
+import sys
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+import align
+from movetif import move_geotiff
+
+RES = 0.1
+LEFT, TOP = 430000.0, 4380000.0
+
+
+def world(xs, ys, seed=0):
+    """Smooth random texture of map coordinates, the same for every raster cut from it."""
+    rng = np.random.default_rng(seed)
+    value = np.zeros(np.broadcast(xs, ys).shape)
+    for _ in range(40):
+        kx, ky = rng.normal(0, 2.5, 2)
+        value += np.sin(kx * xs + ky * ys + rng.uniform(0, 2 * np.pi))
+    return value
+
+
+def write_cut(path, left, top, size=512, error=(0.0, 0.0)):
+    """
+    RGB GeoTIFF of the texture under a size x size grid at (left, top),
+    georeferenced with its origin off by error = (east, north) meters.
+    """
+    xs = left + (np.arange(size) + 0.5) * RES
+    ys = top - (np.arange(size) + 0.5) * RES
+    value = world(xs[None, :], ys[:, None])
+    gray = np.clip(128 + 18 * value, 0, 255).astype(np.uint8)
+    with rasterio.open(
+        path, "w", driver="GTiff", width=size, height=size, count=3, dtype="uint8", crs="EPSG:25831",
+        transform=from_origin(left + error[0], top + error[1], RES, RES),
+    ) as dst:
+        dst.write(np.stack([gray, 255 - gray, gray // 2 + 64]))
+    return str(path)
+
+
+def test_cli_aligns_two_shifted_geotiffs(tmp_path, monkeypatch, capsys):
+    reference = write_cut(tmp_path / "mosaic_over.tif", LEFT, TOP)
+    # The moving raster shows ground 4 m east and 3 m south, but claims to sit 1 m further east
+    moving = write_cut(tmp_path / "mosaic_x.tif", LEFT + 4.0, TOP - 3.0, error=(1.0, 0.0))
+    offsets = tmp_path / "offsets.csv"
+    monkeypatch.setattr(
+        sys, "argv", ["align.py", "--reference", reference, "--moving", moving, "--offsets", str(offsets)]
+    )
+    align.main()
+
+    out = capsys.readouterr().out
+    assert "1/1 pairs succeeded" in out
+    row = offsets.read_text().splitlines()[1].split(",")
+    assert abs(float(row[1])) < 0.02
+    assert abs(float(row[2]) + 1.0) < 0.02
+
+
+@pytest.mark.parametrize("error", [(0.037, -0.023), (-0.261, 0.148)])
+def test_sub_pixel_shift_in_meters(tmp_path, error):
+    reference = write_cut(tmp_path / "mosaic_over.tif", LEFT, TOP)
+    moving = write_cut(tmp_path / "mosaic_x.tif", LEFT + 4.0, TOP - 3.0, error=error)
+    result = align.align_pair(reference, moving)
+
+    # movetif's shift that undoes the georeferencing error
+    assert result["east"] == pytest.approx(-error[0], abs=0.005)
+    assert result["north"] == pytest.approx(error[1], abs=0.005)
+
+    moved = str(tmp_path / "mosaic_x_moved.tif")
+    move_geotiff(moving, moved, result["north"], result["east"])
+    with rasterio.open(moved) as src:
+        assert src.transform.c == pytest.approx(LEFT + 4.0, abs=0.005)
+        assert src.transform.f == pytest.approx(TOP - 3.0, abs=0.005)
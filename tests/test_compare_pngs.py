@@ -0,0 +1,74 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from compare_pngs import compare_all_pngs_in_folder, compare_and_filter_all
+
+NAMES = ["mosaic_x2.png", "mosaic_over.png", "mosaic.png"]
+
+
+def reference_filter(images, filenames):
+    """The original per-pixel loop of compare_and_filter_all."""
+    width, height = images[0].size
+    pixel_data = [img.load() for img in images]
+
+    for y in range(height):
+        for x in range(width):
+            make_transparent = False
+
+            for idx, pixels in enumerate(pixel_data):
+                r, g, b, a = pixels[x, y]
+                if a == 0 or ("mosaic_x" in filenames[idx].lower() and (r, g, b) == (0, 0, 0)):
+                    make_transparent = True
+                    break
+
+            if make_transparent:
+                for p in pixel_data:
+                    p[x, y] = (0, 0, 0, 0)
+
+    return images
+
+
+def to_images(arrays):
+    """Writable PIL copies of arrays."""
+    return [Image.fromarray(a, "RGBA").copy() for a in arrays]
+
+
+def random_rgba(rng, height, width):
+    """RGBA noise with some transparent and some pure black (but opaque) pixels."""
+    arr = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    arr[rng.random((height, width)) < 0.1, 3] = 0
+    arr[rng.random((height, width)) < 0.1, :3] = 0
+    return arr
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_filter_matches_per_pixel_loop(seed):
+    rng = np.random.default_rng(seed)
+    height, width = rng.integers(1, 24, 2)
+    arrays = [random_rgba(rng, height, width) for _ in NAMES]
+
+    expected = reference_filter(to_images(arrays), NAMES)
+    filtered = compare_and_filter_all(to_images(arrays), NAMES)
+
+    for got, want in zip(filtered, expected):
+        np.testing.assert_array_equal(np.asarray(got), np.asarray(want))
+
+
+@pytest.mark.parametrize("max_memory", [None, 2048])
+def test_folder_matches_per_pixel_loop(tmp_path, max_memory):
+    rng = np.random.default_rng(7)
+    arrays = [random_rgba(rng, 17, 11) for _ in NAMES]
+    for name, arr in zip(NAMES, arrays):
+        Image.fromarray(arr, "RGBA").save(tmp_path / name)
+    # A mosaic_over of another size is left out of the comparison and untouched
+    odd = random_rgba(rng, 5, 5)
+    Image.fromarray(odd, "RGBA").save(tmp_path / "mosaic_over_small.png")
+
+    expected = reference_filter(to_images(arrays), NAMES)
+    compare_all_pngs_in_folder(str(tmp_path), max_memory=max_memory)
+
+    for name, want in zip(NAMES, expected):
+        np.testing.assert_array_equal(np.asarray(Image.open(tmp_path / name)), np.asarray(want))
+    np.testing.assert_array_equal(np.asarray(Image.open(tmp_path / "mosaic_over_small.png")), odd)
+    assert not any(f.endswith(".tmp") for f in os.listdir(tmp_path))
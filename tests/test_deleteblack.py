@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from PIL import Image
+from rawpng import STREAMABLE, UNSTREAMABLE, make_png, write_raw_png
+from deleteblack import delete_black
+
+
+def reference_delete_black(path):
+    """The original getdata/putdata loop of deleteblack."""
+    img = Image.open(path).convert("RGBA")
+    new_data = []
+    for item in img.getdata():
+        if item[0] == 0 and item[1] == 0 and item[2] == 0:
+            new_data.append((0, 0, 0, 0))
+        else:
+            new_data.append(item)
+    img.putdata(new_data)
+    return np.asarray(img)
+
+
+@pytest.mark.filterwarnings("ignore:Image.Image.getdata:DeprecationWarning")
+@pytest.mark.parametrize("name, bit_depth, colour_type, trns", STREAMABLE + UNSTREAMABLE)
+def test_threshold_zero_matches_original_loop(tmp_path, name, bit_depth, colour_type, trns):
+    path = make_png(tmp_path / f"{name}.png", bit_depth, colour_type, trns)
+    out = delete_black(str(path), threshold=0, max_memory=1024)
+    np.testing.assert_array_equal(np.asarray(Image.open(out)), reference_delete_black(path))
+
+
+@pytest.mark.filterwarnings("ignore:Image.Image.getdata:DeprecationWarning")
+def test_black_rgba_in_strips(tmp_path):
+    rng = np.random.default_rng(3)
+    samples = rng.integers(0, 4, (40, 30, 4))
+    write_raw_png(tmp_path / "in.png", samples, 8, 6)
+    out = delete_black(str(tmp_path / "in.png"), threshold=0, max_memory=2048)
+    np.testing.assert_array_equal(np.asarray(Image.open(out)), reference_delete_black(tmp_path / "in.png"))
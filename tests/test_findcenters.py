@@ -0,0 +1,34 @@
+import numpy as np
+from PIL import Image
+import findcenters
+from pyramid import Pyramid
+
+MARKERS = [(400, 300, 250), (2700, 2200, 5), (1500, 1200, 250), (200, 2300, 5), (2900, 150, 250)]
+
+
+def marker_mosaic(path, side=40):
+    rng = np.random.default_rng(1)
+    rgba = np.full((3000, 2500, 4), (90, 100, 110, 255), np.uint8)
+    rgba[..., :3] += rng.integers(0, 20, (3000, 2500, 3), dtype=np.uint8)
+    for row, col, value in MARKERS:
+        rgba[row - side // 2:row + side // 2, col - side // 2:col + side // 2, :3] = value
+    Image.fromarray(rgba).save(path)
+    return path
+
+
+def test_centers_read_each_marker_once_top_to_bottom(tmp_path, monkeypatch):
+    path = marker_mosaic(tmp_path / "mosaic.png")
+    reads = []
+    read = Pyramid.read
+
+    def spy(self, level, row_off, rows, col_off, cols):
+        if level == 0:
+            reads.append(row_off)
+        return read(self, level, row_off, rows, col_off, cols)
+
+    monkeypatch.setattr(Pyramid, "read", spy)
+    centers = findcenters.find_centers(str(path), 40, count=5, min_contrast=10, pyramid_dir=str(tmp_path / "pyramid"))
+
+    assert [(c["row"], c["col"]) for c in centers] == sorted((row - 0.5, col - 0.5) for row, col, _ in MARKERS)
+    assert len(reads) == len(MARKERS)
+    assert reads == sorted(reads)
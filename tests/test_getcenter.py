@@ -0,0 +1,40 @@
+import sys
+import numpy as np
+import pytest
+from PIL import Image
+from rawpng import UNSTREAMABLE, make_png
+import getcenter
+from pyramid import Pyramid
+
+
+def test_opens_jpeg(tmp_path):
+    rgb = np.random.default_rng(0).integers(0, 256, (40, 60, 3), dtype=np.uint8)
+    path = tmp_path / "j.jpg"
+    Image.fromarray(rgb).save(path, quality=95, subsampling=0)
+    expected = np.asarray(Image.open(path).convert("RGBA")).astype(int)
+
+    with Pyramid(str(path), str(tmp_path / "pyramid"), fallback=True) as pyramid:
+        rgba, _, _ = pyramid.read(0, 0, pyramid.height, 0, pyramid.width)
+    assert rgba.shape == (40, 60, 4)
+    # GDAL and Pillow may round the colour conversion differently
+    assert np.abs(rgba.astype(int) - expected).max() <= 2
+
+
+@pytest.mark.parametrize("name, bit_depth, colour_type, trns", UNSTREAMABLE)
+def test_refused_pngs_fall_back_to_pillow(tmp_path, name, bit_depth, colour_type, trns):
+    path = str(make_png(tmp_path / f"{name}.png", bit_depth, colour_type, trns))
+    with pytest.raises(ValueError):
+        Pyramid(path, str(tmp_path / "strict"))
+    with Pyramid(path, str(tmp_path / "pyramid"), fallback=True) as pyramid:
+        rgba, _, _ = pyramid.read(0, 0, pyramid.height, 0, pyramid.width)
+    np.testing.assert_array_equal(rgba, np.asarray(Image.open(path).convert("RGBA")))
+
+
+def test_unreadable_file_is_a_clean_error(tmp_path, monkeypatch, capsys):
+    path = tmp_path / "notes.png"
+    path.write_text("not an image")
+    monkeypatch.setattr(sys, "argv", ["getcenter.py", "--path", str(path)])
+    with pytest.raises(SystemExit) as exit_info:
+        getcenter.main()
+    assert exit_info.value.code == 2
+    assert f"cannot open {path}" in capsys.readouterr().err
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.enums import ColorInterp
+from rasterio.transform import from_origin
+from merge import merge_geotiffs
+
+LEFT, TOP = 430000.0, 4380000.0
+
+
+def write_tile(path, data, left=LEFT, top=TOP, res=0.1, nodata=None, colorinterp=None):
+    with rasterio.open(
+        path, "w", driver="GTiff", width=data.shape[2], height=data.shape[1], count=data.shape[0],
+        dtype="uint8", nodata=nodata, crs="EPSG:25831", transform=from_origin(left, top, res, res),
+    ) as dst:
+        dst.write(data)
+        if colorinterp:
+            dst.colorinterp = colorinterp
+    return str(path)
+
+
+def merged(paths, out_path, **kwargs):
+    assert merge_geotiffs(paths, str(out_path), jobs=1, blocksize=64, **kwargs) == 0
+    with rasterio.open(out_path) as src:
+        return src.transform, np.moveaxis(src.read(), 0, -1)
+
+
+def test_uint8_output_merges_as_rgb(tmp_path):
+    # uint8.py output: NIR, red, green, blue, with nodata 0
+    data = np.empty((4, 64, 64), dtype=np.uint8)
+    data[:] = np.array([200, 10, 20, 30], dtype=np.uint8)[:, None, None]
+    data[:, :8] = 0
+    path = write_tile(
+        tmp_path / "nir.tif", data, nodata=0,
+        colorinterp=(ColorInterp.gray, ColorInterp.red, ColorInterp.green, ColorInterp.blue),
+    )
+    _, rgba = merged([path], tmp_path / "out.tif")
+    np.testing.assert_array_equal(rgba[8:64, :64], np.broadcast_to([10, 20, 30, 255], (56, 64, 4)))
+    np.testing.assert_array_equal(rgba[:8], 0)
+
+
+def test_grid_matches_input_extent(tmp_path):
+    path = write_tile(tmp_path / "a.tif", np.full((4, 64, 64), 255, dtype=np.uint8))
+    transform, rgba = merged([path], tmp_path / "out.tif")
+    assert rgba.shape == (64, 64, 4)
+    assert (transform.c, transform.f) == (LEFT, TOP)
+
+
+def overlapping_pair(tmp_path):
+    """
+    Opaque red A and blue B (alpha 200), B 32 pixels east of A. In the
+    overlap A has rows with alpha 100 and rows with alpha 0.
+    """
+    a = np.zeros((4, 64, 64), dtype=np.uint8)
+    a[0], a[3] = 255, 255
+    a[3, 16:32, 32:] = 100
+    a[3, 32:48, 32:] = 0
+    b = np.zeros((4, 64, 64), dtype=np.uint8)
+    b[2], b[3] = 255, 200
+    return write_tile(tmp_path / "a.tif", a), write_tile(tmp_path / "b.tif", b, left=LEFT + 3.2)
+
+
+RED, BLUE = [255, 0, 0], [0, 0, 255]
+
+
+def overlap_colours(rgba):
+    """Single colour of the overlap in A's opaque, alpha-100 and alpha-0 rows."""
+    colours = []
+    for rows in (slice(0, 16), slice(16, 32), slice(32, 48)):
+        unique = np.unique(rgba[rows, 32:64, :3].reshape(-1, 3), axis=0)
+        assert len(unique) == 1
+        colours.append(unique[0].tolist())
+    return colours
+
+
+@pytest.mark.parametrize("rule, expected", [
+    ("first", [RED, RED, BLUE]),
+    ("last", [BLUE, BLUE, BLUE]),
+    ("max-alpha", [RED, BLUE, BLUE]),
+])
+def test_overlap_rules(tmp_path, rule, expected):
+    _, rgba = merged(overlapping_pair(tmp_path), tmp_path / "out.tif", rule=rule)
+    assert rgba.shape == (64, 96, 4)
+    assert overlap_colours(rgba) == expected
+    # Outside the overlap each input shows alone
+    assert (rgba[:, :32, :3] == RED).all() and (rgba[:, 64:, :3] == BLUE).all()
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+import rasterio
+import rasterio.shutil
+from rasterio.transform import Affine, from_origin
+from geotiff_writer import validate_cog
+from movetif import _patch_geotiff_origin, move_geotiff, shifted_transform
+
+ORIGIN = from_origin(430000.0, 4380000.0, 0.5, 0.5)
+ROTATED = ORIGIN * Affine.rotation(12)
+
+LAYOUTS = {
+    "strip": ({}, ORIGIN),
+    "tiled": ({"tiled": True, "blockxsize": 32, "blockysize": 32, "compress": "deflate"}, ORIGIN),
+    "bigtiff": ({"BIGTIFF": "YES"}, ORIGIN),
+    "big_endian": ({"ENDIANNESS": "BIG"}, ORIGIN),
+    "rotated": ({}, ROTATED),
+    "pixel_is_point": ({"AREA_OR_POINT": "Point"}, ORIGIN),
+}
+
+
+def write_geotiff(path, transform=ORIGIN, **options):
+    data = np.random.default_rng(0).integers(0, 256, (3, 70, 90), dtype=np.uint8)
+    with rasterio.open(
+        path, "w", driver="GTiff", width=90, height=70, count=3, dtype="uint8", crs="EPSG:25831",
+        transform=transform, **options,
+    ) as dst:
+        dst.write(data)
+    return str(path), data
+
+
+def geotiff(tmp_path, layout):
+    if layout == "cog":
+        path, data = write_geotiff(tmp_path / "src.tif")
+        rasterio.shutil.copy(path, tmp_path / "cog.tif", driver="COG", blocksize=32)
+        return str(tmp_path / "cog.tif"), data
+    options, transform = LAYOUTS[layout]
+    return write_geotiff(tmp_path / f"{layout}.tif", transform, **options)
+
+
+@pytest.mark.parametrize("layout", list(LAYOUTS) + ["cog"])
+def test_patch_moves_only_the_origin(tmp_path, layout):
+    path, data = geotiff(tmp_path, layout)
+    with rasterio.open(path) as src:
+        before = src.transform
+    with open(path, "rb") as f:
+        original = f.read()
+
+    assert _patch_geotiff_origin(path, 1.5, -2.25)
+
+    with open(path, "rb") as f:
+        patched = f.read()
+    # Same file, with only the two origin doubles rewritten
+    assert len(patched) == len(original)
+    assert sum(a != b for a, b in zip(original, patched)) <= 16
+    with rasterio.open(path) as src:
+        assert src.transform.almost_equals(Affine.translation(1.5, -2.25) * before)
+        np.testing.assert_array_equal(src.read(), data)
+    if layout == "cog":
+        assert validate_cog(path) == []
+
+
+def test_patch_leaves_other_files_alone(tmp_path):
+    path = tmp_path / "not.tif"
+    path.write_bytes(b"PK\x03\x04" + bytes(60))
+    assert not _patch_geotiff_origin(str(path), 1.0, 1.0)
+    assert path.read_bytes() == b"PK\x03\x04" + bytes(60)
+
+
+@pytest.mark.parametrize("cog", [False, True])
+def test_move_copy(tmp_path, cog):
+    path, data = write_geotiff(tmp_path / "in.tif", tiled=True, blockxsize=32, blockysize=32)
+    out = str(tmp_path / "out.tif")
+    move_geotiff(path, out, north_shift=3.0, east_shift=-1.25, cog=cog)
+    with rasterio.open(out) as dst:
+        assert dst.transform.almost_equals(shifted_transform(ORIGIN, 3.0, -1.25))
+        np.testing.assert_array_equal(dst.read(), data)
+    if cog:
+        assert validate_cog(out) == []
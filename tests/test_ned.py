@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from pyproj import Transformer
+from ned import geodetic_to_ecef, ned_rotation, ned_to_geodetic
+
+ORIGIN_LAT, ORIGIN_LON = 39.578535, 2.3502617
+# ECEF (x, y, z) <-> WGS84 (lon, lat, ellipsoidal height)
+TO_GEODETIC = Transformer.from_crs("EPSG:4978", "EPSG:4979", always_xy=True)
+TO_ECEF = Transformer.from_crs("EPSG:4979", "EPSG:4978", always_xy=True)
+# Meters per degree of latitude, roughly; enough to express the errors in meters
+METERS_PER_DEGREE = 111_320.0
+
+
+def ned_offsets(n=2000, reach=5000.0):
+    rng = np.random.default_rng(0)
+    north, east = rng.uniform(-reach, reach, (2, n))
+    down = rng.uniform(-50.0, 50.0, n)
+    return north, east, down
+
+
+def test_matches_pyproj_ecef_to_geodetic():
+    north, east, down = ned_offsets()
+    lat, lon, height = ned_to_geodetic(north, east, down, ORIGIN_LAT, ORIGIN_LON)
+
+    # The same points in ECEF, converted to geodetic by PROJ
+    origin = np.array(TO_ECEF.transform(ORIGIN_LON, ORIGIN_LAT, 0.0))
+    x, y, z = origin[:, None] + ned_rotation(ORIGIN_LAT, ORIGIN_LON).T @ np.stack([north, east, down])
+    ref_lon, ref_lat, ref_height = TO_GEODETIC.transform(x, y, z)
+
+    assert np.abs(lat - ref_lat).max() * METERS_PER_DEGREE < 1e-6
+    assert np.abs(lon - ref_lon).max() * METERS_PER_DEGREE < 1e-6
+    assert np.abs(height - ref_height).max() < 1e-6
+
+
+def test_round_trips_through_pyproj():
+    north, east, down = ned_offsets()
+    lat, lon, height = ned_to_geodetic(north, east, down, ORIGIN_LAT, ORIGIN_LON)
+
+    # Back to ECEF with PROJ, and into the NED frame at the origin
+    ecef = np.array(TO_ECEF.transform(lon, lat, height))
+    origin = np.array(TO_ECEF.transform(ORIGIN_LON, ORIGIN_LAT, 0.0))
+    ned = ned_rotation(ORIGIN_LAT, ORIGIN_LON) @ (ecef - origin[:, None])
+    np.testing.assert_allclose(ned, np.stack([north, east, down]), rtol=0, atol=1e-6)
+
+
+def test_origin_and_shapes():
+    lat, lon, height = ned_to_geodetic(0.0, 0.0, 0.0, ORIGIN_LAT, ORIGIN_LON)
+    assert (float(lat), float(lon), float(height)) == pytest.approx((ORIGIN_LAT, ORIGIN_LON, 0.0), abs=1e-9)
+    np.testing.assert_allclose(
+        geodetic_to_ecef(ORIGIN_LAT, ORIGIN_LON), TO_ECEF.transform(ORIGIN_LON, ORIGIN_LAT, 0.0)
+    )
+
+    lat, _, _ = ned_to_geodetic(np.zeros((3, 4)), np.arange(4.0), 0.0, ORIGIN_LAT, ORIGIN_LON)
+    assert lat.shape == (3, 4)
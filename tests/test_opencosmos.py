@@ -0,0 +1,59 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from benchmark import median_wall_ms
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+HEAVY = ("rasterio", "pyproj", "matplotlib")
+
+# Runs opencosmos <command> --help in a fresh interpreter and reports which heavy modules it loaded
+PROBE = f"""
+import json, sys
+sys.path.insert(0, {SCRIPTS!r})
+import opencosmos
+try:
+    opencosmos.main(sys.argv[1:])
+except SystemExit:
+    pass
+print(json.dumps(sorted(name for name in {HEAVY!r} if name in sys.modules)))
+"""
+
+
+LIGHT_COMMANDS = ["compare-pngs", "deleteblack", "rotate", "rotate-folder", "findcenters", "png2geotiff"]
+COLD_START_ROUNDS = 5
+
+
+@pytest.mark.parametrize("command", LIGHT_COMMANDS)
+def test_help_does_not_import_heavy_dependencies(command):
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE, command, "--help"], capture_output=True, text=True, check=True
+    )
+    usage, _, loaded = result.stdout.rstrip().rpartition("\n")
+    assert f"usage: opencosmos {command}" in usage
+    assert json.loads(loaded) == []
+
+
+def test_listing_commands_imports_no_script():
+    result = subprocess.run([sys.executable, "-c", PROBE], capture_output=True, text=True, check=True)
+    assert "commands:" in result.stdout
+    assert json.loads(result.stdout.rstrip().rpartition("\n")[2]) == []
+
+
+def test_cold_start_beats_loading_heavy_dependencies():
+    # What every script loaded at startup before the entry point; relative, so machine speed cancels out
+    commands = {"eager imports": [sys.executable, "-c", "import numpy, PIL.Image, rasterio, pyproj"]}
+    entry = os.path.join(SCRIPTS, "opencosmos.py")
+    commands.update({command: [sys.executable, entry, command, "--help"] for command in LIGHT_COMMANDS})
+
+    # Interleaved rounds after a warm-up, keeping each command's fastest run, so load spikes hit all alike
+    times = {name: [] for name in commands}
+    for round_ in range(COLD_START_ROUNDS + 1):
+        for name, cmd in commands.items():
+            ms = median_wall_ms(cmd, runs=1)
+            if round_:
+                times[name].append(ms)
+    eager = min(times.pop("eager imports"))
+    slow = {command: round(min(ms)) for command, ms in times.items() if min(ms) >= eager}
+    assert not slow, f"cold start at or above the {eager:.0f} ms of the eager imports: {slow}"
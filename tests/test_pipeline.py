@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+import yaml
+from PIL import Image
+from pipeline import output_transform, run_pipeline
+from png2geotiff import get_world_from_hm_yaml_utm, transform_from_two_points
+
+
+def write_hm(path, north, east):
+    with open(path, "w") as f:
+        yaml.safe_dump({"HM": {"data": [1, 0, north, 0, 1, east, 0, 0, 1]}}, f)
+    return str(path)
+
+
+@pytest.mark.parametrize("crs", ["EPSG:25831", "EPSG:3857"])
+def test_hm_georeference_uses_output_crs(tmp_path, crs):
+    geo = {
+        "crs": crs,
+        "yaml1": write_hm(tmp_path / "hm1.yaml", 10.0, -20.0),
+        "yaml2": write_hm(tmp_path / "hm2.yaml", -150.0, 230.0),
+        "pixel1": [100, 50],
+        "pixel2": [900, 1200],
+        "ned_origin_lat": 39.578535,
+        "ned_origin_lon": 2.3502617,
+    }
+    transform, out_crs = output_transform(geo, None, rotated=False)
+
+    maps = [get_world_from_hm_yaml_utm(geo[key], geo["ned_origin_lat"], geo["ned_origin_lon"], crs)
+            for key in ("yaml1", "yaml2")]
+    expected = transform_from_two_points(tuple(geo["pixel1"]), maps[0], tuple(geo["pixel2"]), maps[1])
+    assert out_crs.to_string() == crs
+    assert transform.almost_equals(expected)
+
+
+def test_uint8_stage_rejects_8_bit_input(tmp_path):
+    Image.fromarray(np.full((8, 8, 4), 200, dtype=np.uint8), "RGBA").save(tmp_path / "mosaic.png")
+    config = tmp_path / "pipeline.yaml"
+    with open(config, "w") as f:
+        yaml.safe_dump({"input": "mosaic.png", "stages": ["deleteblack", "uint8"], "output": "out.png"}, f)
+    with pytest.raises(ValueError, match="Stage 'uint8' needs 16-bit input"):
+        run_pipeline(str(config))
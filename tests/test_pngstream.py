@@ -0,0 +1,78 @@
+import struct
+import zlib
+import numpy as np
+import pytest
+from PIL import Image
+from rawpng import STREAMABLE, UNSTREAMABLE, make_png
+from decodecache import DecodedCache
+from pngstream import PngBandReader, PngBandWriter, iter_bands, unstreamable_reason
+from compare_pngs import compare_all_pngs_in_folder
+
+@pytest.mark.parametrize("name, bit_depth, colour_type, trns", STREAMABLE)
+def test_reader_matches_pillow(tmp_path, name, bit_depth, colour_type, trns):
+    path = make_png(tmp_path / f"{name}.png", bit_depth, colour_type, trns)
+    expected = np.asarray(Image.open(path).convert("RGBA"))
+
+    assert unstreamable_reason(path) is None
+    with PngBandReader(str(path)) as reader:
+        np.testing.assert_array_equal(reader.read_rgba(0, reader.height), expected)
+        np.testing.assert_array_equal(reader.read_rgba(2, 5, 3, 7), expected[2:7, 3:10])
+
+
+@pytest.mark.parametrize("name, bit_depth, colour_type, trns", UNSTREAMABLE)
+def test_reader_refuses_what_it_cannot_reproduce(tmp_path, name, bit_depth, colour_type, trns):
+    path = make_png(tmp_path / f"{name}.png", bit_depth, colour_type, trns)
+
+    assert unstreamable_reason(path) is not None
+    with pytest.raises(ValueError, match="cannot be streamed"):
+        PngBandReader(str(path))
+
+
+@pytest.mark.parametrize("name, bit_depth, colour_type, trns", UNSTREAMABLE)
+def test_cache_decodes_unstreamable_like_pillow(tmp_path, name, bit_depth, colour_type, trns):
+    path = make_png(tmp_path / f"{name}.png", bit_depth, colour_type, trns)
+    cached = DecodedCache(str(tmp_path / "cache")).open(str(path))
+    np.testing.assert_array_equal(cached, np.asarray(Image.open(path).convert("RGBA")))
+
+
+def test_streamed_compare_refuses_before_writing(tmp_path):
+    make_png(tmp_path / "mosaic_a.png", 8, 6, None, seed=1)
+    make_png(tmp_path / "mosaic_b.png", 16, 6, None, seed=2)
+    before = {p.name: p.read_bytes() for p in tmp_path.iterdir()}
+
+    with pytest.raises(ValueError, match="mosaic_b.png has 16-bit samples"):
+        compare_all_pngs_in_folder(str(tmp_path), max_memory=1 << 20)
+    assert {p.name: p.read_bytes() for p in tmp_path.iterdir()} == before
+
+
+def idat_stream(path):
+    """The PNG's concatenated IDAT data, i.e. its zlib stream."""
+    with open(path, "rb") as f:
+        data = f.read()
+    pos, idat = 8, b""
+    while pos < len(data):
+        length, tag = struct.unpack(">I4s", data[pos:pos + 8])
+        if tag == b"IDAT":
+            idat += data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+    return idat
+
+
+@pytest.mark.parametrize("threads", range(3, 9))
+@pytest.mark.parametrize("width, height, band_rows", [(1, 1, 1), (513, 777, 97), (3000, 900, 300)])
+def test_threaded_writer_round_trips_through_pillow(tmp_path, threads, width, height, band_rows):
+    rng = np.random.default_rng(threads)
+    # Noise over a gradient, so bands hold both incompressible and repetitive runs
+    rgba = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    rgba[:, : width // 2] = (np.arange(width // 2) % 256)[None, :, None]
+    path = str(tmp_path / "out.png")
+    writer = PngBandWriter(path, width, height, threads=threads)
+    for row_off, rows in iter_bands(height, band_rows):
+        writer.write(rgba[row_off:row_off + rows])
+    writer.close()
+
+    with Image.open(path) as img:
+        assert img.mode == "RGBA"
+        np.testing.assert_array_equal(np.asarray(img), rgba)
+    # zlib checks the Adler-32 of the joined chunks, which Pillow does not
+    assert len(zlib.decompress(idat_stream(path))) == height * (width * 4 + 1)
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.enums import ColorInterp
+from rasterio.transform import from_origin
+from decodecache import DecodedCache, open_band_reader
+from rasterbands import RasterBandReader
+
+NIR, RED, GREEN, BLUE = 200, 10, 20, 30
+
+
+def write_geotiff(path, data, nodata=None, colorinterp=None, **options):
+    with rasterio.open(
+        path, "w", driver="GTiff", width=data.shape[2], height=data.shape[1], count=data.shape[0],
+        dtype=data.dtype, nodata=nodata, crs="EPSG:25831", transform=from_origin(430000, 4380000, 0.5, 0.5),
+        **options,
+    ) as dst:
+        dst.write(data)
+        if colorinterp:
+            dst.colorinterp = colorinterp
+    return str(path)
+
+
+def nir_rgb(path):
+    """A uint8.py style output: NIR, red, green, blue with nodata 0 in the top rows."""
+    data = np.empty((4, 12, 16), dtype=np.uint8)
+    data[:] = np.array([NIR, RED, GREEN, BLUE], dtype=np.uint8)[:, None, None]
+    data[:, :3] = 0
+    colorinterp = (ColorInterp.gray, ColorInterp.red, ColorInterp.green, ColorInterp.blue)
+    return write_geotiff(path, data, nodata=0, colorinterp=colorinterp)
+
+
+def test_bands_are_picked_by_colour_interpretation(tmp_path):
+    with RasterBandReader(nir_rgb(tmp_path / "nir.tif")) as reader:
+        rgba = reader.read_rgba(0, reader.height)
+    np.testing.assert_array_equal(rgba[3:], np.broadcast_to([RED, GREEN, BLUE, 255], (9, 16, 4)))
+    np.testing.assert_array_equal(rgba[:3], 0)
+
+
+def test_alpha_band_and_grayscale(tmp_path):
+    rng = np.random.default_rng(0)
+    rgba = rng.integers(0, 256, (4, 12, 16), dtype=np.uint8)
+    path = write_geotiff(tmp_path / "rgba.tif", rgba)
+    with open_band_reader(path) as reader:
+        np.testing.assert_array_equal(reader.read_rgba(2, 5, 3, 7), np.moveaxis(rgba, 0, -1)[2:7, 3:10])
+
+    gray = rgba[:1]
+    path = write_geotiff(tmp_path / "gray.tif", gray)
+    with open_band_reader(path) as reader:
+        out = reader.read_rgba(0, reader.height)
+    np.testing.assert_array_equal(out[..., :3], np.repeat(gray[0][..., None], 3, axis=-1))
+    assert (out[..., 3] == 255).all()
+
+
+def test_cache_matches_direct_read(tmp_path):
+    path = nir_rgb(tmp_path / "nir.tif")
+    with open_band_reader(path) as reader:
+        expected = reader.read_rgba(0, reader.height)
+    with open_band_reader(path, DecodedCache(tmp_path / "cache")) as reader:
+        np.testing.assert_array_equal(reader.read_rgba(0, reader.height), expected)
+
+
+def test_refuses_16_bit(tmp_path):
+    path = write_geotiff(tmp_path / "u16.tif", np.zeros((3, 4, 4), dtype=np.uint16))
+    with pytest.raises(ValueError, match="not 8-bit"):
+        open_band_reader(path)
@@ -0,0 +1,99 @@
+import sys
+import numpy as np
+import pytest
+import rasterio
+from PIL import Image
+from rasterio.transform import Affine, from_origin
+import rotate
+from decodecache import DecodedCache
+from rotation import OPERATIONS, TRANSPOSES, pixel_transform, rotate_in_memory, rotate_png
+
+ORIGIN = from_origin(430000.0, 4380000.0, 0.5, 0.5)
+
+
+def write_png(path, width=37, height=23):
+    rgba = np.random.default_rng(0).integers(0, 256, (height, width, 4), dtype=np.uint8)
+    Image.fromarray(rgba, "RGBA").save(path)
+    return str(path)
+
+
+def expected(path, operation):
+    with Image.open(path) as img:
+        return np.asarray(img.transpose(TRANSPOSES[operation]))
+
+
+@pytest.mark.parametrize("operation", OPERATIONS)
+def test_rotate_png_matches_transpose(tmp_path, operation):
+    path = write_png(tmp_path / "mosaic.png")
+    # A few rows per band, so every operation runs over several strips
+    out = rotate_png(path, str(tmp_path / "out.png"), operation, max_memory=2000)
+    with Image.open(out) as img:
+        np.testing.assert_array_equal(np.asarray(img), expected(path, operation))
+
+    cached = rotate_png(path, str(tmp_path / "cached.png"), operation, 2000, DecodedCache(tmp_path / "cache"))
+    with Image.open(cached) as img:
+        np.testing.assert_array_equal(np.asarray(img), expected(path, operation))
+
+    with Image.open(path) as img:
+        np.testing.assert_array_equal(np.asarray(rotate_in_memory(img, operation)), expected(path, operation))
+
+
+@pytest.mark.parametrize("operation", OPERATIONS)
+def test_pixel_transform_follows_transpose(operation):
+    width, height = 7, 4
+    index = np.arange(width * height, dtype=np.int32).reshape(height, width)
+    rotated = np.asarray(Image.fromarray(index, "I").transpose(TRANSPOSES[operation]))
+    to_rotated = Affine(*pixel_transform(width, height, operation))
+    for row in range(height):
+        for col in range(width):
+            x, y = to_rotated * (col + 0.5, row + 0.5)
+            assert rotated[int(y), int(x)] == index[row, col]
+
+
+def write_geotiff(path):
+    data = np.random.default_rng(1).integers(0, 65535, (5, 23, 37), dtype=np.uint16)
+    with rasterio.open(
+        path, "w", driver="GTiff", width=37, height=23, count=5, dtype="uint16", nodata=0, crs="EPSG:25831",
+        transform=ORIGIN,
+    ) as dst:
+        dst.write(data)
+        dst.set_band_description(2, "red")
+    return str(path), data
+
+
+def run_rotate(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["rotate.py", *args])
+    rotate.main()
+
+
+@pytest.mark.parametrize("operation", OPERATIONS)
+def test_geotiff_pixels_land_where_the_geotransform_rotation_does(tmp_path, monkeypatch, operation):
+    path, data = write_geotiff(tmp_path / "mosaic.tif")
+    moved = rotate.rotate_geotiff(path, str(tmp_path / "moved.tif"), operation)
+    run_rotate(monkeypatch, "--input", path, "--rotation", operation, "--pixels", "--max-memory", "2000")
+
+    with rasterio.open(tmp_path / "mosaic_rotated.tif") as src:
+        out = src.read()
+        assert src.transform == ORIGIN
+        assert src.crs == "EPSG:25831"
+        assert src.nodata == 0
+        assert src.descriptions[1] == "red"
+        out_transform = src.transform
+    for band in range(data.shape[0]):
+        band_img = Image.fromarray(data[band].astype(np.int32), "I")
+        np.testing.assert_array_equal(out[band], np.asarray(band_img.transpose(TRANSPOSES[operation])))
+
+    # Every source pixel is at the same map position in both outputs
+    with rasterio.open(moved) as src:
+        np.testing.assert_array_equal(src.read(), data)
+        moved_transform = src.transform
+    for row, col in [(0, 0), (5, 30), (22, 36)]:
+        x, y = moved_transform * (col + 0.5, row + 0.5)
+        out_col, out_row = ~out_transform * (x, y)
+        np.testing.assert_array_equal(out[:, int(out_row), int(out_col)], data[:, row, col])
+
+
+def test_pixels_flag_needs_a_geotiff(tmp_path, monkeypatch):
+    path = write_png(tmp_path / "mosaic.png")
+    with pytest.raises(SystemExit):
+        run_rotate(monkeypatch, "--input", path, "--pixels")
@@ -0,0 +1,52 @@
+import numpy as np
+import rasterio
+from PIL import Image
+from rasterio.enums import ColorInterp
+from rasterio.transform import from_bounds
+from pyramid import downsample as box_downsample
+from tiles import (
+    TILE_SIZE, WEB_MERCATOR, build_parent_tiles, downsample, render_tiles, save_tile, tile_bounds,
+    tile_path,
+)
+
+ZOOM, X, Y = 21, 1062000, 782000
+
+
+def test_tile_shows_red_green_blue_of_uint8_output(tmp_path):
+    # uint8.py output: NIR, red, green, blue, covering exactly one tile
+    data = np.empty((4, TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+    data[:] = np.array([200, 10, 20, 30], dtype=np.uint8)[:, None, None]
+    path = str(tmp_path / "nir.tif")
+    with rasterio.open(
+        path, "w", driver="GTiff", width=TILE_SIZE, height=TILE_SIZE, count=4, dtype="uint8", nodata=0,
+        crs=WEB_MERCATOR, transform=from_bounds(*tile_bounds(X, Y, ZOOM), TILE_SIZE, TILE_SIZE),
+    ) as dst:
+        dst.write(data)
+        dst.colorinterp = (ColorInterp.gray, ColorInterp.red, ColorInterp.green, ColorInterp.blue)
+
+    out_dir = str(tmp_path / "tiles")
+    assert render_tiles(path, ZOOM, [(X, Y)], out_dir, "png", "xyz", "nearest") == (1, 0)
+    tile = np.asarray(Image.open(tile_path(out_dir, ZOOM, X, Y, "png")).convert("RGBA"))
+    assert (tile == [10, 20, 30, 255]).all()
+
+
+def test_opaque_downsample_is_the_box_average():
+    rgba = np.random.default_rng(0).integers(0, 256, (64, 48, 4), dtype=np.uint8)
+    rgba[..., 3] = 255
+    np.testing.assert_array_equal(downsample(rgba), box_downsample(rgba))
+
+
+def test_parent_tiles_have_no_dark_fringe(tmp_path):
+    # A child whose left 101 columns are transparent and the rest opaque white
+    child = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    child[:, 101:] = 255
+    out_dir = str(tmp_path / "tiles")
+    save_tile(child, tile_path(out_dir, ZOOM, 2 * X, 2 * Y, "png"), "png")
+
+    assert build_parent_tiles(ZOOM - 1, [(X, Y)], out_dir, "png", "xyz") == (1, 0)
+    parent = np.asarray(Image.open(tile_path(out_dir, ZOOM - 1, X, Y, "png")).convert("RGBA"))
+    quarter = parent[:TILE_SIZE // 2, :TILE_SIZE // 2]
+    # The edge pixel averages two transparent and two white pixels
+    assert quarter[0, 50].tolist() == [255, 255, 255, 128]
+    assert (quarter[:, 51:] == 255).all()
+    assert (quarter[:, :50, 3] == 0).all()
@@ -0,0 +1,99 @@
+import sys
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+import uint8
+from uint8 import LUT, band_histograms, convert_block, convert_to_uint8, histogram_windows
+
+
+def write_geotiff(path, data, nodata=None, **layout):
+    with rasterio.open(
+        path, "w", driver="GTiff", width=data.shape[2], height=data.shape[1], count=data.shape[0],
+        dtype=data.dtype, nodata=nodata, crs="EPSG:25831", transform=from_origin(430000, 4380000, 0.5, 0.5),
+        **layout,
+    ) as dst:
+        dst.write(data)
+    return str(path)
+
+
+def random_bands(dtype, seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.integers(0, np.iinfo(dtype).max, (3, 300, 500), dtype=dtype, endpoint=True)
+    data[:, :40] = 7
+    return data
+
+
+LAYOUTS = [{}, {"tiled": True, "blockxsize": 64, "blockysize": 32}]
+
+
+def baseline_rule(data, nodata=None):
+    """The original per-pixel float32 conversion of uint8.py."""
+    data_float = data.astype(np.float32)
+    data_float[data_float < 256] = 0
+    data_uint8 = np.clip((data_float / 65535) * 255, 0, 255).astype(np.uint8)
+    if nodata is not None:
+        for b in range(data.shape[0]):
+            data_uint8[b][data[b] == nodata] = 0
+    return data_uint8
+
+
+def test_lut_matches_float_rule_for_every_value():
+    values = np.arange(65536, dtype=np.uint16)
+    np.testing.assert_array_equal(LUT, baseline_rule(values[None])[0])
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+@pytest.mark.parametrize("nodata", [None, 0, 7])
+def test_convert_block_matches_float_rule(dtype, nodata):
+    data = random_bands(dtype)
+    np.testing.assert_array_equal(convert_block(data, nodata), baseline_rule(data, nodata))
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+@pytest.mark.parametrize("cog", [False, True])
+@pytest.mark.parametrize("nodata", [None, 7])
+def test_conversion_is_bit_identical_to_float_rule(tmp_path, layout, cog, nodata):
+    data = random_bands(np.uint16)
+    path = write_geotiff(tmp_path / "in.tif", data, nodata, **layout)
+    for num_threads in (1, 3):
+        convert_to_uint8(path, num_threads, cog)
+        with rasterio.open(tmp_path / "in_uint8.tif") as src:
+            assert src.dtypes == ("uint8",) * 3
+            np.testing.assert_array_equal(src.read(), baseline_rule(data, nodata))
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+@pytest.mark.parametrize("nodata", [None, 0, 7])
+def test_histograms_match_full_read(tmp_path, layout, dtype, nodata):
+    data = random_bands(dtype)
+    path = write_geotiff(tmp_path / "in.tif", data, nodata, **layout)
+    expected = np.stack([np.bincount(band[band != nodata], minlength=65536) for band in data])
+    for num_threads in (1, 3):
+        np.testing.assert_array_equal(band_histograms(path, num_threads), expected)
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+@pytest.mark.parametrize("target_bytes", [1, 5000, 100000, 10 ** 9])
+def test_histogram_windows_tile_the_raster(tmp_path, layout, target_bytes):
+    path = write_geotiff(tmp_path / "in.tif", random_bands(np.uint16), **layout)
+    with rasterio.open(path) as src:
+        covered = np.zeros((src.height, src.width), dtype=np.int64)
+        block_rows, block_cols = src.block_shapes[0]
+        for window in histogram_windows(src, target_bytes):
+            covered[window.toslices()] += 1
+            assert window.row_off % block_rows == 0 and window.col_off % block_cols == 0
+    assert (covered == 1).all()
+
+
+@pytest.mark.parametrize("percentiles", [("98", "2"), ("5", "5"), ("-1", "98"), ("2", "100.5"), ("nan", "98")])
+def test_percentiles_are_validated(tmp_path, monkeypatch, capsys, percentiles):
+    monkeypatch.setattr(
+        sys, "argv",
+        ["uint8.py", "--path_in", str(tmp_path / "missing.tif"), "--stretch", "percentile", "--percentiles", *percentiles],
+    )
+    with pytest.raises(SystemExit) as exc:
+        uint8.main()
+    assert exc.value.code == 2
+    assert "0 <= LOW < HIGH <= 100" in capsys.readouterr().err